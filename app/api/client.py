@@ -0,0 +1,225 @@
+import io
+import json
+import random
+import time
+import uuid
+from typing import BinaryIO, Callable, Iterator, Optional
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+from config import config
+
+RETRY_STATUSES = {502, 503, 504}
+MJPEG_HEADER_END = b"\r\n\r\n"
+
+
+class MultipartUpload:
+    """A multipart/form-data body with one file field, read from the file while it is sent.
+
+    The body has a known length, so it is sent with a Content-Length header and
+    the API can reject an oversized upload before receiving it, but the file is
+    never copied into memory.
+
+    Attributes:
+        content_type : value of the Content-Type header, boundary included
+
+    Methods:
+        read() : Read the next bytes of the body.
+        rewind() : Restart the body from the beginning, to send it again.
+    """
+    def __init__(self, field: str, file: BinaryIO, filename: str, content_type: str = "application/octet-stream"):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._head = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode("utf-8")
+        self._tail = f"\r\n--{boundary}--\r\n".encode("ascii")
+        self._file = file
+        self._start = file.tell()
+        self._size = file.seek(0, io.SEEK_END) - self._start
+        self.rewind()
+
+    def __len__(self) -> int:
+        return len(self._head) + self._size + len(self._tail)
+
+    def rewind(self) -> None:
+        self._file.seek(self._start)
+        self._parts = [io.BytesIO(self._head), self._file, io.BytesIO(self._tail)]
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = []
+        while self._parts and size != 0:
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b"".join(chunks)
+
+
+class ApiClient:
+    """A client of the CV API sharing one pool of keep-alive connections.
+
+    Requests that fail to connect, time out while connecting or get a
+    502/503/504 are retried with exponential backoff and jitter. Uploads are
+    retried only when their file can be rewound. Results of videos and camera
+    streams are consumed while they arrive rather than after the response
+    ends.
+
+    The underlying requests.Session is shared by all Streamlit sessions
+    through `get_client()`; it only holds the connection pool, no per-user
+    state.
+
+    Attributes:
+        base_url : address of the API
+        timeout : (connect, read) timeouts in seconds
+        retries : number of retries of a failed request
+        backoff : delay in seconds before the first retry, doubled at each retry
+
+    Methods:
+        url() : Build the URL of a route of the cv router.
+        set_config() : Set the model configuration.
+        infer_image() : Run the model on an image.
+        infer_video() : Run the model on a video, yielding the result of each sampled frame.
+        mjpeg_frames() : Yield the annotated JPEG frames of a camera stream.
+        close() : Close the pooled connections.
+    """
+    def __init__(self, base_url: str, timeout: tuple = (3.05, 60), retries: int = 3, backoff: float = 0.5,
+                 pool_size: int = 10):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def url(self, *parts: str) -> str:
+        return "/".join((self.base_url, "cv", *parts))
+
+    def _backoff(self, attempt: int) -> float:
+        """Return the delay before a retry, exponential with jitter."""
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.0)
+
+    def _request(self, method: str, path: str, rewind: Optional[Callable[[], None]] = None,
+                 retry: bool = True, **kwargs) -> requests.Response:
+        """Send a request, retrying transient failures.
+
+        Args:
+            method: HTTP method.
+            path: Route of the cv router.
+            rewind: Restarts the request body before a retry, for streamed bodies.
+            retry: False sends the request only once.
+            **kwargs: Arguments of requests.Session.request.
+
+        Returns:
+            The successful response.
+
+        Raises:
+            requests.RequestException: If the request failed after the retries or
+                the API answered with an error status.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        attempts = self.retries + 1 if retry else 1
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            try:
+                response = self.session.request(method, self.url(path), **kwargs)
+            except requests.ConnectionError:
+                if last:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or last:
+                    response.raise_for_status()
+                    return response
+                response.close()
+            time.sleep(self._backoff(attempt))
+            if rewind is not None:
+                rewind()
+
+    def set_config(self, model_config: Optional[dict]) -> dict:
+        """Set the model configuration.
+
+        Returns:
+            The info message and the applied configuration.
+        """
+        return self._request("POST", "set_config/", json=model_config).json()
+
+    def infer_image(self, file: BinaryIO, filename: str = "image", content_type: str = "image/jpeg") -> dict:
+        """Run the model on an image, streaming the upload from the file.
+
+        Returns:
+            The decoded JSON results.
+        """
+        body = MultipartUpload("file", file, filename, content_type)
+        return self._request("POST", "infer_image", rewind=body.rewind, data=body,
+                             headers={"Content-Type": body.content_type}).json()
+
+    def infer_video(self, file: BinaryIO, filename: str = "video", **params) -> Iterator[dict]:
+        """Run the model on a video, uploaded as the raw request body.
+
+        Args:
+            file: The video file, read while it is sent.
+            filename: Name of the video, sent in the X-Filename header.
+            **params: Sampling query parameters of the route (mode, stride, interval, max_frames, format).
+
+        Yields:
+            The results of each sampled frame, as soon as the API sends them.
+        """
+        start = file.tell()
+        rewind = (lambda: file.seek(start)) if file.seekable() else None
+        response = self._request("POST", "infer_video", rewind=rewind, retry=rewind is not None, data=file,
+                                 params=params, headers={"X-Filename": filename,
+                                                         "Content-Type": "application/octet-stream"},
+                                 stream=True)
+        with response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def mjpeg_frames(self, camera: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Read the annotated MJPEG stream of a camera.
+
+        Yields:
+            The JPEG bytes of each frame, as soon as it is complete.
+        """
+        response = self._request("GET", f"{camera}/infer_stream", stream=True)
+        with response:
+            buffer = bytearray()
+            for chunk in response.iter_content(chunk_size):
+                buffer += chunk
+                while True:
+                    end = buffer.find(MJPEG_HEADER_END)
+                    if end < 0:
+                        break
+                    headers = dict(line.split(b":", 1) for line in bytes(buffer[:end]).splitlines()
+                                   if b":" in line)
+                    length = int(headers[b"Content-Length"])
+                    start = end + len(MJPEG_HEADER_END)
+                    if len(buffer) < start + length:
+                        break
+                    yield bytes(buffer[start:start + length])
+                    del buffer[:start + length]
+
+    def close(self) -> None:
+        self.session.close()
+
+
+@st.cache_resource
+def get_client() -> ApiClient:
+    """Return the ApiClient shared by all sessions of the app."""
+    return ApiClient(
+        config.API_ADDRESS,
+        timeout=(config.API_CONNECT_TIMEOUT, config.API_READ_TIMEOUT),
+        retries=config.API_RETRIES,
+        backoff=config.API_BACKOFF,
+        pool_size=config.API_POOL_SIZE,
+    )
@@ -5,8 +5,11 @@ from typing import BinaryIO, Tuple, Optional
 import streamlit as st
 import streamlit.components.v1 as components
 
+from api.client import get_client
 from config import config
-from stream.stream_capture import StreamCapture
+from stream.hub import capture_hub
+from stream.preview import preview_cache
+from stream.stream_capture import StreamHealth
 
 
 def show_message(message: str, message_type: str, section: st.container) -> None:
@@ -44,7 +47,10 @@ def show_source(section: st.container, source_type: str, uploaded_file: BinaryIO
         None
 
     Note:
-        This function uses the StreamCapture class to capture frames from a camera stream.
+        This function subscribes to the camera stream through the shared capture hub, so
+        several viewers of one camera share a single decoder. Frames are downsampled to
+        `config.PREVIEW_WIDTH` and encoded once for all viewers, and shown at most
+        `config.PREVIEW_MAX_FPS` times per second.
     """
     if uploaded_file or selected_camera:
         with section.container():
@@ -61,22 +67,42 @@ def show_source(section: st.container, source_type: str, uploaded_file: BinaryIO
                 rtsp_url = f"rtsp://{username}:{password}@{addr}:{rtsp_port}/{endpoint}"
 
                 stframe = st.empty()
-                stream = StreamCapture(rtsp_url)
-                if st.button("Stop"):
-                    stream.stop()
-
-                while True:
-                    frame = stream.read()
-                    
-                    if frame is None:
-                        st.write("Error with rtsp")
-                        break
-
-                    stframe.image(frame, use_column_width="always")
+                ststatus = st.empty()
+                st.session_state["preview_url"] = rtsp_url
+                frame_interval = 1. / config.PREVIEW_MAX_FPS
+                with capture_hub.subscribe(rtsp_url) as stream:
+                    if st.button("Stop"):
+                        return
+
+                    last_seq = 0
+                    next_frame = time.monotonic()
+                    while True:
+                        # frames decoded while waiting are skipped, only the newest one is shown
+                        time.sleep(max(0., next_frame - time.monotonic()))
+                        captured = stream.read(timeout=stream.capture.reset_delay)
+                        
+                        if stream.health == StreamHealth.dead:
+                            st.write("Error with rtsp")
+                            break
+
+                        if stream.health == StreamHealth.degraded:
+                            ststatus.warning(
+                                f"Reconnecting, last frame {stream.seconds_since_last_frame():.0f}s ago")
+                        else:
+                            ststatus.empty()
+
+                        if captured is not None and captured.seq != last_seq:
+                            last_seq = captured.seq
+                            next_frame = time.monotonic() + frame_interval
+                            preview = preview_cache.get(rtsp_url, stream.capture, captured, config.PREVIEW_WIDTH)
+                            stframe.image(preview, use_column_width="always")
 
 def clear_section(section: st.container) -> None:
     """Clear a section in Streamlit.
 
+    A camera previewed in the section stops being decoded right away if no
+    other session watches it.
+
     Args:
         section: The section to be cleared.
 
@@ -84,6 +110,9 @@ def clear_section(section: st.container) -> None:
         None
     """
     section.empty()
+    rtsp_url = st.session_state.pop("preview_url", None)
+    if rtsp_url is not None:
+        capture_hub.suspend(rtsp_url)
 
 def assign_task(selected_source: str, uploaded_file: BinaryIO, selected_camera: str, info_container: st.container, results_expander: st.expander, history_expander:st.expander) -> None:
     """Assign a task based on the selected source.
@@ -105,39 +134,43 @@ def assign_task(selected_source: str, uploaded_file: BinaryIO, selected_camera:
         else:
             show_message("Model is running", "success", info_container)
 
-            response = requests.post(
-                f"cv/{config.API_ADDRESS}/infer_image",
-                files={"file": uploaded_file},
-            )
-
-            if response.status_code == 200:
+            uploaded_file.seek(0)
+            try:
+                results = get_client().infer_image(uploaded_file, uploaded_file.name, uploaded_file.type)
+            except requests.RequestException as e:
+                show_message(f"Error while running the model: {e}", "error", info_container)
+            else:
                 with results_expander:
                     results_table, results_image = results_expander.columns(2)
 
-                    results_table.json(response.json())
+                    results_table.json(results)
                     results_image.image(
                             uploaded_file, use_column_width="always")
-            else:
-                print("error")
     elif selected_source == "Video":
         if uploaded_file is None:
             show_message("You haven't uploaded a video", "error", info_container)
         else:
             show_message("Model is running", "success", info_container)
-            
-            response = requests.post(
-                f"cv/{config.API_ADDRESS}/infer_video",
-                files={"video": uploaded_file},
-            )
 
-            # TODO: handle video response
+            with results_expander:
+                progress = st.empty()
+                latest = st.empty()
+            uploaded_file.seek(0)
+            try:
+                # results arrive frame by frame while the rest of the video is processed
+                for processed, frame_results in enumerate(
+                        get_client().infer_video(uploaded_file, uploaded_file.name), 1):
+                    progress.write(f"Processed frames: {processed}")
+                    latest.json(frame_results)
+            except requests.RequestException as e:
+                show_message(f"Error while running the model: {e}", "error", info_container)
     elif selected_source == "Stream":
         if selected_camera == "":
             show_message("You haven't selected a camera stream", "error", info_container)
         else:
             show_message("Model is running", "success", info_container)
 
-            url = f"cv/{config.API_ADDRESS}/{selected_camera}/infer_stream"
+            url = get_client().url(selected_camera, "infer_stream")
             with results_expander:
                 # results_table, results_image = results_expander.columns(2)
                 components.html(
@@ -181,18 +214,15 @@ def save_parameters(selected_model: str, classes_to_include: list, confidence_th
             # TODO: handle model parameters and create custom_config
             pass
 
-        response = requests.post(
-            f"cv/{config.API_ADDRESS}/set_config",
-            json=custom_config,
-        )
-
-        if response.status_code == 200:
+        try:
+            response = get_client().set_config(custom_config)
+        except requests.RequestException:
+            show_message("Error while configuring the model", "error", info_container)
+        else:
             show_message("Model has been successfully configured", "success", info_container)
 
-            print(response.json()["info"])
-            print(response.json()["config"])
-        else:
-            show_message("Error while configuring the model", "error", info_container)
+            print(response["info"])
+            print(response["config"])
 
 def setup_sidebar() -> None:
     """Setup the sidebar for model parameters selection in Streamlit."""
@@ -4,6 +4,15 @@ import os
 PROJECT_NAME = "Template"
 API_ADDRESS = "http://localhost:8001"
 
+# requests to the API share a pool of API_POOL_SIZE keep-alive connections;
+# failed connections and 502/503/504 answers are retried API_RETRIES times,
+# after API_BACKOFF seconds doubled at each retry
+API_CONNECT_TIMEOUT = 3.05
+API_READ_TIMEOUT = 60
+API_RETRIES = 3
+API_BACKOFF = 0.5
+API_POOL_SIZE = 10
+
 COLORS = {
     "red": (0, 0, 255),
     "green": (0, 255, 0),
@@ -51,6 +60,12 @@ MODELS = {
 
 DEFAULT_CONFIG = MODELS["model_id"]
 
+# live previews are downsampled to PREVIEW_WIDTH pixels and shown at most
+# PREVIEW_MAX_FPS times per second, whatever the camera frame rate
+PREVIEW_WIDTH = 640
+PREVIEW_MAX_FPS = 10
+PREVIEW_QUALITY = 80
+
 RTSP_PORT = 554
 ENDPOINT = "live"
 
@@ -0,0 +1,183 @@
+import threading
+from typing import Dict, Optional
+
+from stream.stream_capture import CapturedFrame, StreamCapture, StreamHealth
+
+
+class StreamSubscriber:
+    """A lightweight handle to a stream shared through a CaptureHub.
+
+    Attributes:
+        rtsp_url : URL of the subscribed stream
+        capture : the shared StreamCapture decoding the stream
+        dropped_frames : number of frames decoded but skipped by this subscriber
+
+    Methods:
+        read() : Read the newest frame not yet seen by this subscriber.
+        close() : Release the subscription.
+    """
+    def __init__(self, hub, rtsp_url: str, capture: StreamCapture):
+        self.rtsp_url = rtsp_url
+        self.capture = capture
+        self.dropped_frames = 0
+        self._hub = hub
+        self._seq = 0
+        self._closed = False
+
+    @property
+    def health(self) -> StreamHealth:
+        """StreamHealth of the shared capture."""
+        return self.capture.health
+
+    def seconds_since_last_frame(self) -> Optional[float]:
+        """Return the seconds since the shared capture decoded its last frame."""
+        return self.capture.seconds_since_last_frame()
+
+    def read(self, timeout=0.0) -> Optional[CapturedFrame]:
+        """Read the newest frame, independently of other subscribers.
+
+        Args:
+            timeout: Seconds to wait for a frame this subscriber has not seen yet;
+                0 returns immediately.
+
+        Returns:
+            The newest `CapturedFrame`. If no new frame arrived, the previously
+            returned frame is returned again (same `seq`); None until the first frame.
+        """
+        captured = self.capture.read_after(self._seq, timeout)
+        if captured is not None and captured.seq > self._seq:
+            if self._seq:
+                self.dropped_frames += captured.seq - self._seq - 1
+            self._seq = captured.seq
+        return captured
+
+    def close(self) -> None:
+        """Release the subscription, stopping the capture once it is unused."""
+        if not self._closed:
+            self._closed = True
+            self._hub._release(self.rtsp_url)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureHub:
+    """A process-wide registry sharing one threaded StreamCapture per stream URL.
+
+    Attributes:
+        linger : seconds an unused capture is kept open, so a subscriber that
+            reconnects right away (e.g. on a Streamlit rerun) reuses the decoder
+        capture_options : keyword arguments for new StreamCapture instances
+
+    Methods:
+        subscribe() : Subscribe to a stream, opening it on first use.
+        suspend() : Stop decoding an unused stream without waiting for the linger delay.
+        stats() : Subscriber counts and capture state per stream.
+        stop() : Stop all captures.
+    """
+    def __init__(self, linger=5.0, **capture_options):
+        self.linger = linger
+        self.capture_options = capture_options
+        self._captures: Dict[str, StreamCapture] = {}
+        self._refs: Dict[str, int] = {}
+        self._timers: Dict[str, threading.Timer] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, rtsp_url: str, **capture_options) -> StreamSubscriber:
+        """Subscribe to a stream.
+
+        Args:
+            rtsp_url: URL of the stream.
+            **capture_options: StreamCapture arguments overriding the hub defaults,
+                only used if this call opens the stream.
+
+        Returns:
+            A StreamSubscriber to be closed when no longer needed.
+        """
+        with self._lock:
+            timer = self._timers.pop(rtsp_url, None)
+            if timer is not None:
+                timer.cancel()
+
+            capture = self._captures.get(rtsp_url)
+            if capture is None or capture.health == StreamHealth.dead:
+                options = {**self.capture_options, **capture_options}
+                options.update(threaded=True, buffer_size=1)
+                capture = StreamCapture(rtsp_url, **options)
+                self._captures[rtsp_url] = capture
+            self._refs[rtsp_url] = self._refs.get(rtsp_url, 0) + 1
+
+        return StreamSubscriber(self, rtsp_url, capture)
+
+    def _release(self, rtsp_url: str) -> None:
+        """Drop one reference to a stream and schedule its teardown when unused."""
+        with self._lock:
+            if rtsp_url not in self._refs:
+                return
+            self._refs[rtsp_url] -= 1
+            if self._refs[rtsp_url] > 0:
+                return
+
+            if self.linger > 0:
+                timer = threading.Timer(self.linger, self._teardown, args=(rtsp_url,))
+                timer.daemon = True
+                self._timers[rtsp_url] = timer
+                timer.start()
+                return
+
+        self._teardown(rtsp_url)
+
+    def suspend(self, rtsp_url: str) -> None:
+        """Stop the capture of a stream right away if it has no subscriber left.
+
+        Used when a viewer is known not to come back soon, e.g. a hidden
+        preview, so the decoder does not run for the linger delay.
+        """
+        with self._lock:
+            timer = self._timers.pop(rtsp_url, None)
+            if timer is not None:
+                timer.cancel()
+        self._teardown(rtsp_url)
+
+    def _teardown(self, rtsp_url: str) -> None:
+        """Stop the capture of a stream if it is still unused."""
+        with self._lock:
+            if self._refs.get(rtsp_url, 0) > 0:
+                return
+            self._refs.pop(rtsp_url, None)
+            self._timers.pop(rtsp_url, None)
+            capture = self._captures.pop(rtsp_url, None)
+
+        if capture is not None:
+            capture.stop()
+
+    def stats(self) -> dict:
+        """Return subscriber counts and capture state per stream URL."""
+        with self._lock:
+            return {
+                url: {
+                    "subscribers": self._refs.get(url, 0),
+                    "health": capture.health.value,
+                    "reconnects": capture.reconnects,
+                }
+                for url, capture in self._captures.items()
+            }
+
+    def stop(self) -> None:
+        """Stop all captures regardless of their subscribers."""
+        with self._lock:
+            captures = list(self._captures.values())
+            for timer in self._timers.values():
+                timer.cancel()
+            self._captures.clear()
+            self._refs.clear()
+            self._timers.clear()
+
+        for capture in captures:
+            capture.stop()
+
+
+capture_hub = CaptureHub()
@@ -0,0 +1,85 @@
+import threading
+from typing import Dict, NamedTuple, Tuple
+
+import cv2
+import numpy as np
+
+from config import config
+from stream.stream_capture import CapturedFrame, StreamCapture
+
+
+class _Preview(NamedTuple):
+    capture: StreamCapture
+    seq: int
+    jpeg: bytes
+
+
+def encode_preview(frame: np.ndarray, width: int, quality: int) -> bytes:
+    """Downsample an RGB frame to a display width and encode it as JPEG.
+
+    Args:
+        frame: RGB frame.
+        width: Display width in pixels; narrower frames are not upscaled.
+        quality: JPEG quality (0-100).
+
+    Returns:
+        The JPEG bytes.
+    """
+    height, frame_width = frame.shape[:2]
+    if frame_width > width:
+        # INTER_AREA averages the dropped pixels instead of aliasing them
+        frame = cv2.resize(frame, (width, max(1, round(height * width / frame_width))),
+                           interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(".jpg", cv2.cvtColor(frame, cv2.COLOR_RGB2BGR),
+                              [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode the preview")
+    return buffer.tobytes()
+
+
+class PreviewCache:
+    """Display-sized JPEG previews of the streams, shared by the sessions watching them.
+
+    Each decoded frame is downsampled and encoded at most once per display
+    width, whatever the number of sessions previewing the stream; the others
+    get the cached JPEG, which Streamlit sends to the browser as is.
+
+    Attributes:
+        quality : JPEG quality of the previews
+
+    Methods:
+        get() : Return the preview of a captured frame.
+    """
+    def __init__(self, quality: int = 80):
+        self.quality = quality
+        self._previews: Dict[Tuple[str, int], _Preview] = {}
+        self._locks: Dict[Tuple[str, int], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, rtsp_url: str, capture: StreamCapture, captured: CapturedFrame, width: int) -> bytes:
+        """Return the JPEG preview of a frame, encoding it if no session did yet.
+
+        Args:
+            rtsp_url: URL of the stream.
+            capture: The StreamCapture that decoded the frame, as sequence
+                numbers restart when a stream is reopened.
+            captured: The frame.
+            width: Display width in pixels.
+
+        Returns:
+            The JPEG bytes.
+        """
+        key = (rtsp_url, width)
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+
+        # sessions arriving while the frame is encoded wait for it rather than encoding it again
+        with lock:
+            preview = self._previews.get(key)
+            if preview is None or preview.capture is not capture or preview.seq < captured.seq:
+                preview = _Preview(capture, captured.seq, encode_preview(captured.frame, width, self.quality))
+                self._previews[key] = preview
+        return preview.jpeg
+
+
+preview_cache = PreviewCache(config.PREVIEW_QUALITY)
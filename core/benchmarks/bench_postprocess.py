@@ -0,0 +1,113 @@
+"""Benchmark the vectorized post-processing against a reference loop.
+
+Run from the core directory:
+
+    python -m benchmarks.bench_postprocess
+"""
+import argparse
+import time
+
+import numpy as np
+
+from inference.postprocess import MAX_CANDIDATES, MAX_DETECTIONS, postprocess
+
+
+def _iou(a, b):
+    """IOU of two boxes given as xmin, ymin, xmax, ymax."""
+    iw = max(0., min(a[2], b[2]) - max(a[0], b[0]))
+    ih = max(0., min(a[3], b[3]) - max(a[1], b[1]))
+    inter = iw * ih
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / max(union, 1e-9)
+
+def reference_postprocess(raw, scales, pads, image_sizes, confidence_threshold, iou_threshold,
+                          class_ids=None):
+    """Straightforward per-box loop implementation of `postprocess`."""
+    detections = []
+    for out, scale, pad, (height, width) in zip(raw, scales, pads, image_sizes):
+        candidates = []
+        for row in out:
+            class_scores = [float(row[4]) * float(score) for score in row[5:]]
+            label = max(range(len(class_scores)), key=lambda i: (class_scores[i], -i))
+            score = class_scores[label]
+            if score < confidence_threshold:
+                continue
+            if class_ids is not None and label not in class_ids:
+                continue
+            cx, cy, w, h = (float(v) for v in row[:4])
+            box = [
+                min(max((cx - w / 2 - pad[0]) / scale[0], 0.), width),
+                min(max((cy - h / 2 - pad[1]) / scale[1], 0.), height),
+                min(max((cx + w / 2 - pad[0]) / scale[0], 0.), width),
+                min(max((cy + h / 2 - pad[1]) / scale[1], 0.), height),
+            ]
+            candidates.append((score, label, box))
+
+        candidates.sort(key=lambda c: -c[0])
+        candidates = candidates[:MAX_CANDIDATES]
+
+        kept = []
+        for score, label, box in candidates:
+            if all(k_label != label or _iou(box, k_box) <= iou_threshold
+                   for _, k_label, k_box in kept):
+                kept.append((score, label, box))
+
+        detections.append(np.array([box + [score, label] for score, label, box in kept[:MAX_DETECTIONS]],
+                                   dtype=np.float32).reshape(-1, 6))
+    return detections
+
+def synthetic_output(batch, candidates, classes, input_size, seed=0):
+    """Random raw output with clusters of overlapping boxes, like a real detector."""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(0, input_size, (batch, candidates // 10 + 1, 2))
+    raw = np.empty((batch, candidates, 5 + classes), dtype=np.float32)
+    cluster = rng.integers(0, centers.shape[1], (batch, candidates))
+    raw[..., :2] = np.take_along_axis(centers, cluster[..., np.newaxis], axis=1) \
+        + rng.normal(0, 4, (batch, candidates, 2))
+    raw[..., 2:4] = rng.uniform(20, 120, (batch, candidates, 2))
+    raw[..., 4] = rng.uniform(0, 1, (batch, candidates)) ** 2
+    raw[..., 5:] = rng.dirichlet(np.ones(classes) * 0.3, (batch, candidates))
+    return raw
+
+def timed(fn, repeat):
+    """Return the result of `fn` and its best wall time over `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--candidates", type=int, default=25200)
+    parser.add_argument("--classes", type=int, default=80)
+    parser.add_argument("--confidence", type=float, default=0.25)
+    parser.add_argument("--iou", type=float, default=0.45)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    input_size = 640
+    raw = synthetic_output(args.batch, args.candidates, args.classes, input_size)
+    image_sizes = np.tile(np.array([[1080, 1920]], dtype=np.float32), (args.batch, 1))
+    scales = input_size / image_sizes[:, ::-1]
+    pads = np.zeros_like(scales)
+    call = (raw, scales, pads, image_sizes, args.confidence, args.iou)
+
+    fast, fast_time = timed(lambda: postprocess(*call), args.repeat)
+    slow, slow_time = timed(lambda: reference_postprocess(*call), 1)
+
+    for i, (a, b) in enumerate(zip(fast, slow)):
+        if a.shape != b.shape or not np.allclose(a, b, atol=1e-2):
+            raise SystemExit(f"Mismatch on image {i}: {len(a)} vs {len(b)} detections")
+
+    detections = sum(len(d) for d in fast)
+    print(f"batch={args.batch} candidates={args.candidates} classes={args.classes} detections={detections}")
+    print(f"vectorized: {fast_time * 1000:9.2f} ms")
+    print(f"reference:  {slow_time * 1000:9.2f} ms")
+    print(f"speedup:    {slow_time / fast_time:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""Benchmark the codecs, inference and streaming paths of the API.
+
+Synthetic frames are generated at common resolutions, the FastAPI app is
+driven in-process, and a local video file replayed at camera speed through
+StreamCapture/CamGear stands in for an RTSP camera. Throughput, p50/p95/p99
+latency and peak RSS are reported per benchmark and written as JSON, so runs
+can be diffed between commits.
+
+Run from the core directory:
+
+    python -m benchmarks.bench_suite --model models/model.onnx
+    python -m benchmarks.bench_suite --compare before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from config import config
+from util.helper import (decode_frame, decode_image, encode_frame, encode_frame_b64, encode_jpeg, frame_from_bytes,
+                         frame_to_bytes)
+
+RESOLUTIONS = {
+    "480p": (640, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "2160p": (3840, 2160),
+}
+BENCHMARKS = ("codecs", "single", "batched", "stream")
+
+
+def synthetic_frame(width, height, seed=0):
+    """A RGB frame with a gradient, shapes and sensor-like noise, compressing like a camera frame."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, np.newaxis]
+    frame = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                      np.full((height, width), 128, np.float32)], axis=-1).astype(np.uint8)
+    for _ in range(12):
+        x0, y0 = rng.integers(0, width), rng.integers(0, height)
+        size = int(rng.integers(height // 20, height // 4))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.rectangle(frame, (int(x0), int(y0)), (int(x0) + size, int(y0) + size // 2), color, -1)
+    noise = rng.integers(-8, 9, frame.shape, dtype=np.int16)
+    return np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+def synthetic_video(path, width, height, fps, seconds):
+    """Write a video of a rectangle moving over a synthetic frame."""
+    background = synthetic_frame(width, height)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        raise SystemExit(f"Could not write {path}")
+    size = height // 5
+    for i in range(int(fps * seconds)):
+        frame = background.copy()
+        x = int((width - size) * (i / (fps * seconds)))
+        cv2.rectangle(frame, (x, height // 3), (x + size, height // 3 + size), (255, 32, 32), -1)
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+    writer.release()
+
+
+class RssMonitor:
+    """Sample the resident set size of the process on a thread and keep its peak.
+
+    Falls back to the lifetime peak from getrusage where /proc is not available.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="RssMonitor", daemon=True)
+
+    def _rss(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self._page_size
+        except OSError:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.peak = max(self.peak, self._rss())
+            self._stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self._rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+
+def summarize(name, latencies, seconds, rss, **extra):
+    """Build the result of a benchmark from its per-operation latencies in seconds."""
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0., 0., 0.)
+    result = {
+        "name": name,
+        "ops": len(latencies),
+        "seconds": round(seconds, 4),
+        "throughput": round(len(latencies) / seconds, 2) if seconds else 0.,
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "peak_rss_mb": round(rss.peak / 1024 ** 2, 1),
+        **extra,
+    }
+    print(f"{name:<28} {result['throughput']:>10.1f}/s  p50 {result['p50_ms']:>9.2f} ms  "
+          f"p95 {result['p95_ms']:>9.2f} ms  p99 {result['p99_ms']:>9.2f} ms  rss {result['peak_rss_mb']:>7.1f} MB")
+    return result
+
+def run_timed(name, fn, args, repeat, **extra):
+    """Call `fn` on each item of `args` `repeat` times, timing each call."""
+    latencies = []
+    with RssMonitor() as rss:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for arg in args:
+                call_start = time.perf_counter()
+                fn(arg)
+                latencies.append(time.perf_counter() - call_start)
+        seconds = time.perf_counter() - start
+    return summarize(name, latencies, seconds, rss, **extra)
+
+
+def bench_codecs(resolutions, repeat):
+    """Encode and decode synthetic frames with the helpers used by the API and the app."""
+    results = []
+    for label in resolutions:
+        width, height = RESOLUTIONS[label]
+        frames = [synthetic_frame(width, height, seed) for seed in range(4)]
+        jpegs = [encode_jpeg(frame, 85) for frame in frames]
+        extra = {"resolution": label}
+        results.append(run_timed(f"encode_jpeg/{label}", lambda f: encode_jpeg(f, 85), frames, repeat, **extra))
+        results.append(run_timed(f"decode_jpeg/{label}", decode_image, jpegs, repeat, **extra))
+        reduction = max(r for r in (1, 2, 4, 8) if r == 1 or max(width, height) / r >= config.MODEL_INPUT_SIZE)
+        if reduction > 1:
+            results.append(run_timed(f"decode_jpeg_reduced/{label}", lambda d: decode_image(d, reduction), jpegs,
+                                     repeat, reduction=reduction, **extra))
+        results.append(run_timed(f"encode_frame/{label}", encode_frame, frames, repeat, **extra))
+        encoded = [encode_frame(frame) for frame in frames]
+        results.append(run_timed(f"decode_frame/{label}", lambda e: decode_frame(e[1], e[0]), encoded, repeat,
+                                 **extra))
+        results.append(run_timed(f"encode_frame_b64_jpeg/{label}", lambda f: encode_frame_b64(f, "jpeg"), frames,
+                                 repeat, **extra))
+        for codec in ("raw", "jpeg"):
+            messages = [frame_to_bytes(frame, codec) for frame in frames]
+            results.append(run_timed(f"frame_to_bytes/{codec}/{label}", lambda f: frame_to_bytes(f, codec), frames,
+                                     repeat, **extra))
+            results.append(run_timed(f"frame_from_bytes/{codec}/{label}", frame_from_bytes, messages, repeat,
+                                     **extra))
+    return results
+
+
+def upload_images(label, count):
+    """Distinct JPEG uploads, so the result cache never answers them."""
+    width, height = RESOLUTIONS[label]
+    frame = synthetic_frame(width, height)
+    images = []
+    for i in range(count):
+        frame[:8, :8] = i % 256, (i // 256) % 256, 0
+        images.append(encode_jpeg(frame, 90))
+    return images
+
+async def post_image(client, data, i):
+    start = time.perf_counter()
+    response = await client.post("/cv/infer_image", files={"file": (f"bench_{i}.jpg", data, "image/jpeg")})
+    if response.status_code != 200:
+        raise SystemExit(f"infer_image failed with {response.status_code}: {response.text}")
+    return time.perf_counter() - start, response.json()["processing_time"].get("batch_size") or 1
+
+async def bench_single(client, label, requests):
+    """Sequential infer_image requests: the latency of one image through the whole API."""
+    images = upload_images(label, requests)
+    await post_image(client, images[0], -1)
+    with RssMonitor() as rss:
+        start = time.perf_counter()
+        latencies = [(await post_image(client, data, i))[0] for i, data in enumerate(images)]
+        seconds = time.perf_counter() - start
+    return summarize(f"infer_single/{label}", latencies, seconds, rss, resolution=label)
+
+async def bench_batched(client, label, requests, concurrency):
+    """Concurrent infer_image requests, gathered into batches by the batcher."""
+    images = upload_images(label, requests)
+    pending = iter(enumerate(images))
+    latencies, batch_sizes = [], []
+
+    async def client_loop():
+        for i, data in pending:
+            latency, batch_size = await post_image(client, data, i)
+            latencies.append(latency)
+            batch_sizes.append(batch_size)
+
+    with RssMonitor() as rss:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        seconds = time.perf_counter() - start
+    return summarize(f"infer_batched/{label}", latencies, seconds, rss, resolution=label,
+                     concurrency=concurrency, mean_batch_size=round(float(np.mean(batch_sizes)), 2))
+
+async def bench_stream(app, label, seconds):
+    """Read the MJPEG stream of the stand-in camera in-process for a while.
+
+    The ASGI app is called directly, since test transports buffer whole
+    responses; the stream ends by receiving a disconnect. Latencies are the
+    intervals between delivered frames.
+    """
+    path = "/cv/test/infer_stream"
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+             "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 0), "server": ("bench", 80)}
+    disconnected = asyncio.Event()
+    arrivals = []
+
+    async def receive():
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            arrivals.append(time.perf_counter())
+
+    task = asyncio.create_task(app(scope, receive, send))
+    deadline = time.perf_counter() + 30
+    while not arrivals:
+        if task.done() or time.perf_counter() > deadline:
+            disconnected.set()
+            raise SystemExit("The stand-in stream delivered no frame")
+        await asyncio.sleep(0.05)
+
+    with RssMonitor() as rss:
+        first = len(arrivals)
+        await asyncio.sleep(seconds)
+        window = arrivals[first - 1:]
+    disconnected.set()
+    await asyncio.wait_for(task, 10)
+
+    intervals = np.diff(window)
+    return summarize(f"stream/{label}", intervals, seconds, rss, resolution=label,
+                     fps=round(len(intervals) / seconds, 2), target_fps=config.STREAMS["test"]["fps"])
+
+
+async def bench_app(args, selected, tmp):
+    """Run the benchmarks driving the FastAPI app in-process."""
+    import httpx
+
+    width, height = RESOLUTIONS[args.stream_resolution]
+    video = args.video
+    if "stream" in selected and video is None:
+        video = os.path.join(tmp, f"stream_{args.stream_resolution}.mp4")
+        synthetic_video(video, width, height, args.stream_fps, args.stream_seconds + 10)
+
+    config.DEFAULT_CONFIG["model_path"] = args.model
+    config.HISTORY_DB = os.path.join(tmp, "history.db")
+    config.TRACE_DIR = os.path.join(tmp, "slow")
+    config.OUTPUT_SAVE_IMAGES = config.OUTPUT_SAVE_STREAM = False
+    config.MJPEG_MAX_FPS = args.stream_fps
+    config.STREAMS["test"].update(url=video, fps=args.stream_fps, motion_threshold=0, record=False)
+
+    from main import app
+    from routers import cv
+    from stream.hub import capture_hub
+    cv.result_cache.max_bytes = 0
+    capture_hub.capture_options["max_fps"] = args.stream_fps
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+            if "single" in selected:
+                results.append(await bench_single(client, args.infer_resolution, args.requests))
+            if "batched" in selected:
+                results.append(await bench_batched(client, args.infer_resolution, args.requests,
+                                                   args.concurrency))
+        if "stream" in selected:
+            label = args.stream_resolution if args.video is None else os.path.basename(args.video)
+            results.append(await bench_stream(app, label, args.stream_seconds))
+    finally:
+        capture_hub.stop()
+        cv.shutdown()
+    return results
+
+
+def metadata(args):
+    """Describe the run: commit, versions and machine."""
+    def git(*command):
+        try:
+            return subprocess.run(["git", *command], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "commit": git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+    }
+
+def compare(before_path, after_path):
+    """Print the throughput and p95 changes between two result files."""
+    with open(before_path) as f:
+        before = {r["name"]: r for r in json.load(f)["results"]}
+    with open(after_path) as f:
+        after = json.load(f)["results"]
+
+    print(f"{'benchmark':<28} {'throughput':>24} {'change':>8} {'p95 ms':>22} {'change':>8}")
+    for result in after:
+        old = before.get(result["name"])
+        if old is None:
+            continue
+        throughput = (result["throughput"] / old["throughput"] - 1) * 100 if old["throughput"] else 0.
+        p95 = (result["p95_ms"] / old["p95_ms"] - 1) * 100 if old["p95_ms"] else 0.
+        print(f"{result['name']:<28} {old['throughput']:>11.1f} -> {result['throughput']:>9.1f} {throughput:>+7.1f}% "
+              f"{old['p95_ms']:>9.2f} -> {result['p95_ms']:>9.2f} {p95:>+7.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", default=",".join(BENCHMARKS),
+                        help=f"comma separated benchmarks among {', '.join(BENCHMARKS)}")
+    parser.add_argument("--resolutions", default="480p,720p,1080p,2160p", help="resolutions of the codec benchmarks")
+    parser.add_argument("--repeat", type=int, default=10, help="passes over the frames of the codec benchmarks")
+    parser.add_argument("--model", default=config.DEFAULT_CONFIG["model_path"])
+    parser.add_argument("--infer-resolution", default="1080p", choices=RESOLUTIONS)
+    parser.add_argument("--requests", type=int, default=64, help="requests per inference benchmark")
+    parser.add_argument("--concurrency", type=int, default=config.BATCH_MAX_SIZE)
+    parser.add_argument("--video", help="video file replayed as the stream, synthetic if omitted")
+    parser.add_argument("--stream-resolution", default="720p", choices=RESOLUTIONS, help="of the synthetic video")
+    parser.add_argument("--stream-fps", type=float, default=25.)
+    parser.add_argument("--stream-seconds", type=float, default=10.)
+    parser.add_argument("--output", help="result file, bench-<commit>.json by default")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    selected = set(args.only.split(","))
+    unknown = selected - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    if selected & {"single", "batched", "stream"} and not os.path.exists(args.model):
+        print(f"Model {args.model} not found, skipping the inference and stream benchmarks", file=sys.stderr)
+        selected -= {"single", "batched", "stream"}
+
+    results = []
+    if "codecs" in selected:
+        results += bench_codecs(args.resolutions.split(","), args.repeat)
+    if selected - {"codecs"}:
+        with tempfile.TemporaryDirectory() as tmp:
+            results += asyncio.run(bench_app(args, selected, tmp))
+
+    meta = metadata(args)
+    output = args.output or f"bench-{meta['commit'] or 'nogit'}.json"
+    with open(output, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -23,3 +23,153 @@ TEMP_LOG_OUT = os.path.join(DATA_DIR, 'log')
 TEMP_IMAGE_OUT = os.path.join(DATA_OUTPUT, 'image')
 TEMP_VIDEO_OUT = os.path.join(DATA_OUTPUT, 'video')
 TEMP_STREAM_OUT = os.path.join(DATA_OUTPUT, 'stream')
+
+MODEL_PATH = os.path.join(CORE_DIR, 'models', 'model.onnx')
+MODEL_INPUT_SIZE = 640
+
+DEFAULT_DEVICE = "cpu"
+CLASS_NAME0 = {"id": 0, "name": "class0"}
+CLASS_NAME1 = {"id": 1, "name": "class1"}
+CLASSES = [CLASS_NAME0, CLASS_NAME1]
+
+DEFAULT_CONFIDENCE_THRESHOLD = 0.85
+DEFAULT_IOU_THRESHOLD = 0.5
+
+DEFAULT_CONFIG = {
+    "model_path": MODEL_PATH,
+    "device": DEFAULT_DEVICE,
+    "classes": CLASSES,
+    "confidence_threshold": DEFAULT_CONFIDENCE_THRESHOLD,
+    "iou_threshold": DEFAULT_IOU_THRESHOLD
+}
+
+MODEL_MEMORY_BUDGET = 2 * 1024 ** 3
+
+# "thread" runs the model in the API process, "process" in a pool of worker
+# processes (INFERENCE_WORKERS, None sizes it from the available cores)
+INFERENCE_MODE = "thread"
+INFERENCE_WORKERS = None
+
+# uploads above these sizes are rejected before being read
+MAX_UPLOAD_BYTES = 50 * 1024 ** 2
+MAX_VIDEO_UPLOAD_BYTES = 4 * 1024 ** 3
+MAX_IMAGE_PIXELS = 100_000_000
+
+RESULT_CACHE_MAX_BYTES = 64 * 1024 ** 2
+RESULT_CACHE_TTL = 300
+
+# annotated images saved off the request path by the OutputWriter, every
+# OUTPUT_EVERY_N-th image per source; when the queue is full a stream's
+# pending frame is replaced by the newer one and other images are dropped
+OUTPUT_SAVE_IMAGES = False
+OUTPUT_SAVE_STREAM = False
+OUTPUT_FORMAT = "jpeg"
+OUTPUT_QUALITY = 90
+OUTPUT_EVERY_N = 1
+OUTPUT_ONLY_DETECTIONS = True
+OUTPUT_QUEUE_SIZE = 64
+
+BATCH_MAX_SIZE = 8
+BATCH_MAX_WAIT = 0.01
+
+# target frame rate of infer_stream per camera, overridable per stream with "fps";
+# under overload (frames waiting longer than SCHEDULER_MAX_QUEUE_WAIT seconds for
+# the model) the cameras are slowed down fairly, down to SCHEDULER_MIN_FPS
+STREAM_TARGET_FPS = 15
+SCHEDULER_MAX_QUEUE_WAIT = 0.1
+SCHEDULER_MIN_FPS = 1
+
+# fraction of changed pixels from which infer_stream runs the model on a frame,
+# overridable per stream with "motion_threshold" (0 runs it on every frame)
+MOTION_THRESHOLD = 0.005
+MOTION_PIXEL_THRESHOLD = 25
+MOTION_WIDTH = 160
+MOTION_ALPHA = 0.05
+MOTION_MAX_SKIP = 10.0
+
+# streams with "record" enabled are written to TEMP_VIDEO_OUT/<camera> in
+# segments of RECORD_SEGMENT_SECONDS, keeping at most RECORD_MAX_BYTES and
+# RECORD_MAX_AGE seconds of video
+RECORD_SEGMENT_SECONDS = 60
+RECORD_MAX_BYTES = 10 * 1024 ** 3
+RECORD_MAX_AGE = 7 * 24 * 3600
+RECORD_FOURCC = "mp4v"
+RECORD_QUEUE_SIZE = 32
+
+# results of the frames infer_stream runs the model on are stored in
+# HISTORY_DB, inserted in batches of up to HISTORY_BATCH_SIZE at least every
+# HISTORY_FLUSH_INTERVAL seconds (HISTORY_ENABLED = False turns it off); the
+# last frame time is remembered for the HISTORY_MAX_CAMERAS latest cameras
+HISTORY_ENABLED = True
+HISTORY_DB = os.path.join(DATA_DIR, 'history.db')
+HISTORY_FLUSH_INTERVAL = 1.0
+HISTORY_BATCH_SIZE = 500
+HISTORY_QUEUE_SIZE = 10000
+HISTORY_MAX_CAMERAS = 1000
+HISTORY_PAGE_SIZE = 100
+
+# requests slower than the threshold of their path (seconds) have their spans
+# written to TRACE_DIR, keeping the TRACE_MAX_FILES newest
+TRACE_SLOW_REQUESTS = {
+    "/cv/infer_image": 1.0,
+    "/data/frames": 1.0,
+    "/data/counts": 1.0,
+}
+TRACE_DIR = os.path.join(TEMP_LOG_OUT, 'slow')
+TRACE_MAX_FILES = 1000
+# seconds between two stack samples of the process while traced requests
+# run, written with the spans of the slow ones; None disables the sampling
+TRACE_SAMPLE_INTERVAL = 0.01
+
+# log records are written as JSON lines by a listener thread; logging calls
+# drop records beyond LOG_QUEUE_SIZE pending ones and beyond LOG_RATE records
+# per second (bursts of LOG_BURST) from the same line of code, and
+# LOG_ACCESS_SAMPLE is the fraction of index page requests logged
+LOG_LEVEL = "INFO"
+LOG_QUEUE_SIZE = 10000
+LOG_RATE = 10
+LOG_BURST = 50
+LOG_ACCESS_SAMPLE = 0.1
+
+# sampling profiler of /admin/profile, off by default; when ADMIN_ENDPOINTS
+# is True the /admin routes only answer requests with an
+# "Authorization: Bearer <ADMIN_TOKEN>" header, and none if the token is empty
+ADMIN_ENDPOINTS = False
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+PROFILE_SECONDS = 10
+PROFILE_MAX_SECONDS = 60
+PROFILE_INTERVAL = 0.005
+
+RTSP_PORT = 554
+ENDPOINT = "live"
+
+# RTSP streams by camera name; a "url" entry (any URL or a video file path)
+# replaces the URL built from the other entries
+STREAMS = {
+    "test": {
+        "username": "",
+        "password": "",
+        "address": "",
+        "port": RTSP_PORT,
+        "endpoint": ENDPOINT,
+        "fps": STREAM_TARGET_FPS,
+        "motion_threshold": MOTION_THRESHOLD,
+        "record": False
+    },
+}
+
+MJPEG_MAX_FPS = 25
+MJPEG_MIN_FPS = 1
+MJPEG_MAX_QUALITY = 85
+MJPEG_MIN_QUALITY = 40
+
+# frames a client of /cv/ingest may have in flight; the window is halved when
+# frames wait longer than SCHEDULER_MAX_QUEUE_WAIT seconds for the model
+INGEST_MAX_CREDITS = BATCH_MAX_SIZE
+
+VIDEO_CHUNK_SIZE = 1024 * 1024
+VIDEO_SAMPLE_MODE = "time"
+VIDEO_SAMPLE_STRIDE = 1
+VIDEO_SAMPLE_INTERVAL = 1.0
+# sampled frames sent to the batcher before the oldest result is written
+VIDEO_MAX_IN_FLIGHT = BATCH_MAX_SIZE
@@ -0,0 +1,139 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from util.metrics import batch_sizes, stage_seconds
+
+
+class BatchInfo(NamedTuple):
+    """Timing of the batch a request was processed in.
+
+    Attributes:
+        batch_size : number of frames in the batch
+        queue_wait : seconds the request waited before its batch started
+        batch_latency : seconds the batched forward pass took
+        stages : seconds of the preprocess, inference and postprocess stages of the batch
+    """
+    batch_size: int
+    queue_wait: float
+    batch_latency: float
+    stages: Optional[Dict[str, float]] = None
+
+
+class InferenceBatcher:
+    """A class to gather concurrent inference requests into batches.
+
+    Requests from any coroutine (HTTP uploads, camera loops) are queued. A worker
+    task takes the first waiting request, collects more until `max_batch_size`
+    requests are gathered or `max_wait` seconds have passed, runs one batched
+    call of `predict` in the thread pool and resolves each caller's future with
+    its own result. Up to `concurrency` batches run at the same time, e.g. one
+    per worker process of an InferencePool; while all are busy, new requests
+    keep filling the next batch.
+
+    Attributes:
+        predict : callable taking a list of frames and a dict receiving the stage
+            timings of the batch, and returning one result per frame
+        max_batch_size : maximum number of frames per batch
+        max_wait : maximum seconds to wait for a batch to fill up
+        concurrency : maximum number of batches running at the same time
+
+    Methods:
+        infer() : Run the model on a frame as part of a batch.
+        queue_depth() : Return the number of requests waiting for a batch.
+    """
+    def __init__(self, predict: Callable[[List[np.ndarray], Dict[str, float]], Sequence[Any]],
+                 max_batch_size: int = 8, max_wait: float = 0.01, concurrency: int = 1):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.concurrency = concurrency
+        self._queue = None
+        self._slots = None
+        self._batches = set()
+        self._loop = None
+        self._worker = None
+
+    def _ensure_worker(self) -> None:
+        """Start the worker task on the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._worker = loop.create_task(self._run())
+
+    async def infer(self, frame: np.ndarray) -> Tuple[Any, BatchInfo]:
+        """Run the model on a frame as part of a batch.
+
+        Args:
+            frame: The frame to process.
+
+        Returns:
+            The result of `predict` for this frame and the BatchInfo of its batch.
+        """
+        self._ensure_worker()
+        future = self._loop.create_future()
+        self._queue.put_nowait((frame, future, time.perf_counter()))
+        return await future
+
+    def queue_depth(self) -> int:
+        """Return the number of requests waiting for a batch."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _collect(self) -> list:
+        """Wait for a first request and gather a batch behind it."""
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return [item for item in batch if not item[1].done()]
+
+    async def _run(self) -> None:
+        """Worker loop starting a batched forward pass whenever a slot is free."""
+        while True:
+            await self._slots.acquire()
+            batch = await self._collect()
+            if not batch:
+                self._slots.release()
+                continue
+            task = self._loop.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch: list) -> None:
+        """Run one batched forward pass and resolve the futures of its requests."""
+        start = time.perf_counter()
+        stages = {}
+        try:
+            results = await self._loop.run_in_executor(
+                None, self.predict, [frame for frame, _, _ in batch], stages)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        latency = time.perf_counter() - start
+        batch_sizes.observe(len(batch))
+        for stage, seconds in stages.items():
+            stage_seconds.observe(seconds, stage)
+
+        for (_, future, queued), result in zip(batch, results):
+            stage_seconds.observe(start - queued, "queue")
+            if not future.done():
+                future.set_result((result, BatchInfo(len(batch), start - queued, latency, stages)))
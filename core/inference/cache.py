@@ -0,0 +1,101 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+# bookkeeping per entry on top of the cached arrays
+ENTRY_OVERHEAD = 256
+
+
+class ResultCache:
+    """A content addressed LRU cache of inference results.
+
+    Entries are keyed by a digest of the encoded upload and the configuration
+    the model ran with, so a re-submitted image is answered without decoding
+    it or running the model. Least recently used entries are evicted once the
+    cached results exceed `max_bytes`, and entries older than `ttl` seconds
+    are dropped when looked up.
+
+    Attributes:
+        max_bytes : memory cap of the cached results
+        ttl : seconds an entry stays valid
+        hits : number of lookups answered from the cache
+        misses : number of lookups not in the cache
+
+    Methods:
+        key() : Build the key of an upload for a configuration.
+        get() : Return a cached value.
+        put() : Cache a value.
+        clear() : Drop all entries.
+    """
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(data: bytes, config_key: Hashable) -> Hashable:
+        """Build the key of an upload for a configuration.
+
+        Args:
+            data: The encoded upload.
+            config_key: Hashable description of the model configuration.
+
+        Returns:
+            The cache key.
+        """
+        return hashlib.blake2b(data, digest_size=16).digest(), config_key
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return a cached value, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[2] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, nbytes: int) -> None:
+        """Cache a value of about `nbytes` bytes, evicting old entries over the cap."""
+        nbytes += ENTRY_OVERHEAD
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, nbytes, time.monotonic())
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Hashable) -> None:
+        _, nbytes, _ = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def clear(self) -> None:
+        """Drop all entries, e.g. when the model configuration changes."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Return the hit and miss counters and the cache size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
@@ -0,0 +1,194 @@
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from inference.postprocess import postprocess
+from util.metrics import stage_seconds
+
+LETTERBOX_COLOR = 114
+
+
+class Detector:
+    """A class to run an object detection model with OpenCV's DNN module.
+
+    The model is expected to be a YOLOv5 style export (ONNX or any other format
+    `cv2.dnn.readNet` accepts) with a single output of shape
+    (batch, candidates, 5 + number of classes), each row holding cx, cy, w, h,
+    objectness and the class scores, with boxes in input pixel coordinates.
+
+    Attributes:
+        model_path : path to the model
+        device : device to use for running the model ("cpu" or "cuda")
+        input_size : side of the square model input
+        confidence_threshold : threshold for confidence score
+        iou_threshold : threshold for intersection over union score
+        class_ids : ids of the classes to keep, None keeps all
+        batched : flag to indicate if the model accepts a batch dimension above 1
+
+    Methods:
+        predict() : Run the model on a batch of frames.
+    """
+    def __init__(self, model_path: str, device: str = "cpu", input_size: int = 640,
+                 confidence_threshold: float = 0.5, iou_threshold: float = 0.5,
+                 classes: Optional[list] = None):
+        self.model_path = model_path
+        self.device = device
+        self.input_size = input_size
+        self.confidence_threshold = confidence_threshold
+        self.iou_threshold = iou_threshold
+        self.class_ids = class_ids_from(classes)
+        self.batched = True
+        self._lock = threading.Lock()
+        self._canvas = np.empty((input_size, input_size, 3), dtype=np.uint8)
+        self._blob = None
+
+        self.net = cv2.dnn.readNet(model_path)
+        if device.startswith("cuda"):
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
+        else:
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+    def preprocess(self, frames: Sequence[np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Letterbox and normalize RGB frames into a NCHW blob.
+
+        Each frame is resized keeping its aspect ratio straight into a padded
+        canvas, and the canvas is scaled into the blob. The canvas and the blob
+        are preallocated and reused, so the blob is only valid until the next
+        call; callers hold the detector's lock.
+
+        Returns:
+            The blob, and the per frame (x, y) scales and pads of shape (batch, 2).
+        """
+        size = self.input_size
+        if self._blob is None or len(self._blob) < len(frames):
+            self._blob = np.empty((len(frames), 3, size, size), dtype=np.float32)
+        blob = self._blob[:len(frames)]
+        scales = np.empty((len(frames), 2), dtype=np.float32)
+        pads = np.empty((len(frames), 2), dtype=np.float32)
+
+        for i, frame in enumerate(frames):
+            height, width = frame.shape[:2]
+            scale = min(size / width, size / height)
+            new_width, new_height = min(size, round(width * scale)), min(size, round(height * scale))
+            left, top = (size - new_width) // 2, (size - new_height) // 2
+
+            self._canvas.fill(LETTERBOX_COLOR)
+            cv2.resize(frame, (new_width, new_height), dst=self._canvas[top:top + new_height, left:left + new_width],
+                       interpolation=cv2.INTER_LINEAR)
+            np.multiply(self._canvas.transpose(2, 0, 1), 1. / 255, out=blob[i], casting="unsafe")
+            scales[i] = new_width / width, new_height / height
+            pads[i] = left, top
+
+        return blob, scales, pads
+
+    def forward(self, frames: Sequence[np.ndarray],
+                timings: Optional[dict] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Preprocess frames and run the network on them.
+
+        Args:
+            frames: The frames.
+            timings: Optional dict receiving the seconds of the "preprocess"
+                and "inference" stages.
+
+        Returns:
+            The raw network output, and the scales and pads of `preprocess`.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            blob, scales, pads = self.preprocess(frames)
+            preprocessed = time.perf_counter()
+            raw = self._forward(blob)
+        if timings is not None:
+            timings["preprocess"] = preprocessed - start
+            timings["inference"] = time.perf_counter() - preprocessed
+        return raw, scales, pads
+
+    def _forward(self, blob: np.ndarray) -> np.ndarray:
+        """Run the network on a blob, one frame at a time if it has a fixed batch of 1."""
+        if self.batched or len(blob) == 1:
+            try:
+                self.net.setInput(blob)
+                return self.net.forward()
+            except cv2.error:
+                if len(blob) == 1:
+                    raise
+                self.batched = False
+
+        outputs = []
+        for image in blob:
+            self.net.setInput(image[np.newaxis])
+            outputs.append(self.net.forward())
+        return np.concatenate(outputs)
+
+    def postprocess(self, raw: np.ndarray, frames: Sequence[np.ndarray], scales: np.ndarray, pads: np.ndarray,
+                    confidence_threshold: Optional[float] = None, iou_threshold: Optional[float] = None,
+                    class_ids: Optional[List[int]] = None) -> List[np.ndarray]:
+        """Turn raw network output into detections in frame coordinates.
+
+        Args:
+            raw: Network output of shape (batch, candidates, 5 + classes).
+            frames: The frames the output was computed for.
+            scales: Per frame (x, y) letterbox scales from `preprocess`.
+            pads: Per frame (x, y) letterbox pads from `preprocess`.
+            confidence_threshold: Overrides the detector's confidence threshold.
+            iou_threshold: Overrides the detector's NMS IOU threshold.
+            class_ids: Overrides the detector's class ids to keep.
+
+        Returns:
+            One array of shape (detections, 6) per frame, each row holding
+            xmin, ymin, xmax, ymax, score and class id.
+        """
+        confidence_threshold = (self.confidence_threshold if confidence_threshold is None
+                                else confidence_threshold)
+        iou_threshold = self.iou_threshold if iou_threshold is None else iou_threshold
+        class_ids = self.class_ids if class_ids is None else class_ids
+
+        image_sizes = np.array([frame.shape[:2] for frame in frames], dtype=np.float32)
+        return postprocess(raw, scales, pads, image_sizes, confidence_threshold, iou_threshold, class_ids)
+
+    def predict(self, frames: Sequence[np.ndarray], confidence_threshold: Optional[float] = None,
+                iou_threshold: Optional[float] = None, class_ids: Optional[List[int]] = None,
+                timings: Optional[dict] = None) -> List[np.ndarray]:
+        """Run the model on a batch of RGB frames.
+
+        Args:
+            frames: The frames, of any size.
+            confidence_threshold: Overrides the detector's confidence threshold.
+            iou_threshold: Overrides the detector's NMS IOU threshold.
+            class_ids: Overrides the detector's class ids to keep.
+            timings: Optional dict receiving the seconds of the preprocess,
+                inference and postprocess stages, e.g. to send them from a
+                worker process; without it they are recorded in `stage_seconds`.
+
+        Returns:
+            One array of shape (detections, 6) per frame, each row holding
+            xmin, ymin, xmax, ymax, score and class id.
+        """
+        stages = {} if timings is None else timings
+        raw, scales, pads = self.forward(frames, stages)
+        start = time.perf_counter()
+        results = self.postprocess(raw, frames, scales, pads, confidence_threshold, iou_threshold, class_ids)
+        stages["postprocess"] = time.perf_counter() - start
+        if timings is None:
+            for stage, seconds in stages.items():
+                stage_seconds.observe(seconds, stage)
+        return results
+
+
+def class_ids_from(classes: Optional[list]) -> Optional[List[int]]:
+    """Return the class ids of a `ModelConfig.classes` list, None to keep all classes.
+
+    Args:
+        classes: Class ids or `{"id": ..., "name": ...}` dicts as in `config.CLASSES`.
+
+    Returns:
+        The class ids.
+    """
+    if not classes:
+        return None
+    return [c["id"] if isinstance(c, dict) else int(c) for c in classes]
@@ -0,0 +1,275 @@
+import logging
+import multiprocessing
+import os
+import queue
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from util.metrics import stage_seconds
+
+logger = logging.getLogger("core")
+
+MODELS_PER_WORKER = 2
+
+
+class WorkerError(RuntimeError):
+    """Raised when an inference worker fails or crashes."""
+
+
+def _worker_main(conn, shm_name: str, input_size: int) -> None:
+    """Serve load and predict requests in a worker process.
+
+    Frames are read from the shared memory slot described in each predict
+    request and only the detection arrays and the stage timings are sent back.
+    """
+    from inference.detector import Detector
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    detectors = OrderedDict()
+
+    def get(model_path, device):
+        key = (model_path, device)
+        if key not in detectors:
+            detectors[key] = Detector(model_path, device, input_size)
+            while len(detectors) > MODELS_PER_WORKER:
+                detectors.popitem(last=False)
+        detectors.move_to_end(key)
+        return detectors[key]
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        kind = message[0]
+        if kind == "stop":
+            break
+
+        try:
+            if kind == "attach":
+                shm.close()
+                shm = shared_memory.SharedMemory(name=message[1])
+                conn.send(("ok", None))
+            elif kind == "load":
+                detector = get(message[1], message[2])
+                detector.predict([np.zeros((input_size, input_size, 3), dtype=np.uint8)])
+                conn.send(("ok", None))
+            elif kind == "predict":
+                _, model_path, device, confidence_threshold, iou_threshold, class_ids, layout = message
+                frames = [np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+                          for offset, shape, dtype in layout]
+                timings = {}
+                results = get(model_path, device).predict(frames, confidence_threshold,
+                                                          iou_threshold, class_ids, timings)
+                del frames
+                conn.send(("ok", (results, timings)))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+
+    shm.close()
+
+
+class _Worker:
+    """A worker process with its pipe and shared memory slot."""
+    def __init__(self, ctx, input_size: int, slot_bytes: int):
+        self.shm = shared_memory.SharedMemory(create=True, size=slot_bytes)
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, self.shm.name, input_size),
+                                   name="InferenceWorker", daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def request(self, message, timeout: float):
+        """Send a request and wait for its reply, raising WorkerError if the process dies."""
+        try:
+            self.conn.send(message)
+            waited = 0.
+            while not self.conn.poll(0.1):
+                waited += 0.1
+                if not self.process.is_alive():
+                    raise WorkerError(f"Inference worker exited with code {self.process.exitcode}")
+                if waited >= timeout:
+                    self.process.kill()
+                    self.process.join()
+                    raise WorkerError("Inference worker timed out")
+            status, payload = self.conn.recv()
+        except (EOFError, OSError) as e:
+            self.process.join(timeout=1)
+            raise WorkerError(f"Inference worker connection lost: {e}")
+
+        if status == "error":
+            raise WorkerError(payload)
+        return payload
+
+    def ensure_slot(self, size: int) -> None:
+        """Grow the shared memory slot to hold at least `size` bytes."""
+        if size <= self.shm.size:
+            return
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            self.request(("attach", shm.name), timeout=10)
+        except WorkerError:
+            shm.close()
+            shm.unlink()
+            raise
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = shm
+
+    def close(self) -> None:
+        """Stop the process and release the shared memory slot."""
+        try:
+            self.conn.send(("stop",))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class InferencePool:
+    """A pool of worker processes running the model outside the API process.
+
+    Each worker owns a shared memory slot. Frames of a batch are copied into the
+    slot of an idle worker and only their layout travels through the pipe, so no
+    numpy array is pickled on the way in; the compact detection arrays are the
+    only data sent back. Workers that crash are replaced and the batch is retried
+    once on the new worker.
+
+    Attributes:
+        workers : number of worker processes
+        input_size : side of the square model input
+        timeout : seconds to wait for a worker reply
+
+    Methods:
+        model() : Return a PooledDetector, loading the model on every worker.
+        predict() : Run a batch on an idle worker.
+        close() : Stop all workers.
+    """
+    def __init__(self, workers: Optional[int] = None, input_size: int = 640,
+                 slot_bytes: int = 8 * 1920 * 1080 * 3, timeout: float = 60.):
+        self.workers = workers or default_workers()
+        self.input_size = input_size
+        self.timeout = timeout
+        self._slot_bytes = slot_bytes
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._closed = False
+        for _ in range(self.workers):
+            self._idle.put(self._spawn())
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self._ctx, self.input_size, self._slot_bytes)
+
+    def _call(self, workers: List[_Worker], i: int, build_message):
+        """Run a request on `workers[i]`, replacing it and retrying once if it crashed.
+
+        A replaced worker is stored back into `workers[i]`, so the caller always
+        returns a live worker to the pool.
+        """
+        for _ in range(2):
+            worker = workers[i]
+            try:
+                return build_message(worker)
+            except WorkerError:
+                if worker.process.is_alive() or self._closed:
+                    raise
+                logger.error(f"Inference worker {worker.process.pid} crashed, restarting it")
+                worker.close()
+                workers[i] = self._spawn()
+        raise WorkerError("Inference worker crashed twice in a row")
+
+    def _run(self, build_message):
+        """Run a request on the next idle worker."""
+        workers = [self._idle.get()]
+        try:
+            return self._call(workers, 0, build_message)
+        finally:
+            self._idle.put(workers[0])
+
+    def predict(self, frames: Sequence[np.ndarray], model_path: str, device: str,
+                confidence_threshold: float, iou_threshold: float,
+                class_ids: Optional[List[int]], timings: Optional[dict] = None) -> List[np.ndarray]:
+        """Run a batch of frames on an idle worker.
+
+        The stage timings measured by the worker are stored in `timings` if
+        given, and recorded in `stage_seconds` otherwise.
+
+        Returns:
+            One array of shape (detections, 6) per frame.
+        """
+        frames = [np.ascontiguousarray(frame) for frame in frames]
+
+        def build_message(worker):
+            worker.ensure_slot(sum(frame.nbytes for frame in frames))
+            layout, offset = [], 0
+            for frame in frames:
+                np.copyto(np.ndarray(frame.shape, dtype=frame.dtype, buffer=worker.shm.buf,
+                                     offset=offset), frame)
+                layout.append((offset, frame.shape, frame.dtype.str))
+                offset += frame.nbytes
+            return worker.request(("predict", model_path, device, confidence_threshold,
+                                   iou_threshold, class_ids, layout), self.timeout)
+
+        results, stages = self._run(build_message)
+        if timings is not None:
+            timings.update(stages)
+        else:
+            for stage, seconds in stages.items():
+                stage_seconds.observe(seconds, stage)
+        return results
+
+    def load(self, model_path: str, device: str) -> None:
+        """Load and warm up a model on every worker."""
+        workers = [self._idle.get() for _ in range(self.workers)]
+        try:
+            for i in range(len(workers)):
+                self._call(workers, i, lambda w: w.request(("load", model_path, device), self.timeout))
+        finally:
+            for worker in workers:
+                self._idle.put(worker)
+
+    def model(self, model_path: str, device: str) -> "PooledDetector":
+        """Return a PooledDetector for a model, loading it on every worker."""
+        self.load(model_path, device)
+        return PooledDetector(self, model_path, device)
+
+    def close(self) -> None:
+        """Stop all workers."""
+        self._closed = True
+        for _ in range(self.workers):
+            self._idle.get().close()
+
+
+class PooledDetector:
+    """A Detector stand-in running predictions in an InferencePool.
+
+    Used as the ModelRegistry loader result in process mode, so hot-swapping
+    and thresholds work the same way as with in-process detectors.
+    """
+    def __init__(self, pool: InferencePool, model_path: str, device: str):
+        self.pool = pool
+        self.model_path = model_path
+        self.device = device
+
+    def predict(self, frames: Sequence[np.ndarray], confidence_threshold: Optional[float] = None,
+                iou_threshold: Optional[float] = None, class_ids: Optional[List[int]] = None,
+                timings: Optional[dict] = None) -> List[np.ndarray]:
+        return self.pool.predict(frames, self.model_path, self.device, confidence_threshold,
+                                 iou_threshold, class_ids, timings)
+
+
+def default_workers() -> int:
+    """Return a worker count leaving one available core to the API process."""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    return max(1, cores - 1)
@@ -0,0 +1,141 @@
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+MAX_CANDIDATES = 1000
+MAX_DETECTIONS = 300
+MAX_NMS_BOXES = 512
+
+
+def box_iou(boxes: np.ndarray) -> np.ndarray:
+    """Pairwise IOU of boxes given as (N, 4) xmin, ymin, xmax, ymax."""
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    lt = np.maximum(boxes[:, np.newaxis, :2], boxes[np.newaxis, :, :2])
+    rb = np.minimum(boxes[:, np.newaxis, 2:], boxes[np.newaxis, :, 2:])
+    wh = np.clip(rb - lt, 0, None)
+    inter = wh[..., 0] * wh[..., 1]
+    return inter / np.maximum(area[:, np.newaxis] + area[np.newaxis, :] - inter, 1e-9)
+
+def nms(boxes: np.ndarray, scores: np.ndarray, groups: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """Greedy non-maximum suppression within groups, without a per-box loop.
+
+    Boxes of different groups are moved apart so they can never overlap, which
+    makes a single IOU matrix cover all groups. Greedy NMS keeps a box if no
+    higher scored kept box overlaps it; that recursion is solved as a fixed
+    point over the whole matrix, which gives the exact greedy result after as
+    many iterations as the longest suppression chain (usually two or three).
+
+    Args:
+        boxes: Boxes of shape (N, 4) as xmin, ymin, xmax, ymax.
+        scores: Scores of shape (N,).
+        groups: Group of each box (e.g. image and class), shape (N,).
+        iou_threshold: Boxes overlapping a kept box above this are suppressed.
+
+    Returns:
+        Indices of the kept boxes, by descending score.
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    order = np.argsort(-scores, kind="stable")
+    boxes = boxes[order].astype(np.float64)
+    boxes += ((boxes.max() + 1) * groups[order])[:, np.newaxis]
+
+    overlaps = np.triu(box_iou(boxes) > iou_threshold, k=1)
+    keep = np.ones(len(boxes), dtype=bool)
+    while True:
+        update = ~(overlaps & keep[:, np.newaxis]).any(axis=0)
+        if np.array_equal(update, keep):
+            break
+        keep = update
+
+    return order[keep]
+
+def postprocess(raw: np.ndarray, scales: np.ndarray, pads: np.ndarray, image_sizes: np.ndarray,
+                confidence_threshold: float, iou_threshold: float,
+                class_ids: Optional[Sequence[int]] = None, max_candidates: int = MAX_CANDIDATES,
+                max_detections: int = MAX_DETECTIONS) -> List[np.ndarray]:
+    """Turn raw YOLO style output of a whole batch into detections.
+
+    Score filtering, class masking, per image top-k, class aware NMS and the
+    rescaling to the original images are done on the whole batch at once.
+
+    Args:
+        raw: Network output of shape (batch, candidates, 5 + classes) holding
+            cx, cy, w, h, objectness and class scores in input pixels.
+        scales: Per image (x, y) factors from image to input pixels, shape (batch, 2).
+        pads: Per image (x, y) padding added in input pixels, shape (batch, 2).
+        image_sizes: Per image (height, width), shape (batch, 2).
+        confidence_threshold: Minimum objectness times class score.
+        iou_threshold: NMS IOU threshold.
+        class_ids: Class ids to keep, None keeps all.
+        max_candidates: Maximum boxes per image going into NMS.
+        max_detections: Maximum detections per image.
+
+    Returns:
+        One array of shape (detections, 6) per image, each row holding xmin,
+        ymin, xmax, ymax, score and class id in image pixels.
+    """
+    batch = raw.shape[0]
+    scores = raw[..., 5:] * raw[..., 4:5]
+    labels = scores.argmax(axis=-1)
+    confidences = np.take_along_axis(scores, labels[..., np.newaxis], axis=-1)[..., 0]
+
+    keep = confidences >= confidence_threshold
+    if class_ids is not None:
+        keep &= np.isin(labels, class_ids)
+    images, candidates = np.nonzero(keep)
+    labels = labels[images, candidates]
+    confidences = confidences[images, candidates]
+    out = raw[images, candidates, :4]
+
+    # top-k per image: sort by image then score and rank within each image
+    order = np.lexsort((-confidences, images))
+    images, labels, confidences, out = images[order], labels[order], confidences[order], out[order]
+    first = np.searchsorted(images, np.arange(batch))
+    rank = np.arange(len(images)) - first[images]
+    topk = rank < max_candidates
+    images, labels, confidences, out = images[topk], labels[topk], confidences[topk], out[topk]
+
+    xy = out[:, :2] - out[:, 2:4] / 2
+    boxes = np.hstack([xy, xy + out[:, 2:4]])
+    boxes = (boxes - np.tile(pads[images], 2)) / np.tile(scales[images], 2)
+    limits = np.tile(image_sizes[images][:, ::-1], 2)
+    boxes = np.clip(boxes, 0, limits).astype(np.float32)
+
+    num_classes = raw.shape[-1] - 5
+    groups = images * num_classes + labels
+    by_group = np.argsort(groups, kind="stable")
+    kept = by_group[_chunked_nms(boxes[by_group], confidences[by_group], groups[by_group],
+                                 iou_threshold)]
+
+    kept = kept[np.lexsort((-confidences[kept], images[kept]))]
+    images = images[kept]
+    detections = np.hstack([
+        boxes[kept], confidences[kept, np.newaxis], labels[kept, np.newaxis],
+    ]).astype(np.float32)
+
+    bounds = np.searchsorted(images, np.arange(batch + 1))
+    return [detections[start:start + min(end - start, max_detections)]
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+def _chunked_nms(boxes, scores, groups, iou_threshold):
+    """Run `nms` on runs of whole groups holding at most MAX_NMS_BOXES boxes.
+
+    Boxes of different groups never suppress each other, so splitting the
+    input keeps the result exact while avoiding most of the quadratic IOU
+    matrix. `groups` must be sorted; a group above the limit runs on its own.
+    """
+    if len(boxes) <= MAX_NMS_BOXES:
+        return nms(boxes, scores, groups, iou_threshold)
+
+    bounds = np.flatnonzero(np.diff(groups)) + 1
+    bounds = np.concatenate([[0], bounds, [len(groups)]])
+    kept, start = [], 0
+    while start < len(boxes):
+        end = bounds[np.searchsorted(bounds, start + MAX_NMS_BOXES, side="right") - 1]
+        if end <= start:
+            end = bounds[np.searchsorted(bounds, start, side="right")]
+        kept.append(start + nms(boxes[start:end], scores[start:end], groups[start:end], iou_threshold))
+        start = end
+    return np.concatenate(kept)
@@ -0,0 +1,217 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from inference.detector import Detector, class_ids_from
+
+logger = logging.getLogger("core")
+
+
+class ActiveModel(NamedTuple):
+    """An immutable snapshot of the model in use and its thresholds.
+
+    Attributes:
+        detector : the loaded Detector
+        confidence_threshold : threshold for confidence score
+        iou_threshold : threshold for intersection over union score
+        class_ids : ids of the classes to keep, None keeps all
+        config : the model configuration the snapshot was created from
+    """
+    detector: Detector
+    confidence_threshold: float
+    iou_threshold: float
+    class_ids: Optional[List[int]]
+    config: dict
+
+
+class ModelRegistry:
+    """A class to keep loaded models warm and swap the active one atomically.
+
+    Loaded models are cached by (model_path, device) and evicted least recently
+    used first once their estimated size exceeds `memory_budget`. The active
+    model is an `ActiveModel` snapshot that is replaced with a single reference
+    assignment, so a batch that already took the snapshot finishes on the old
+    instance while new batches use the new one.
+
+    Attributes:
+        loader : callable creating a Detector from (model_path, device)
+        memory_budget : bytes of model weights kept loaded, estimated from file size
+        input_size : side of the square model input used for warmup
+        loading : (model_path, device) being loaded in the background, if any
+        last_error : error of the last failed background load, if any
+
+    Methods:
+        active() : Return the active model, loading the default one on first use.
+        predict() : Run the active model on a batch of frames.
+        configure() : Apply a model configuration.
+    """
+    def __init__(self, default_config: dict, loader: Callable[[str, str], Detector],
+                 memory_budget: int, input_size: int = 640):
+        self.loader = loader
+        self.memory_budget = memory_budget
+        self.input_size = input_size
+        self.loading = None
+        self.last_error = None
+
+        self._default_config = dict(default_config)
+        self._models: "OrderedDict[Tuple[str, str], Detector]" = OrderedDict()
+        self._sizes = {}
+        self._pending: Dict[Tuple[str, str], Future] = {}
+        self._active: Optional[ActiveModel] = None
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def _snapshot(self, detector: Detector, model_config: dict) -> ActiveModel:
+        """Create an ActiveModel for a detector and a configuration."""
+        return ActiveModel(detector, model_config["confidence_threshold"],
+                           model_config["iou_threshold"], class_ids_from(model_config["classes"]),
+                           dict(model_config))
+
+    def _get_or_load(self, key: Tuple[str, str]) -> Tuple[Detector, bool]:
+        """Return a cached detector, or load one. The flag tells if this call loaded it.
+
+        The model is loaded outside the lock; callers asking for a model that
+        is being loaded wait for that load instead of starting their own.
+        """
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key], False
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = future = Future()
+        if pending is not None:
+            return pending.result(), False
+
+        try:
+            detector = self.loader(*key)
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+        try:
+            size = os.path.getsize(key[0])
+        except OSError:
+            size = 0
+
+        with self._lock:
+            self._models[key] = detector
+            self._sizes[key] = size
+            del self._pending[key]
+            self._evict()
+        future.set_result(detector)
+        return detector, True
+
+    def _evict(self) -> None:
+        """Drop least recently used models over the budget, never the active one."""
+        active = self._active.detector if self._active is not None else None
+        for key in list(self._models):
+            if sum(self._sizes.values()) <= self.memory_budget:
+                break
+            if self._models[key] is active or key == self.loading:
+                continue
+            logger.info(f"Evicting model {key[0]} ({key[1]})")
+            del self._models[key]
+            del self._sizes[key]
+
+    def warmup(self, detector: Detector) -> None:
+        """Run a blank frame through a detector so the first request is not slow."""
+        detector.predict([np.zeros((self.input_size, self.input_size, 3), dtype=np.uint8)])
+
+    def active(self) -> ActiveModel:
+        """Return the active model, loading the default one on first use."""
+        active = self._active
+        if active is None:
+            key = (self._default_config["model_path"], self._default_config["device"])
+            detector, _ = self._get_or_load(key)
+            with self._lock:
+                if self._active is None:
+                    self._active = self._snapshot(detector, self._default_config)
+                active = self._active
+        return active
+
+    def config_key(self) -> tuple:
+        """Return a hashable description of the configuration requests are served with.
+
+        Unlike `active()`, this never loads a model.
+        """
+        active = self._active
+        model_config = active.config if active is not None else self._default_config
+        class_ids = class_ids_from(model_config["classes"])
+        return (model_config["model_path"], model_config["device"], model_config["confidence_threshold"],
+                model_config["iou_threshold"], tuple(class_ids) if class_ids is not None else None)
+
+    def predict(self, frames: Sequence[np.ndarray], timings: Optional[dict] = None) -> List[np.ndarray]:
+        """Run the active model on a batch of frames with its thresholds.
+
+        `timings`, if given, receives the seconds of the model stages instead
+        of them being recorded in the metrics.
+        """
+        active = self.active()
+        return active.detector.predict(frames, active.confidence_threshold,
+                                       active.iou_threshold, active.class_ids, timings)
+
+    def configure(self, model_config: dict) -> str:
+        """Apply a model configuration.
+
+        Threshold and class changes for the active model apply immediately. A
+        different model is loaded (or taken from the cache), warmed up and
+        swapped in on a background thread; until then the current model keeps
+        serving requests.
+
+        Args:
+            model_config: A dict with the fields of `ModelConfig`.
+
+        Returns:
+            "applied" if the configuration is active, "loading" otherwise.
+        """
+        key = (model_config["model_path"], model_config["device"])
+
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            active = self._active
+            if active is None:
+                # nothing loaded yet, the first request loads this configuration
+                self._default_config = dict(model_config)
+                self.loading = None
+                return "applied"
+            if (active.config["model_path"], active.config["device"]) == key:
+                self._active = self._snapshot(active.detector, model_config)
+                self.loading = None
+                return "applied"
+            self.loading = key
+
+        thread = threading.Thread(target=self._swap, args=(key, model_config, generation),
+                                  name="ModelRegistry-swap", daemon=True)
+        thread.start()
+        return "loading"
+
+    def _swap(self, key: Tuple[str, str], model_config: dict, generation: int) -> None:
+        """Load and warm up a model, then make it active unless superseded."""
+        try:
+            detector, loaded = self._get_or_load(key)
+            if loaded:
+                self.warmup(detector)
+        except Exception as e:
+            logger.error(f"Could not load model {key[0]} ({key[1]}): {e}")
+            with self._lock:
+                if self._generation == generation:
+                    self.loading = None
+                    self.last_error = str(e)
+            return
+
+        with self._lock:
+            if self._generation != generation:
+                return
+            self._active = self._snapshot(detector, model_config)
+            self.loading = None
+            self.last_error = None
+            self._evict()
+        logger.info(f"Model {key[0]} ({key[1]}) is active")
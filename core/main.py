@@ -2,11 +2,14 @@ from typing import Any
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 
 from config import config
-from routers import data, cv
+from routers import admin, data, cv
 from util.log import setup_logging
+from util.metrics import PROMETHEUS_MEDIA_TYPE, metrics
+from util.tracing import TraceMiddleware
+from util.upload import UploadLimitMiddleware
 
 app = FastAPI(
     title = config.PROJECT_NAME + " API",
@@ -21,8 +24,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(
+    UploadLimitMiddleware,
+    limits={
+        "/cv/infer_image": config.MAX_UPLOAD_BYTES,
+        "/cv/infer_video": config.MAX_VIDEO_UPLOAD_BYTES,
+    },
+)
+
+app.add_middleware(
+    TraceMiddleware,
+    thresholds=config.TRACE_SLOW_REQUESTS,
+    directory=config.TRACE_DIR,
+    max_files=config.TRACE_MAX_FILES,
+    sample_interval=config.TRACE_SAMPLE_INTERVAL,
+)
+
 app.include_router(cv.cv_router)
 app.include_router(data.data_router)
+if config.ADMIN_ENDPOINTS:
+    app.include_router(admin.admin_router)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -46,11 +67,21 @@ def index(request: Request) -> Any:
         "</body>"
         "</html>"
     )
-    logger.info(f"Index page requested by {request.client.host}")
+    logger.info("Index page requested", extra={"client": request.client.host, "sample": config.LOG_ACCESS_SAMPLE})
     return HTMLResponse(content=body)
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics() -> Any:
+    """Returns the stage latency histograms, per-camera throughput and queue metrics.
+
+    Returns:
+        The metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_MEDIA_TYPE)
+
+
 if __name__ == "__main__":
     import uvicorn
-    logger.info(f"Starting API server on {config.API_HOST}:{config.API_PORT}")
+    logger.info("Starting API server", extra={"host": config.API_HOST, "port": config.API_PORT})
     uvicorn.run(app, host=config.API_HOST, port=config.API_PORT)
@@ -0,0 +1,58 @@
+import asyncio
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+
+from config import config
+from util.profiler import sample_stacks
+
+
+async def require_admin_token(authorization: Optional[str] = Header(None)) -> None:
+    """Reject requests without the `config.ADMIN_TOKEN` bearer token.
+
+    A custom header also makes browsers preflight cross-origin requests, so
+    a page on another origin cannot start a profile.
+
+    Raises:
+        HTTPException: If no token is configured or the request does not carry it.
+    """
+    scheme, _, token = (authorization or "").partition(" ")
+    if not config.ADMIN_TOKEN or scheme.lower() != "bearer" or \
+            not secrets.compare_digest(token.encode("utf-8"), config.ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
+
+
+admin_router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(require_admin_token)],
+)
+
+profiling = asyncio.Lock()
+
+
+@admin_router.get("/profile", response_class=PlainTextResponse)
+async def profile(seconds: float = Query(config.PROFILE_SECONDS, gt=0, le=config.PROFILE_MAX_SECONDS),
+                  interval: float = Query(config.PROFILE_INTERVAL, ge=0.001, le=1.),
+                  idle: bool = False):
+    """Sample the stacks of the live process and return them as collapsed stacks.
+
+    Args:
+        seconds: How long to sample.
+        interval: Seconds between two samples.
+        idle: Also count the stacks of threads waiting for work.
+
+    Returns:
+        A flamegraph-compatible collapsed stack file.
+
+    Raises:
+        HTTPException: If a profile is already running.
+    """
+    if profiling.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    async with profiling:
+        stacks = await run_in_threadpool(sample_stacks, seconds, interval, idle)
+    return PlainTextResponse(stacks, headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'})
@@ -1,12 +1,41 @@
+import asyncio
+import os
 import time
+from collections import deque
 from enum import Enum
 from typing import List, Optional
 
-from fastapi import APIRouter, UploadFile, File
+from datetime import datetime
+
+import anyio
+
+from fastapi import APIRouter, HTTPException, Query, Request, UploadFile, File, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response as RawResponse, StreamingResponse
+import orjson
 from pydantic import BaseModel
 
+from config import config
+from inference.batcher import BatchInfo, InferenceBatcher
+from inference.cache import ResultCache
+from inference.detector import Detector
+from inference.pool import InferencePool, WorkerError, default_workers
+from inference.registry import ModelRegistry
 from util.helper import *
-from stream.stream_capture import StreamCapture
+from util.history import history_store
+from util.metrics import MetricFamily, metrics, stage_seconds
+from util.tracing import add_span, span
+from util.writer import OutputWriter
+from util.columnar import (COLUMNAR_JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, columnar_media_type,
+                           columnar_results, encode_columnar)
+from stream.hub import capture_hub
+from stream.ingest import CreditWindow, unpack_ingest_frame
+from stream.mjpeg import MJPEG_MEDIA_TYPE, AdaptiveRate, mjpeg_part
+from stream.motion import MotionGate, MotionStats
+from stream.recorder import SegmentRecorder
+from stream.scheduler import FrameScheduler
+from stream.stream_capture import StreamHealth
+from stream.video import SampleMode, open_video, sample_frames, save_chunks
 
 import logging
 logger = logging.getLogger("core")
@@ -34,9 +63,17 @@ class Processing(BaseModel):
     Attributes:
         detection : float value representing detection information
         recognition : float value representing recognition information
+        batch_size : number of frames in the inference batch
+        queue_wait : seconds spent waiting for the inference batch to start
+        batch_latency : seconds taken by the batched forward pass
+        cached : True if the results were taken from the result cache
     """
     detection: float
     recognition: float
+    batch_size: Optional[int] = None
+    queue_wait: Optional[float] = None
+    batch_latency: Optional[float] = None
+    cached: Optional[bool] = None
 
 class Box(BaseModel):
     """A class to represent a box.
@@ -58,9 +95,11 @@ class Result(BaseModel):
     Attributes:
         box : an instance of the Box class
         d_score : a float representing the score for detection
+        class_id : id of the detected class
     """
     box: Box
     d_score: float
+    class_id: Optional[int] = None
 
 class Response(BaseModel):
     """A class representing the response from frame processing.
@@ -90,26 +129,233 @@ class Frame(BaseModel):
     """A class to represent a frame.
 
     Attributes:
-        frame : the frame string
+        frame : the frame string, a base64 encoded binary frame (see `encode_frame_b64`)
     """
     frame: str
 
+class ColumnarResults(BaseModel):
+    """A class to represent results as parallel arrays, one entry per detection.
+
+    Attributes:
+        xmin : minimum x-coordinates of the boxes
+        ymin : minimum y-coordinates of the boxes
+        xmax : maximum x-coordinates of the boxes
+        ymax : maximum y-coordinates of the boxes
+        d_score : scores for detection
+        class_id : ids of the detected classes
+    """
+    xmin: List[int]
+    ymin: List[int]
+    xmax: List[int]
+    ymax: List[int]
+    d_score: List[float]
+    class_id: List[int]
+
+class ColumnarResponse(BaseModel):
+    """A class representing the columnar response from frame processing.
+
+    Same as Response, with the results as a ColumnarResults. It documents the
+    `format=columnar` output; the payload is encoded without building it.
+    """
+    processing_time: Processing
+    results: ColumnarResults
+    filename: str
+    camera_id: Optional[str] = None
+    timestamp: str
+
+class ResponseFormat(str, Enum):
+    """A class to represent the layout of the results in a response.
+    """
+    objects = "objects"
+    columnar = "columnar"
+
 class Camera(str, Enum):
     """A class to represent camera locations.
     """
     test = "test"
     # TODO: add camera locations
 
-def create_response(np_img, results, start_det_time, end_det_time, source, source_name):
-    # TODO: create Response object from results
-    pass
-    
+def detection_arrays(image_shape, results):
+    """Round detections to integer boxes clipped to the image.
+
+    Args:
+        image_shape: Shape of the processed image.
+        results: Detections of shape (N, 6), each row holding xmin, ymin, xmax,
+            ymax, score and class id.
+
+    Returns:
+        The integer boxes of shape (N, 4) and the detections as float32 (N, 6).
+    """
+    height, width = image_shape[:2]
+    detections = np.asarray(results, dtype=np.float32).reshape(-1, 6)
+    coords = np.rint(detections[:, :4]).astype(np.int64)
+    coords[:, [0, 2]] = np.clip(coords[:, [0, 2]], 0, width - 1)
+    coords[:, [1, 3]] = np.clip(coords[:, [1, 3]], 0, height - 1)
+    return coords, detections
+
+def create_processing(start_det_time, end_det_time, batch=None, cached=None):
+    """Create the Processing object of a response."""
+    processing = Processing(detection=end_det_time - start_det_time, recognition=0., cached=cached)
+    if batch is not None:
+        processing.batch_size = batch.batch_size
+        processing.queue_wait = batch.queue_wait
+        processing.batch_latency = batch.batch_latency
+    return processing
+
+def create_response(image_shape, results, start_det_time, end_det_time, source, source_name, batch=None,
+                    cached=None):
+    """Create a Response object from detections.
+
+    Args:
+        image_shape: Shape of the processed image, used to clip boxes to its bounds.
+        results: Detections of shape (N, 6), each row holding xmin, ymin, xmax,
+            ymax, score and class id.
+        start_det_time: time.time() before the detection started.
+        end_det_time: time.time() after the detection finished.
+        source: Camera ID for stream frames, None for uploaded images.
+        source_name: Name of the file or frame.
+        batch: Optional BatchInfo of the inference batch.
+
+    Returns:
+        The Response object.
+    """
+    coords, detections = detection_arrays(image_shape, results)
+
+    return Response(
+        processing_time=create_processing(start_det_time, end_det_time, batch, cached),
+        results=[
+            Result(box=Box(xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax),
+                   d_score=float(score), class_id=int(class_id))
+            for (xmin, ymin, xmax, ymax), score, class_id
+            in zip(coords.tolist(), detections[:, 4].tolist(), detections[:, 5].tolist())
+        ],
+        filename=source_name,
+        camera_id=source,
+        timestamp=datetime.now().isoformat(),
+    )
+
+def columnar_payload(image_shape, results, start_det_time, end_det_time, source, source_name, batch=None,
+                     cached=None):
+    """Create the ColumnarResponse fields from detections, with numpy columns.
+
+    No model is built per detection: the columns go from numpy straight to
+    the encoder.
+
+    Args:
+        image_shape: Shape of the processed image, used to clip boxes to its bounds.
+        results: Detections of shape (N, 6).
+        start_det_time: time.time() before the detection started.
+        end_det_time: time.time() after the detection finished.
+        source: Camera ID for stream frames, None for uploaded images.
+        source_name: Name of the file or frame.
+        batch: Optional BatchInfo of the inference batch.
+
+    Returns:
+        A dict to be encoded with `encode_columnar`.
+    """
+    coords, detections = detection_arrays(image_shape, results)
+    return {
+        "processing_time": create_processing(start_det_time, end_det_time, batch, cached).model_dump(),
+        "results": columnar_results(coords, detections),
+        "filename": source_name,
+        "camera_id": source,
+        "timestamp": datetime.now().isoformat(),
+    }
+
+def create_columnar_response(image_shape, results, start_det_time, end_det_time, source, source_name,
+                             media_type, batch=None, cached=None):
+    """Create an encoded ColumnarResponse from detections.
+
+    Args:
+        image_shape: Shape of the processed image, used to clip boxes to its bounds.
+        results: Detections of shape (N, 6).
+        start_det_time: time.time() before the detection started.
+        end_det_time: time.time() after the detection finished.
+        source: Camera ID for stream frames, None for uploaded images.
+        source_name: Name of the file or frame.
+        media_type: COLUMNAR_JSON_MEDIA_TYPE or MSGPACK_MEDIA_TYPE.
+        batch: Optional BatchInfo of the inference batch.
+
+    Returns:
+        The HTTP response.
+    """
+    payload = columnar_payload(image_shape, results, start_det_time, end_det_time, source, source_name,
+                               batch, cached)
+    return RawResponse(encode_columnar(payload, media_type), media_type=media_type)
+
+pool = None
+
+def get_pool() -> InferencePool:
+    """Return the inference process pool, starting it on first use."""
+    global pool
+    if pool is None:
+        pool = InferencePool(config.INFERENCE_WORKERS, config.MODEL_INPUT_SIZE)
+    return pool
+
+def load_model(model_path: str, device: str):
+    """Load a model in the API process or on the worker processes, per `config.INFERENCE_MODE`."""
+    if config.INFERENCE_MODE == "process":
+        return get_pool().model(model_path, device)
+    return Detector(model_path, device, config.MODEL_INPUT_SIZE)
+
+registry = ModelRegistry(config.DEFAULT_CONFIG, load_model,
+                         config.MODEL_MEMORY_BUDGET, config.MODEL_INPUT_SIZE)
+
+batcher = InferenceBatcher(
+    registry.predict, config.BATCH_MAX_SIZE, config.BATCH_MAX_WAIT,
+    concurrency=(config.INFERENCE_WORKERS or default_workers()) if config.INFERENCE_MODE == "process" else 1,
+)
+
+result_cache = ResultCache(config.RESULT_CACHE_MAX_BYTES, config.RESULT_CACHE_TTL)
+
+output_writer = OutputWriter(config.OUTPUT_QUEUE_SIZE, config.OUTPUT_FORMAT, config.OUTPUT_QUALITY,
+                             config.OUTPUT_EVERY_N, config.OUTPUT_ONLY_DETECTIONS)
+
+async def run_model(np_img):
+    """Run the model on an image through the batcher.
+
+    Args:
+        np_img: The RGB image.
+
+    Returns:
+        The detections and the BatchInfo of the batch.
+
+    Raises:
+        HTTPException: If the model cannot be loaded or run.
+    """
+    start = time.perf_counter()
+    try:
+        with span("model"):
+            results, batch = await batcher.infer(np_img)
+    except (cv2.error, WorkerError) as e:
+        logger.error(f"Model error: {e}")
+        raise HTTPException(status_code=503, detail="Model is not available")
+
+    # the batch stages of a traced request, laid out after its queue wait
+    add_span("queue", start, batch.queue_wait)
+    start += batch.queue_wait
+    for stage in ("preprocess", "inference", "postprocess"):
+        seconds = (batch.stages or {}).get(stage, 0.)
+        add_span(stage, start, seconds)
+        start += seconds
+    return results, batch
+
 
 cv_router = APIRouter(
     prefix="/cv",
     tags=["main"]
 )
 
+@cv_router.on_event("shutdown")
+def shutdown():
+    """Write the pending output images, recordings and history, and stop the inference worker processes."""
+    output_writer.close()
+    history_store.close()
+    for recorder in recorders.values():
+        recorder.close()
+    if pool is not None:
+        pool.close()
+
 @cv_router.get("/")
 async def index():
     """Index route."""
@@ -117,33 +363,624 @@ async def index():
 
 @cv_router.post("/set_config/")
 async def set_config(model_config: ModelConfig):
+    """Set the model configuration.
+
+    Threshold and class changes apply immediately. Switching to another model
+    loads and warms it up in the background; requests keep using the current
+    model until the new one is ready.
+
+    Args:
+        model_config: The model configuration.
+
+    Returns:
+        A dict with an info message and the configuration.
+    """
     logger.info("Setting config...")
-    # TODO: implement your code here
-    pass
+    status = registry.configure(model_config.model_dump())
+    result_cache.clear()
+    if status == "loading":
+        info = f"Loading model {model_config.model_path}, the current model is used until it is ready"
+    else:
+        info = "Config applied"
+    return {"info": info, "config": model_config}
+
+@cv_router.post("/infer_image", response_model=Response, responses={200: {"content": {
+    COLUMNAR_JSON_MEDIA_TYPE: {}, MSGPACK_MEDIA_TYPE: {},
+}}})
+async def infer_image(request: Request, file: UploadFile = File(...),
+                      format: ResponseFormat = ResponseFormat.objects):
+    """Run the model on an uploaded image.
+
+    The results are a list of Result objects by default. With `format=columnar`
+    or an Accept header of `application/vnd.detections.columnar+json` or
+    `application/msgpack` they are returned as a ColumnarResponse instead.
+
+    The upload is read in place from its spooled buffer. Only JPEG and PNG
+    images are accepted, as their size is read from the header and checked
+    against `config.MAX_IMAGE_PIXELS` before decoding. JPEG images much
+    larger than the model input are decoded at a reduced resolution, and the
+    detections are scaled back to the full image. Results are cached by the
+    content of the upload and the model configuration, so a re-submitted image
+    is neither decoded nor processed again.
+
+    The Response is encoded with orjson directly, and hashing, decoding, the
+    model and encoding are recorded as spans of the request trace.
+
+    Args:
+        request: The HTTP request.
+        file: The uploaded image.
+        format: Layout of the results.
+
+    Returns:
+        The Response with the detections.
+    """
+    media_type = columnar_media_type(request.headers.get("accept"),
+                                     format == ResponseFormat.columnar)
+    config_key = registry.config_key()
+    filename = file.filename or "upload"
+    with file_buffer(file.file) as data:
+        with span("hash"):
+            key = await run_in_threadpool(ResultCache.key, data, config_key)
+        start_det_time = time.time()
+        cached = result_cache.get(key)
+        if cached is None:
+            with span("decode"):
+                np_img, image_shape = await run_in_threadpool(decode_upload, data)
+
+    if cached is not None:
+        (results, image_shape), batch = cached, None
+    else:
+        results, batch = await run_model(np_img)
+        if config.OUTPUT_SAVE_IMAGES:
+            output_writer.submit(np_img, config.TEMP_IMAGE_OUT,
+                                 f"{datetime.now():%Y%m%dT%H%M%S%f}_{os.path.splitext(filename)[0]}",
+                                 results)
+        results = scale_results(results, np_img.shape, image_shape)
+        if registry.config_key() == config_key:
+            result_cache.put(key, (results, image_shape), results.nbytes)
+    end_det_time = time.time()
+
+    with span("serialize"):
+        if media_type is not None:
+            return create_columnar_response(image_shape, results, start_det_time, end_det_time, None,
+                                            filename, media_type, batch, cached is not None)
+        response = create_response(image_shape, results, start_det_time, end_det_time, None, filename,
+                                   batch, cached is not None)
+        return RawResponse(orjson.dumps(response.model_dump()), media_type="application/json")
+
+def decode_upload(data):
+    """Decode an uploaded image at the lowest resolution the model input allows.
+
+    Args:
+        data: The encoded image.
+
+    Returns:
+        The RGB image and the shape of the image at full resolution.
+
+    Raises:
+        HTTPException: If the image is empty, is not a JPEG or PNG image (the
+            formats whose size is checked before decoding), has more than
+            `config.MAX_IMAGE_PIXELS` pixels or cannot be decoded.
+    """
+    if len(data) == 0:
+        raise HTTPException(status_code=400, detail="Empty image")
+    info = image_info(data)
+    if info is None:
+        raise HTTPException(status_code=415, detail="Only JPEG and PNG images are supported")
+    image_format, width, height = info
+    if width * height > config.MAX_IMAGE_PIXELS:
+        raise HTTPException(status_code=413, detail=f"Image larger than {config.MAX_IMAGE_PIXELS} pixels")
+    reduction = 1
+    if image_format == "jpeg":
+        reduction = max(r for r in (1, 2, 4, 8) if r == 1 or max(width, height) / r >= config.MODEL_INPUT_SIZE)
+
+    try:
+        with stage_seconds.time("decode"):
+            np_img = decode_image(data, reduction)
+    except cv2.error:
+        np_img = None
+    if np_img is None:
+        raise HTTPException(status_code=400, detail="Could not decode image")
+    if reduction == 1:
+        return np_img, np_img.shape
+
+    # EXIF orientation may have swapped the sides of the header's size
+    if (np_img.shape[0] > np_img.shape[1]) != (height > width):
+        width, height = height, width
+    return np_img, (height, width) + np_img.shape[2:]
+
+def scale_results(results, decoded_shape, image_shape):
+    """Scale detections on a reduced resolution image to the full resolution image."""
+    if tuple(decoded_shape[:2]) == tuple(image_shape[:2]):
+        return results
+    results = np.array(results, dtype=np.float32).reshape(-1, 6)
+    results[:, [0, 2]] *= image_shape[1] / decoded_shape[1]
+    results[:, [1, 3]] *= image_shape[0] / decoded_shape[0]
+    return results
+
+def ndjson_line(payload: dict) -> bytes:
+    """Encode a payload, which may hold numpy columns, as one NDJSON line."""
+    return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE)
+
+async def run_timed(np_img):
+    """Run the model on an image, returning the detections, BatchInfo and start and end times."""
+    start_det_time = time.time()
+    results, batch = await run_model(np_img)
+    return results, batch, start_det_time, time.time()
 
-@cv_router.post("/infer_image", response_model=Response)
-async def infer_image(file: UploadFile = File(...)):
-    # TODO: implement your code here
-    pass
+async def infer_video_frames(request: Request, path: str, frames, source_name: str, columnar: bool):
+    """Run the model on sampled video frames and yield one NDJSON line per frame.
 
-def infer_stream(rtsp_url, camera):
-    prev = 0
-    FPS = 60 # how often to read from the stream
+    Decoding runs in the thread pool one frame at a time, and up to
+    `config.VIDEO_MAX_IN_FLIGHT` frames are in the batcher at once, so decoding
+    and inference overlap while results are still written in frame order. The
+    video file is removed when the generator ends, including when it is
+    cancelled by a client disconnect.
 
-    stream = StreamCapture(rtsp_url, reset_attempts=2, reset_delay=5)
+    Args:
+        request: The HTTP request of the client.
+        path: Path of the uploaded video.
+        frames: Iterator of VideoFrame from `sample_frames`.
+        source_name: Name of the uploaded video.
+        columnar: Write results as ColumnarResults instead of Result lists.
 
-    while True:
-        time_elapsed = time.time() - prev 
+    Yields:
+        JSON lines holding a Response (or ColumnarResponse) with the
+        `frame_index` and `frame_time` of the frame.
+    """
+    pending = deque()
+    try:
+        while not await request.is_disconnected():
+            vframe = await run_in_threadpool(next, frames, None)
+            if vframe is not None:
+                pending.append((vframe, asyncio.ensure_future(run_timed(vframe.frame))))
+
+            while pending and (vframe is None or pending[0][1].done()
+                               or len(pending) >= config.VIDEO_MAX_IN_FLIGHT):
+                done, task = pending.popleft()
+                name = f"{source_name}_{done.index}"
+                try:
+                    results, batch, start_det_time, end_det_time = await task
+                except HTTPException as e:
+                    yield ndjson_line({"frame_index": done.index, "frame_time": done.time,
+                                       "filename": name, "error": e.detail})
+                    return
+
+                if columnar:
+                    payload = columnar_payload(done.frame.shape, results, start_det_time, end_det_time,
+                                               None, name, batch)
+                else:
+                    payload = create_response(done.frame.shape, results, start_det_time, end_det_time,
+                                              None, name, batch).model_dump()
+                payload.update(frame_index=done.index, frame_time=done.time)
+                yield ndjson_line(payload)
+
+            if vframe is None:
+                break
+    finally:
+        for _, task in pending:
+            task.cancel()
+        # shielded, as a client disconnect cancels the response and the upload must still be removed
+        with anyio.CancelScope(shield=True):
+            try:
+                await run_in_threadpool(frames.close)
+            finally:
+                os.remove(path)
+
+@cv_router.post("/infer_video")
+async def infer_video(request: Request,
+                      mode: SampleMode = SampleMode(config.VIDEO_SAMPLE_MODE),
+                      stride: int = Query(config.VIDEO_SAMPLE_STRIDE, ge=1),
+                      interval: float = Query(config.VIDEO_SAMPLE_INTERVAL, gt=0),
+                      max_frames: Optional[int] = Query(None, ge=1),
+                      format: ResponseFormat = ResponseFormat.objects):
+    """Run the model on sampled frames of an uploaded video.
+
+    The video is sent either as the raw request body or as the `video` field
+    of a multipart form, and is written to disk in chunks of
+    `config.VIDEO_CHUNK_SIZE`. Results are streamed back as NDJSON, one line
+    per sampled frame, while the rest of the video is still being processed.
+
+    Args:
+        request: The HTTP request with the video.
+        mode: How frames are sampled.
+        stride: Sampling stride in frames, for the stride mode.
+        interval: Sampling interval in seconds, for the time mode.
+        max_frames: Maximum number of frames to process.
+        format: Layout of the results of each frame.
+
+    Returns:
+        A StreamingResponse of `application/x-ndjson` lines.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        video = form.get("video")
+        if video is None or isinstance(video, str):
+            raise HTTPException(status_code=400, detail="Missing video file")
+        source_name = video.filename or "video"
+
+        async def chunks():
+            while chunk := await video.read(config.VIDEO_CHUNK_SIZE):
+                yield chunk
+    else:
+        source_name = request.headers.get("x-filename", "video")
+        chunks = request.stream
+
+    path = await save_chunks(chunks(), config.TEMP_VIDEO_OUT, os.path.splitext(source_name)[1])
+    try:
+        await run_in_threadpool(lambda: open_video(path).release())
+    except ValueError:
+        os.remove(path)
+        raise HTTPException(status_code=400, detail=f"Could not open video {source_name}")
+
+    frames = sample_frames(path, mode, stride, interval, max_frames)
+    return StreamingResponse(
+        infer_video_frames(request, path, frames, source_name, format == ResponseFormat.columnar),
+        media_type="application/x-ndjson",
+    )
+
+def get_stream_url(camera: str) -> str:
+    """Build the RTSP URL of a camera from `config.STREAMS`.
+
+    A "url" entry of the stream, e.g. a local video file, is used as is.
+
+    Args:
+        camera: Name of the camera.
+
+    Returns:
+        The RTSP URL of the camera.
+
+    Raises:
+        HTTPException: If the camera is not configured.
+    """
+    if camera not in config.STREAMS:
+        raise HTTPException(status_code=404, detail=f"Camera {camera} is not configured")
 
-        rframe = stream.read()
+    stream = config.STREAMS[camera]
+    if stream.get("url"):
+        return stream["url"]
+    return (f"rtsp://{stream['username']}:{stream['password']}@{stream['address']}"
+            f":{stream['port']}/{stream['endpoint']}")
 
-        if time_elapsed > 1./FPS:
-            prev = time.time()
-            # TODO: implement your code here, use the infer_image function to process the frame
-            # TODO: use the create_response function to create a Response object and return it
-            pass
+motion_stats = {}
+
+scheduler = FrameScheduler(config.SCHEDULER_MAX_QUEUE_WAIT, config.SCHEDULER_MIN_FPS)
+
+def get_motion_gate(camera: str) -> MotionGate:
+    """Create a MotionGate for a client of a camera, recording into the camera's MotionStats."""
+    stats = motion_stats.setdefault(camera, MotionStats())
+    threshold = config.STREAMS[camera].get("motion_threshold", config.MOTION_THRESHOLD)
+    return MotionGate(threshold, config.MOTION_PIXEL_THRESHOLD, config.MOTION_WIDTH,
+                      config.MOTION_ALPHA, config.MOTION_MAX_SKIP, stats)
+
+recorders = {}
+
+def get_recorder(camera: str) -> Optional[SegmentRecorder]:
+    """Return the SegmentRecorder of a camera, None if recording is off for it."""
+    stream = config.STREAMS[camera]
+    if not stream.get("record", False):
+        return None
+    if camera not in recorders:
+        recorders[camera] = SegmentRecorder(
+            os.path.join(config.TEMP_VIDEO_OUT, camera), camera,
+            stream.get("fps", config.STREAM_TARGET_FPS), config.RECORD_SEGMENT_SECONDS,
+            config.RECORD_MAX_BYTES, config.RECORD_MAX_AGE, config.RECORD_FOURCC, config.RECORD_QUEUE_SIZE)
+    return recorders[camera]
+
+def annotate_jpeg(np_img, response, quality):
+    """Draw the results of a response on a frame and encode it as JPEG."""
+    results = response.results if response is not None else []
+    np_img = draw_results(np_img, results)
+    with stage_seconds.time("encode"):
+        return encode_jpeg(np_img, quality)
+
+async def infer_stream(request: Request, rtsp_url: str, camera: Camera):
+    """Run the model on a camera stream and yield annotated MJPEG parts.
+
+    Frames are paced by a Lane of the frame scheduler, which sleeps until the
+    camera's next slot and lowers its frame rate fairly with the other cameras
+    when the model is overloaded. A per-client AdaptiveRate caps it further: a
+    client that reads slowly gets a lower frame rate and JPEG quality instead
+    of a growing backlog. A MotionGate skips the model on frames of a static
+    scene and the previous results are drawn instead. The results of the
+    frames the model ran on are stored in the detection history. The generator
+    stops, releasing its stream subscription, as soon as the client
+    disconnects or the stream dies.
+
+    Args:
+        request: The HTTP request of the client.
+        rtsp_url: URL of the camera stream.
+        camera: The camera being streamed.
+
+    Yields:
+        Multipart MJPEG parts.
+    """
+    rate = AdaptiveRate(config.MJPEG_MAX_FPS, config.MJPEG_MIN_FPS,
+                        config.MJPEG_MAX_QUALITY, config.MJPEG_MIN_QUALITY)
+    gate = get_motion_gate(camera.value)
+    recorder = get_recorder(camera.value)
+    target_fps = config.STREAMS[camera.value].get("fps", config.STREAM_TARGET_FPS)
+
+    with capture_hub.subscribe(rtsp_url, reset_attempts=2, reset_delay=5) as stream, \
+            scheduler.lane(camera.value, target_fps) as lane:
+        last_seq = 0
+        response = None
+
+        while not await request.is_disconnected():
+            await lane.wait(rate.fps)
+
+            rframe = await run_in_threadpool(stream.read, lane.interval)
+            if stream.health == StreamHealth.dead:
+                logger.warning(f"Stream of camera {camera.value} is dead")
+                break
+            if rframe is None or rframe.seq == last_seq:
+                continue
+            last_seq = rframe.seq
+
+            if await run_in_threadpool(gate.check, rframe.frame) or response is None:
+                start_det_time = time.time()
+                try:
+                    results, batch = await run_model(rframe.frame)
+                except HTTPException:
+                    results, batch = [], None
+                end_det_time = time.time()
+                if batch is not None:
+                    lane.report(batch.queue_wait)
+                    if config.HISTORY_ENABLED:
+                        history_store.add(camera.value, rframe.timestamp, results, end_det_time - start_det_time,
+                                          batch.queue_wait, batch.batch_size)
+                response = create_response(rframe.frame.shape, results, start_det_time, end_det_time,
+                                           camera.value, f"{camera.value}_{rframe.seq}", batch)
+            if recorder is not None:
+                recorder.submit(rframe.frame, rframe.timestamp, results)
+            if config.OUTPUT_SAVE_STREAM:
+                output_writer.submit(rframe.frame, os.path.join(config.TEMP_STREAM_OUT, camera.value),
+                                     f"{camera.value}_{rframe.seq}", results, key=camera.value)
+
+            jpeg = await run_in_threadpool(annotate_jpeg, rframe.frame, response, rate.quality)
+
+            start_send = time.monotonic()
+            yield mjpeg_part(jpeg)
+            rate.update(time.monotonic() - start_send)
 
 @cv_router.get("/{camera}/infer_stream")
-def infer_camera_stream(camera: Camera):
-    # TODO: implement your code here
-    pass
\ No newline at end of file
+async def infer_camera_stream(camera: Camera, request: Request):
+    """Stream annotated frames of a camera as multipart MJPEG.
+
+    Args:
+        camera: The camera to stream.
+        request: The HTTP request of the client.
+
+    Returns:
+        A StreamingResponse to be used as the source of an `<img>` tag.
+    """
+    rtsp_url = get_stream_url(camera.value)
+    return StreamingResponse(infer_stream(request, rtsp_url, camera), media_type=MJPEG_MEDIA_TYPE)
+
+def decode_ingest(data):
+    """Decode a frame pushed to the ingest endpoint.
+
+    Args:
+        data: The binary WebSocket message, see `pack_ingest_frame`.
+
+    Returns:
+        The camera id, the capture timestamp and the RGB frame. Raw frames are
+        a view of `data`.
+
+    Raises:
+        ValueError: If the message is malformed, or the frame is not an RGB
+            uint8 image of at most `config.MAX_IMAGE_PIXELS` pixels.
+    """
+    camera, timestamp, frame = unpack_ingest_frame(data)
+    codec, shape, payload = frame_info(frame)
+    if len(shape) != 3 or shape[2] != 3:
+        raise ValueError("Frames must be RGB images")
+    if shape[0] * shape[1] > config.MAX_IMAGE_PIXELS:
+        raise ValueError(f"Frame larger than {config.MAX_IMAGE_PIXELS} pixels")
+    if codec != "raw":
+        # the header is only a claim: the encoded image itself must have that size before it is decoded
+        info = image_info(payload)
+        if info is None or info[0] != codec:
+            raise ValueError(f"Frame payload is not a {codec} image")
+        if (info[2], info[1]) != tuple(shape[:2]):
+            raise ValueError("Frame payload size does not match the header")
+
+    with stage_seconds.time("decode"):
+        np_img = frame_from_bytes(frame)
+    if np_img.dtype != np.uint8:
+        raise ValueError("Frames must be uint8 images")
+    return camera, timestamp, np_img
+
+ingest_windows = set()
+
+@cv_router.websocket("/ingest")
+async def ingest(websocket: WebSocket):
+    """Run the model on frames pushed by clients, e.g. edge boxes of cameras behind NAT.
+
+    Clients send binary messages built by `pack_ingest_frame`: a camera id, a
+    capture timestamp and a raw, JPEG or PNG frame. Frames are processed
+    concurrently, so the frames of a connection are batched together, and each
+    is answered on the same socket with a JSON text message as soon as it is
+    done:
+
+        {"type": "response", "seq": n, "timestamp": t, "credit": k, "response": Response}
+        {"type": "error", "seq": n, "detail": "...", "credit": k}
+
+    where `seq` numbers the frames of the connection from 1 and `timestamp` is
+    the capture timestamp of the frame. Flow control is credit based: the
+    server first sends {"type": "credit", "credit": k} and grants further
+    credits in its answers. A client may send one frame per credit it holds,
+    and sending without credit closes the socket with code 1008, so the work
+    queued per connection stays bounded (see CreditWindow). The results are
+    stored in the detection history like those of infer_stream.
+
+    Args:
+        websocket: The WebSocket of the client.
+    """
+    await websocket.accept()
+    window = CreditWindow(config.INGEST_MAX_CREDITS, config.SCHEDULER_MAX_QUEUE_WAIT)
+    send_lock = asyncio.Lock()
+    tasks = set()
+
+    async def send(message):
+        async with send_lock:
+            try:
+                await websocket.send_text(orjson.dumps(message).decode())
+            except (WebSocketDisconnect, RuntimeError, OSError):
+                # the client left, its pending frames are cancelled by the receive loop
+                pass
+
+    async def answer(seq, data):
+        """Run the model on one frame, returning the message answering it and the queue wait of the frame."""
+        try:
+            camera, timestamp, np_img = await run_in_threadpool(decode_ingest, data)
+        except (ValueError, TypeError, cv2.error) as e:
+            return {"type": "error", "seq": seq, "detail": str(e)}, None
+
+        start_det_time = time.time()
+        try:
+            results, batch = await run_model(np_img)
+        except HTTPException as e:
+            return {"type": "error", "seq": seq, "detail": e.detail}, None
+        end_det_time = time.time()
+
+        if config.HISTORY_ENABLED:
+            history_store.add(camera, timestamp, results, end_det_time - start_det_time,
+                              batch.queue_wait, batch.batch_size)
+        response = create_response(np_img.shape, results, start_det_time, end_det_time, camera,
+                                   f"{camera}_{seq}", batch)
+        return {"type": "response", "seq": seq, "timestamp": timestamp,
+                "response": response.model_dump()}, batch.queue_wait
+
+    async def process(seq, data):
+        message, queue_wait = {"type": "error", "seq": seq}, None
+        try:
+            message, queue_wait = await answer(seq, data)
+        except Exception as e:
+            logger.error(f"Could not process ingested frame: {e}")
+            message["detail"] = "Could not process frame"
+        finally:
+            # the credit of the frame comes back whatever happened, or the client would stall
+            credit = window.release(queue_wait)
+        message["credit"] = credit
+        await send(message)
+
+    ingest_windows.add(window)
+    try:
+        await send({"type": "credit", "credit": window.grant()})
+        seq = 0
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is None:
+                await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA, reason="Frames must be binary messages")
+                break
+            if not window.take():
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Frame sent without credit")
+                break
+
+            seq += 1
+            task = asyncio.create_task(process(seq, message["bytes"]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        ingest_windows.discard(window)
+        for task in tasks:
+            task.cancel()
+
+@cv_router.get("/{camera}/motion")
+async def camera_motion(camera: Camera):
+    """Return how often the model was skipped on static frames of a camera.
+
+    Args:
+        camera: The camera.
+
+    Returns:
+        A dict with the checked and skipped frame counts and the skip ratio.
+    """
+    stats = motion_stats.get(camera.value, MotionStats())
+    return stats.as_dict()
+
+@cv_router.get("/cache")
+async def cache_stats():
+    """Return the hit and miss counters and the size of the infer_image result cache."""
+    return result_cache.stats()
+
+@metrics.collector
+def camera_metrics():
+    """Collect the per-camera frame rates, drops and reconnects, and the queue depths, on scrape."""
+    cameras = scheduler.stats()["cameras"]
+    captures = capture_hub.stats()
+    fps = {name: [] for name in ("target_fps", "allowed_fps", "achieved_fps")}
+    dropped, reconnects, recording_queue, recording_dropped = [], [], [], []
+    for camera in config.STREAMS:
+        labels = {"camera": camera}
+        for name, samples in fps.items():
+            samples.append((labels, cameras.get(camera, {}).get(name, 0.)))
+        capture = captures.get(get_stream_url(camera))
+        if capture is not None:
+            dropped.append((labels, capture["dropped_frames"]))
+            reconnects.append((labels, capture["reconnects"]))
+        recorder = recorders.get(camera)
+        if recorder is not None:
+            recording_queue.append((labels, recorder.queue_depth()))
+            recording_dropped.append((labels, recorder.dropped))
+
+    yield MetricFamily("cv_camera_target_fps", "gauge", "Target frame rate of the clients of a camera",
+                       fps["target_fps"])
+    yield MetricFamily("cv_camera_allowed_fps", "gauge", "Frame rate the scheduler allows a camera",
+                       fps["allowed_fps"])
+    yield MetricFamily("cv_camera_achieved_fps", "gauge", "Frame rate a camera reaches", fps["achieved_fps"])
+    yield MetricFamily("cv_camera_dropped_frames_total", "counter",
+                       "Decoded frames of a camera skipped by its readers", dropped)
+    yield MetricFamily("cv_camera_reconnects_total", "counter", "Reconnection attempts of a camera", reconnects)
+    yield MetricFamily("cv_camera_recording_queue_depth", "gauge", "Frames of a camera waiting to be recorded",
+                       recording_queue)
+    yield MetricFamily("cv_camera_recording_dropped_total", "counter",
+                       "Frames of a camera not recorded because the queue was full", recording_dropped)
+
+    writer, history = output_writer.stats(), history_store.stats()
+    yield MetricFamily("cv_queue_depth", "gauge", "Items waiting in a queue", [
+        ({"queue": "inference"}, batcher.queue_depth()),
+        ({"queue": "output"}, writer["pending"]),
+        ({"queue": "history"}, history["pending"]),
+    ])
+    yield MetricFamily("cv_queue_dropped_total", "counter", "Items dropped because a queue was full", [
+        ({"queue": "output"}, writer["dropped"]),
+        ({"queue": "history"}, history["dropped"]),
+    ])
+    yield MetricFamily("cv_scheduler_budget_fps", "gauge", "Total frame rate the scheduler allows",
+                       [({}, scheduler.budget)])
+
+    windows = list(ingest_windows)
+    yield MetricFamily("cv_ingest_connections", "gauge", "Open ingest WebSocket connections",
+                       [({}, len(windows))])
+    yield MetricFamily("cv_ingest_in_flight", "gauge", "Ingested frames waiting for their results",
+                       [({}, sum(window.in_flight for window in windows))])
+
+@cv_router.get("/scheduler")
+async def scheduler_stats():
+    """Return the frame rate budget and the target, allowed and achieved frame rates per camera."""
+    return scheduler.stats()
+
+@cv_router.get("/output")
+async def output_stats():
+    """Return the written, dropped and coalesced counters of the output writer."""
+    return output_writer.stats()
+
+@cv_router.get("/{camera}/recordings")
+async def camera_recordings(camera: Camera):
+    """Return the recorded segments of a camera, each with its file, start and end time.
+
+    Args:
+        camera: The camera.
+
+    Returns:
+        The segment index, oldest first.
+    """
+    recorder = get_recorder(camera.value)
+    if recorder is None:
+        raise HTTPException(status_code=404, detail=f"Camera {camera.value} is not recorded")
+    return recorder.segments()
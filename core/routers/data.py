@@ -1,11 +1,78 @@
-from fastapi import APIRouter
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
+
+from config import config
+from util.history import history_store
 
-# TODO: Add your API routes here.
 data_router = APIRouter(
     prefix="/data",
     tags=["data"],
 )
 
+
+class CountBy(str, Enum):
+    """Grouping of the detection counts."""
+    time = "time"
+    cls = "class"
+
+
+def to_timestamp(value: Optional[datetime]) -> Optional[float]:
+    """Convert an optional datetime query parameter to a POSIX timestamp."""
+    return value.timestamp() if value is not None else None
+
+
 @data_router.get("/")
 async def index():
     return {"message": "Data"}
+
+@data_router.get("/frames")
+def get_frames(camera: Optional[str] = None, start: Optional[datetime] = None, end: Optional[datetime] = None,
+               cursor: Optional[str] = None, limit: int = Query(config.HISTORY_PAGE_SIZE, ge=1, le=1000)):
+    """Return a page of the detection history, oldest first.
+
+    Args:
+        camera: Only frames of this camera.
+        start: Only frames captured at or after this time.
+        end: Only frames captured before this time.
+        cursor: The `next` cursor of the previous page.
+        limit: Maximum number of frames in the page.
+
+    Returns:
+        The frames, and the cursor of the next page or None on the last page.
+    """
+    after = None
+    if cursor is not None:
+        try:
+            timestamp, id_ = cursor.split(":")
+            after = (float(timestamp), int(id_))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    frames = history_store.frames(camera, to_timestamp(start), to_timestamp(end), after, limit)
+    next_cursor = f"{frames[-1]['timestamp']!r}:{frames[-1]['id']}" if len(frames) == limit else None
+    return {"frames": frames, "next": next_cursor}
+
+@data_router.get("/counts")
+def get_counts(by: CountBy = CountBy.time, camera: Optional[str] = None, start: Optional[datetime] = None,
+               end: Optional[datetime] = None, bucket: int = Query(60, ge=60)):
+    """Return frame and detection counts per camera and time bucket, or per camera and class.
+
+    Args:
+        by: "time" or "class".
+        camera: Only this camera.
+        start: Start of the range, rounded down to the minute.
+        end: End of the range, rounded up to the minute.
+        bucket: Seconds per time bucket, a multiple of 60.
+
+    Returns:
+        The counts.
+    """
+    return history_store.counts(by.value, camera, to_timestamp(start), to_timestamp(end), bucket)
+
+@data_router.get("/history")
+async def history_stats():
+    """Return the stored, dropped and pending record counters of the detection history."""
+    return history_store.stats()
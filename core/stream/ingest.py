@@ -0,0 +1,111 @@
+import struct
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+from util.helper import frame_to_buffers
+
+# Ingest message (client to server, one binary WebSocket message), little endian:
+#   timestamp   d    capture time of the frame, seconds since the epoch
+#   camera_len  H    length of the camera id
+#   camera      camera_len bytes of UTF-8
+# followed by one frame in the binary frame wire format (see `frame_to_buffers`).
+INGEST_HEADER = struct.Struct("<dH")
+
+
+def pack_ingest_frame(camera: str, timestamp: float, frame: np.ndarray, codec: str = "jpeg",
+                      quality: int = 90) -> List[Union[bytes, memoryview]]:
+    """Serialize a frame pushed to the ingest endpoint, without joining the parts.
+
+    Args:
+        camera: Id of the camera the frame comes from.
+        timestamp: Capture time of the frame, seconds since the epoch.
+        frame: The RGB frame.
+        codec: Payload codec, one of "raw", "jpeg" or "png".
+        quality: JPEG quality (0-100) or PNG compression level (0-9).
+
+    Returns:
+        The buffers of the message, to be joined or written one after another.
+    """
+    camera_id = camera.encode("utf-8")
+    return [INGEST_HEADER.pack(timestamp, len(camera_id)), camera_id, *frame_to_buffers(frame, codec, quality)]
+
+def unpack_ingest_frame(data: Union[bytes, memoryview]) -> Tuple[str, float, memoryview]:
+    """Split an ingest message into its camera id, timestamp and serialized frame.
+
+    Args:
+        data: The binary WebSocket message.
+
+    Returns:
+        The camera id, the timestamp and a view of the serialized frame.
+
+    Raises:
+        ValueError: If the message is shorter than its header or the camera id is not UTF-8.
+    """
+    view = memoryview(data).cast("B")
+    if len(view) < INGEST_HEADER.size:
+        raise ValueError("Message is shorter than the ingest header")
+    timestamp, camera_len = INGEST_HEADER.unpack_from(view)
+    offset = INGEST_HEADER.size + camera_len
+    if len(view) < offset or camera_len == 0:
+        raise ValueError("Message has no valid camera id")
+    camera = bytes(view[INGEST_HEADER.size:offset]).decode("utf-8")
+    return camera, timestamp, view[offset:]
+
+
+class CreditWindow:
+    """Credit-based flow control of one ingest connection.
+
+    The client may only send a frame for which it holds a credit. The server
+    grants credits so that the frames in flight (received but not answered
+    yet) plus the credits held by the client never exceed `window`, so a
+    client pushing faster than the model can keep at most `window` frames
+    queued in the server. The window is halved when frames waited longer than
+    `max_queue_wait` for the model, and grows back by one per answered frame
+    otherwise, between 1 and `max_credits`.
+
+    Attributes:
+        max_credits : upper bound of the window
+        max_queue_wait : queue wait in seconds from which the window shrinks
+        window : current bound of the frames in flight and credits held
+        in_flight : frames received and not answered yet
+        available : credits held by the client
+
+    Methods:
+        grant() : Return the credits to grant, up to the window.
+        take() : Use up a credit for a received frame.
+        release() : Account for an answered frame and return the credits to grant.
+    """
+    def __init__(self, max_credits: int, max_queue_wait: float):
+        self.max_credits = max_credits
+        self.max_queue_wait = max_queue_wait
+        self.window = max_credits
+        self.in_flight = 0
+        self.available = 0
+
+    def grant(self) -> int:
+        credit = max(0, self.window - self.in_flight - self.available)
+        self.available += credit
+        return credit
+
+    def take(self) -> bool:
+        """Use up a credit for a received frame, False if the client held none."""
+        if self.available < 1:
+            return False
+        self.available -= 1
+        self.in_flight += 1
+        return True
+
+    def release(self, queue_wait: Optional[float] = None) -> int:
+        """Account for an answered frame and return the credits to grant.
+
+        Args:
+            queue_wait: Seconds the frame waited for the model, None if it did not reach it.
+        """
+        self.in_flight -= 1
+        if queue_wait is not None:
+            if queue_wait > self.max_queue_wait:
+                self.window = max(1, self.window // 2)
+            else:
+                self.window = min(self.max_credits, self.window + 1)
+        return self.grant()
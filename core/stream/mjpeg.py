@@ -0,0 +1,59 @@
+MJPEG_BOUNDARY = "frame"
+MJPEG_MEDIA_TYPE = f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}"
+
+
+def mjpeg_part(jpeg: bytes) -> bytes:
+    """Wrap a JPEG image into one part of a multipart MJPEG response.
+
+    Args:
+        jpeg: The JPEG bytes.
+
+    Returns:
+        The multipart part, boundary and headers included.
+    """
+    header = (
+        f"--{MJPEG_BOUNDARY}\r\n"
+        "Content-Type: image/jpeg\r\n"
+        f"Content-Length: {len(jpeg)}\r\n\r\n"
+    ).encode("ascii")
+    return header + jpeg + b"\r\n"
+
+
+class AdaptiveRate:
+    """Per-client frame rate and JPEG quality for an MJPEG stream.
+
+    The time it takes to hand a part to the server is used as the signal: the
+    ASGI server only returns from `send` once the transport has room, so a slow
+    client makes it grow. The rate and quality are then cut multiplicatively and
+    recovered additively (AIMD), so a slow browser receives fewer, smaller
+    frames instead of building a backlog.
+
+    Attributes:
+        fps : current target frame rate
+        quality : current JPEG quality
+    """
+    def __init__(self, max_fps, min_fps=1.0, max_quality=85, min_quality=40):
+        self.max_fps = max_fps
+        self.min_fps = min_fps
+        self.max_quality = max_quality
+        self.min_quality = min_quality
+        self.fps = float(max_fps)
+        self.quality = max_quality
+
+    @property
+    def interval(self) -> float:
+        """Seconds between two frames at the current rate."""
+        return 1. / self.fps
+
+    def update(self, send_time: float) -> None:
+        """Adapt the rate to the time the last part took to send.
+
+        Args:
+            send_time: Seconds spent handing the last part to the client.
+        """
+        if send_time > 0.5 * self.interval:
+            self.fps = max(self.min_fps, self.fps * 0.75)
+            self.quality = max(self.min_quality, self.quality - 5)
+        else:
+            self.fps = min(self.max_fps, self.fps + 0.5)
+            self.quality = min(self.max_quality, self.quality + 1)
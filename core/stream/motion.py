@@ -0,0 +1,98 @@
+import threading
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+class MotionStats:
+    """Counters of frames checked and skipped by the MotionGates of a camera.
+
+    Attributes:
+        frames : number of frames checked
+        skipped : number of frames on which inference was skipped
+    """
+    def __init__(self):
+        self.frames = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def record(self, skipped: bool) -> None:
+        with self._lock:
+            self.frames += 1
+            self.skipped += skipped
+
+    @property
+    def skip_ratio(self) -> float:
+        """Fraction of the checked frames that were skipped."""
+        return self.skipped / self.frames if self.frames else 0.
+
+    def as_dict(self) -> dict:
+        return {"frames": self.frames, "skipped": self.skipped, "skip_ratio": self.skip_ratio}
+
+
+class MotionGate:
+    """A cheap change detector deciding if a frame needs to go through the model.
+
+    Frames are downscaled to `width` pixels wide, converted to grayscale and
+    blurred, then compared with a running average background. If the fraction
+    of pixels differing by more than `pixel_threshold` is below `threshold`,
+    the scene is considered static and the previous results can be reused.
+    The model still runs at least every `max_skip` seconds, so slow changes the
+    background absorbs are not missed for long. A threshold of 0 disables the
+    gate.
+
+    Attributes:
+        threshold : fraction of changed pixels from which the model runs
+        pixel_threshold : gray level difference from which a pixel counts as changed
+        width : width of the downscaled frames
+        alpha : weight of a new frame in the running background
+        max_skip : maximum seconds between two model runs
+        change : fraction of changed pixels of the last checked frame
+        stats : MotionStats the decisions are recorded in
+    """
+    def __init__(self, threshold: float = 0.005, pixel_threshold: int = 25, width: int = 160,
+                 alpha: float = 0.05, max_skip: float = 10., stats: Optional[MotionStats] = None):
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.width = width
+        self.alpha = alpha
+        self.max_skip = max_skip
+        self.change = 1.
+        self.stats = stats if stats is not None else MotionStats()
+        self._background = None
+        self._last_inference = 0.
+
+    def _gray(self, frame: np.ndarray) -> np.ndarray:
+        """Downscale, gray and blur a RGB frame."""
+        height = max(1, round(frame.shape[0] * self.width / frame.shape[1]))
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0).astype(np.float32)
+
+    def check(self, frame: np.ndarray) -> bool:
+        """Update the background with a frame and tell if the model should run on it.
+
+        Args:
+            frame: The RGB frame.
+
+        Returns:
+            True if the frame changed enough, or the model has not run for
+            `max_skip` seconds.
+        """
+        gray = self._gray(frame)
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray
+            self.change = 1.
+        else:
+            self.change = float(np.count_nonzero(
+                cv2.absdiff(gray, self._background) > self.pixel_threshold)) / gray.size
+            cv2.accumulateWeighted(gray, self._background, self.alpha)
+
+        now = time.monotonic()
+        run = self.change >= self.threshold or now - self._last_inference >= self.max_skip
+        if run:
+            self._last_inference = now
+        self.stats.record(not run)
+        return run
@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+from util.helper import draw_detections
+from util.metrics import stage_seconds
+
+logger = logging.getLogger("core")
+
+INDEX_FILE = "index.json"
+
+
+class SegmentRecorder:
+    """A recorder writing annotated frames of a camera into rolling video segments.
+
+    Frames are queued by `submit` and written by a thread of their own with
+    `cv2.VideoWriter`, a new segment being started every `segment_seconds`
+    (or when the frame size changes). A full queue drops the frame, so the
+    inference loop is never slowed down by the disk. Closed segments are
+    listed in an index file mapping each segment to its time range, and the
+    oldest ones are deleted to keep the recordings under `max_bytes` and
+    `max_age` seconds.
+
+    Attributes:
+        directory : directory of the segments and of the index file
+        camera : name of the camera, used as segment file prefix
+        fps : frame rate written in the segments
+        segment_seconds : duration of a segment
+        max_bytes : size budget of all segments
+        max_age : seconds a segment is kept
+        dropped : number of frames dropped because the queue was full
+
+    Methods:
+        submit() : Queue a frame to be recorded.
+        segments() : Return the index of the closed segments.
+        queue_depth() : Return the number of frames waiting to be written.
+        close() : Finish the current segment and stop the thread.
+    """
+    def __init__(self, directory: str, camera: str, fps: float, segment_seconds: float = 60.,
+                 max_bytes: int = 10 * 1024 ** 3, max_age: float = 7 * 24 * 3600.,
+                 fourcc: str = "mp4v", queue_size: int = 32):
+        self.directory = directory
+        self.camera = camera
+        self.fps = fps
+        self.segment_seconds = segment_seconds
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fourcc = fourcc
+        self.dropped = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._index = self._load_index()
+        self._index_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._segment = None
+        self._last_timestamp = 0.
+        self._thread = threading.Thread(target=self._run, name=f"SegmentRecorder-{camera}", daemon=True)
+        self._thread.start()
+
+    def _load_index(self) -> List[dict]:
+        """Read the index left by a previous run, keeping the segments still on disk."""
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return []
+        return [segment for segment in index
+                if os.path.exists(os.path.join(self.directory, segment["file"]))]
+
+    def submit(self, frame: np.ndarray, timestamp: float, detections: Optional[np.ndarray] = None) -> bool:
+        """Queue a RGB frame to be recorded, annotated with its detections.
+
+        Frames older than the last queued one, e.g. the same frame sent by
+        another client of the camera, are ignored.
+
+        Returns:
+            True if the frame was queued.
+        """
+        if timestamp <= self._last_timestamp:
+            return False
+        try:
+            self._queue.put_nowait((frame, timestamp, detections))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self._last_timestamp = timestamp
+        return True
+
+    def segments(self) -> List[dict]:
+        """Return the closed segments with their file, start and end time, frames and bytes."""
+        with self._index_lock:
+            return list(self._index)
+
+    def queue_depth(self) -> int:
+        """Return the number of frames waiting to be written."""
+        return self._queue.qsize()
+
+    def _run(self) -> None:
+        """Write queued frames until a None sentinel is received."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            frame, timestamp, detections = item
+            try:
+                with stage_seconds.time("record"):
+                    self._write(frame, timestamp, detections)
+            except Exception as e:
+                logger.error(f"Could not record frame of camera {self.camera}: {e}")
+        self._close_segment()
+
+    def _write(self, frame: np.ndarray, timestamp: float, detections: Optional[np.ndarray]) -> None:
+        if detections is not None:
+            frame = draw_detections(frame, detections)
+        height, width = frame.shape[:2]
+
+        segment = self._segment
+        if segment is not None and (timestamp - segment["start"] >= self.segment_seconds
+                                    or (width, height) != segment["size"]):
+            self._close_segment()
+        if self._segment is None:
+            self._open_segment(timestamp, width, height)
+
+        self._writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+        self._segment["end"] = timestamp
+        self._segment["frames"] += 1
+
+    def _open_segment(self, timestamp: float, width: int, height: int) -> None:
+        name = f"{self.camera}_{datetime.fromtimestamp(timestamp):%Y%m%dT%H%M%S%f}.mp4"
+        writer = cv2.VideoWriter(os.path.join(self.directory, name), cv2.VideoWriter_fourcc(*self.fourcc),
+                                 self.fps, (width, height))
+        if not writer.isOpened():
+            raise RuntimeError(f"Could not open video writer for {name}")
+        self._writer = writer
+        self._segment = {"file": name, "start": timestamp, "end": timestamp, "frames": 0,
+                         "size": (width, height)}
+
+    def _close_segment(self) -> None:
+        """Finish the current segment, add it to the index and apply the retention budget."""
+        if self._segment is None:
+            return
+        self._writer.release()
+        segment, self._segment, self._writer = self._segment, None, None
+        path = os.path.join(self.directory, segment.pop("file"))
+        del segment["size"]
+        entry = {"file": os.path.basename(path), **segment, "bytes": os.path.getsize(path)}
+
+        with self._index_lock:
+            self._index.append(entry)
+            self._apply_retention()
+            index = list(self._index)
+        self._save_index(index)
+
+    def _apply_retention(self) -> None:
+        """Delete the oldest segments over the size or age budget."""
+        oldest = time.time() - self.max_age
+        while self._index and (sum(s["bytes"] for s in self._index) > self.max_bytes
+                               or self._index[0]["end"] < oldest):
+            segment = self._index.pop(0)
+            try:
+                os.remove(os.path.join(self.directory, segment["file"]))
+            except OSError:
+                pass
+
+    def _save_index(self, index: List[dict]) -> None:
+        """Replace the index file atomically."""
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(path + ".tmp", path)
+
+    def close(self, timeout: Optional[float] = 10.) -> None:
+        """Finish the current segment and stop the thread."""
+        while True:
+            try:
+                self._queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                if not self._thread.is_alive():
+                    return
+        self._thread.join(timeout)
@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+def fair_share(targets: List[float], budget: float, min_fps: float = 0.) -> List[float]:
+    """Split a frame rate budget max-min fairly between lanes.
+
+    Lanes asking for less than an equal share get their target, and what they
+    leave is split between the others, so a camera with a high target cannot
+    starve the rest.
+
+    Args:
+        targets: Target frame rate of each lane.
+        budget: Total frame rate to split.
+        min_fps: Rate every lane gets even if the budget is exceeded.
+
+    Returns:
+        The frame rate of each lane, in the order of `targets`.
+    """
+    shares = [0.] * len(targets)
+    remaining = budget
+    order = sorted(range(len(targets)), key=lambda i: targets[i])
+    for n, i in enumerate(order):
+        share = min(targets[i], remaining / (len(order) - n))
+        shares[i] = max(share, min(min_fps, targets[i]))
+        remaining -= share
+    return shares
+
+
+class Lane:
+    """The schedule of one consumer of a camera, created by FrameScheduler.lane().
+
+    Attributes:
+        camera : name of the camera
+        target_fps : frame rate asked for
+        fps : frame rate currently allowed by the scheduler
+        achieved_fps : moving average of the frame rate actually reached
+    """
+    def __init__(self, scheduler: "FrameScheduler", camera: str, target_fps: float):
+        self.scheduler = scheduler
+        self.camera = camera
+        self.target_fps = target_fps
+        self.fps = target_fps
+        self.achieved_fps = 0.
+        self._next_slot = time.monotonic()
+        self._last_tick = None
+
+    @property
+    def interval(self) -> float:
+        return 1. / self.fps
+
+    async def wait(self, max_fps: Optional[float] = None) -> None:
+        """Sleep until the next slot of the lane.
+
+        A lane that fell behind starts again from now instead of catching up
+        with a burst of frames.
+
+        Args:
+            max_fps: Optional lower cap for this slot, e.g. from a slow client.
+        """
+        fps = min(self.fps, max_fps) if max_fps else self.fps
+        delay = self._next_slot - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        now = time.monotonic()
+        self._next_slot = max(self._next_slot, now - 1. / fps) + 1. / fps
+
+        if self._last_tick is not None:
+            achieved = 1. / max(now - self._last_tick, 1e-6)
+            self.achieved_fps += 0.2 * (achieved - self.achieved_fps)
+        self._last_tick = now
+
+    def report(self, queue_wait: float) -> None:
+        """Report the inference queue wait of the lane's last frame to the scheduler."""
+        self.scheduler.report(queue_wait)
+
+    def close(self) -> None:
+        self.scheduler._remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class FrameScheduler:
+    """A scheduler pacing the frames each camera consumer sends to the model.
+
+    Each lane sleeps until its next slot instead of polling. The scheduler
+    keeps a total frame rate budget: when frames wait longer than
+    `max_queue_wait` in the inference queue, the model is overloaded and the
+    budget is cut multiplicatively; otherwise it grows back additively towards
+    the sum of the targets. The budget is split with `fair_share`, so cameras
+    are lowered below their target fairly instead of one starving the others.
+
+    Attributes:
+        max_queue_wait : inference queue wait in seconds from which the model is overloaded
+        min_fps : frame rate every lane keeps under overload
+        decrease : factor applied to the budget under overload
+        increase : fraction of the summed targets regained per second
+        cooldown : minimum seconds between two budget cuts
+        budget : total frame rate currently allowed
+        overloaded : True while the last report exceeded `max_queue_wait`
+
+    Methods:
+        lane() : Register a consumer of a camera.
+        report() : Report the inference queue wait of a frame.
+        stats() : Return the target, allowed and achieved frame rates per camera.
+    """
+    def __init__(self, max_queue_wait: float = 0.1, min_fps: float = 1., decrease: float = 0.8,
+                 increase: float = 0.1, cooldown: float = 1.):
+        self.max_queue_wait = max_queue_wait
+        self.min_fps = min_fps
+        self.decrease = decrease
+        self.increase = increase
+        self.cooldown = cooldown
+        self.budget = 0.
+        self.overloaded = False
+        self._last_report = time.monotonic()
+        self._last_decrease = 0.
+        self._lanes: List[Lane] = []
+        self._lock = threading.Lock()
+
+    def lane(self, camera: str, target_fps: float) -> Lane:
+        """Register a consumer of a camera with its target frame rate."""
+        lane = Lane(self, camera, target_fps)
+        with self._lock:
+            self._lanes.append(lane)
+            self.budget += target_fps
+            self._allocate()
+        return lane
+
+    def _remove(self, lane: Lane) -> None:
+        with self._lock:
+            if lane in self._lanes:
+                self._lanes.remove(lane)
+                self.budget = min(self.budget, self._demand())
+                self._allocate()
+
+    def _demand(self) -> float:
+        return sum(lane.target_fps for lane in self._lanes)
+
+    def _allocate(self) -> None:
+        shares = fair_share([lane.target_fps for lane in self._lanes], self.budget, self.min_fps)
+        for lane, share in zip(self._lanes, shares):
+            lane.fps = share
+
+    def report(self, queue_wait: float) -> None:
+        """Report the inference queue wait of a frame and adjust the budget (AIMD).
+
+        The budget is cut at most once per `cooldown` seconds, since the queue
+        needs time to drain after a cut, and grows back by `increase` times the
+        demand per second.
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed, self._last_report = now - self._last_report, now
+            demand = self._demand()
+            self.overloaded = queue_wait > self.max_queue_wait
+            if self.overloaded:
+                if now - self._last_decrease >= self.cooldown:
+                    achieved = sum(lane.achieved_fps for lane in self._lanes) or self.budget
+                    self.budget = max(self.min_fps * len(self._lanes),
+                                      min(self.budget, achieved) * self.decrease)
+                    self._last_decrease = now
+            else:
+                self.budget = min(demand, self.budget + self.increase * demand * elapsed)
+            self._allocate()
+
+    def stats(self) -> Dict[str, dict]:
+        """Return the target, allowed and achieved frame rates per camera, summed over its lanes."""
+        with self._lock:
+            cameras = {}
+            for lane in self._lanes:
+                camera = cameras.setdefault(lane.camera, {"lanes": 0, "target_fps": 0.,
+                                                          "allowed_fps": 0., "achieved_fps": 0.})
+                camera["lanes"] += 1
+                camera["target_fps"] += lane.target_fps
+                camera["allowed_fps"] += lane.fps
+                camera["achieved_fps"] += lane.achieved_fps
+            return {"budget_fps": self.budget, "overloaded": self.overloaded, "cameras": cameras}
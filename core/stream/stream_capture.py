@@ -1,6 +1,51 @@
-from datetime import datetime
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import NamedTuple, Optional
+
+import numpy as np
 from vidgear.gears import CamGear
 
+logger = logging.getLogger("core")
+
+
+def redact_url(url: str) -> str:
+    """Remove the credentials of a stream URL, for logging."""
+    return re.sub(r"//[^/@]*@", "//", str(url))
+
+
+class StreamHealth(str, Enum):
+    """A class to represent the health of a threaded StreamCapture.
+
+    Attributes:
+        connecting : no frame has been decoded yet
+        live : frames are arriving
+        degraded : the stream failed and is being reconnected, the last good frame is served
+        dead : the capture was stopped or ran out of re-connection attempts
+    """
+    connecting = "connecting"
+    live = "live"
+    degraded = "degraded"
+    dead = "dead"
+
+
+class CapturedFrame(NamedTuple):
+    """A frame read by a threaded StreamCapture.
+
+    Attributes:
+        frame : the decoded frame
+        timestamp : time.time() at which the frame was decoded
+        seq : sequence number of the frame, increasing by one per decoded frame
+    """
+    frame: np.ndarray
+    timestamp: float
+    seq: int
+
 
 class StreamCapture:
     """A class to capture and read frames from a video stream.
@@ -11,18 +56,37 @@ class StreamCapture:
         reset_delay : delay in seconds between re-connection attempts
         source : CamGear object to capture frames from the stream
         running : flag to indicate if the stream is running or not
+        threaded : flag to indicate if frames are decoded on a supervisor thread
+        buffer_size : number of decoded frames kept for the reader in threaded mode
+        max_fps : maximum decoding frame rate in threaded mode, None for no limit
+        dropped_frames : number of decoded frames overwritten before they were read
+        reconnects : number of re-connection attempts made so far
+        health : StreamHealth of the capture (threaded mode)
 
     Methods:
         read() : Read a frame from the stream. Returns None if the stream is not available or if the maximum number of re-connection attempts has been reached.
+        read_after() : Return the newest frame after a given sequence number without consuming it (threaded mode).
+        seconds_since_last_frame() : Time since the last decoded frame (threaded mode).
         stop() : Stop the stream capture.
     """
-    def __init__(self, rtsp_url, reset_attempts=20, reset_delay=5):
+    def __init__(self, rtsp_url, reset_attempts=20, reset_delay=5, threaded=False, buffer_size=1,
+                 max_reset_delay=60, max_fps=None):
         """Initialize a class instance.
 
         Args:
             rtsp_url: The RTSP URL of the camera feed.
             reset_attempts: The number of attempts to reset the camera feed if it fails.
             reset_delay: The delay in seconds between each reset attempt.
+            threaded: If True, a supervisor thread opens, decodes and reconnects the
+                stream, and `read()` returns a `CapturedFrame` without blocking on
+                the network.
+            buffer_size: The number of newest frames kept in threaded mode. Older
+                unread frames are dropped, so 1 always serves the latest frame.
+            max_reset_delay: Upper bound in seconds for the exponential backoff
+                between consecutive reset attempts in threaded mode.
+            max_fps: Maximum decoding frame rate in threaded mode. Video files
+                are otherwise decoded as fast as possible; this replays them
+                like a live camera, e.g. as a stand-in stream in benchmarks.
 
         Attributes:
             rtsp_url: The RTSP URL of the camera feed.
@@ -31,46 +95,202 @@ class StreamCapture:
             source: The camera feed source.
             running: A boolean indicating if the camera feed is running.
         """
+        if buffer_size < 1:
+            raise ValueError("buffer_size must be at least 1")
+
         self.rtsp_url = rtsp_url
         self.reset_attempts = reset_attempts
         self.reset_delay = reset_delay
-        options = {"THREADED_QUEUE_MODE": False}
-        self.source = CamGear(source=self.rtsp_url, colorspace="COLOR_BGR2RGB",
-                              **options).start()
+        self.max_reset_delay = max_reset_delay
+        self.threaded = threaded
+        self.buffer_size = buffer_size
+        self.max_fps = max_fps
+        self.dropped_frames = 0
+        self.reconnects = 0
+        self.health = StreamHealth.connecting
+
+        self._max_attempts = reset_attempts
+        self._frames = deque(maxlen=buffer_size)
+        self._last = None
+        self._newest = None
+        self._last_timestamp = None
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = None
         self.running = True
 
-    def read(self):
+        if self.threaded:
+            self.source = None
+            self._thread = threading.Thread(target=self._supervise, name=f"StreamCapture-{id(self)}",
+                                            daemon=True)
+            self._thread.start()
+        else:
+            self.source = self._open()
+
+    def _open(self):
+        """Open and start a new CamGear source for the stream.
+
+        In threaded mode CamGear's own frame queue is used so that every decoded
+        frame is handed to the supervisor thread exactly once, and a stalled
+        stream raises `queue.Empty` after `reset_delay` seconds.
+        """
+        if self.threaded:
+            options = {"THREADED_QUEUE_MODE": True, "THREAD_TIMEOUT": self.reset_delay}
+        else:
+            options = {"THREADED_QUEUE_MODE": False}
+        return CamGear(source=self.rtsp_url, colorspace="COLOR_BGR2RGB",
+                       **options).start()
+
+    def _count_reset(self):
+        """Use up one re-connection attempt."""
+        self.reset_attempts -= 1
+        self.reconnects += 1
+        logger.warning("Stream re-connection attempt",
+                       extra={"stream": redact_url(self.rtsp_url), "attempts_left": self.reset_attempts,
+                              "reconnects": self.reconnects})
+
+    def _reconnect(self):
+        """Replace the current source with a new one after a failed read."""
+        self.source.stop()
+        self._count_reset()
+
+        self.source = self._open()
+
+    def _backoff(self, failures):
+        """Return the delay before the next reset attempt, exponential with jitter."""
+        delay = min(self.reset_delay * 2 ** (failures - 1), self.max_reset_delay)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _set_health(self, health):
+        """Set the health and wake up readers waiting for a frame."""
+        with self._cond:
+            self.health = health
+            self._cond.notify_all()
+
+    def _supervise(self):
+        """Open, decode and reconnect the stream on the supervisor thread."""
+        failures = 0
+        next_frame = time.monotonic()
+
+        while self.running and self.reset_attempts > 0:
+            if self.source is None:
+                if failures:
+                    self._count_reset()
+                try:
+                    self.source = self._open()
+                except (RuntimeError, ValueError):
+                    failures += 1
+                    self._stopped.wait(self._backoff(failures))
+                    continue
+
+            try:
+                frame = self.source.read()
+            except queue.Empty:
+                frame = None
+
+            if frame is None:
+                self.source.stop()
+                self.source = None
+                if self.running:
+                    failures += 1
+                    if self.health == StreamHealth.live:
+                        self._set_health(StreamHealth.degraded)
+                    self._stopped.wait(self._backoff(failures))
+                continue
+
+            with self._cond:
+                failures = 0
+                self.reset_attempts = self._max_attempts
+                self.health = StreamHealth.live
+                self._seq += 1
+                self._last_timestamp = time.time()
+                if len(self._frames) == self.buffer_size:
+                    self.dropped_frames += 1
+                self._newest = CapturedFrame(frame, self._last_timestamp, self._seq)
+                self._frames.append(self._newest)
+                self._cond.notify_all()
+
+            if self.max_fps:
+                next_frame = max(next_frame + 1. / self.max_fps, time.monotonic() - 1. / self.max_fps)
+                self._stopped.wait(max(0., next_frame - time.monotonic()))
+
+        if self.source is not None:
+            self.source.stop()
+        self._set_health(StreamHealth.dead)
+
+    def _read_threaded(self, timeout):
+        """Return the oldest unread frame, waiting up to `timeout` seconds for one."""
+        with self._cond:
+            if not self._frames and timeout > 0 and self.health != StreamHealth.dead:
+                self._cond.wait(timeout)
+
+            if self._frames:
+                self._last = self._frames.popleft()
+            return self._last
+
+    def read_after(self, seq, timeout=0.0):
+        """Return the newest frame without consuming it (threaded mode).
+
+        Unlike `read()`, any number of callers can use this concurrently, each
+        keeping its own cursor.
+
+        Args:
+            seq: Sequence number of the last frame the caller has seen.
+            timeout: Seconds to wait for a frame newer than `seq`; 0 returns immediately.
+
+        Returns:
+            The newest `CapturedFrame`, which is not newer than `seq` if none arrived
+            within `timeout`; None until the first frame.
+        """
+        with self._cond:
+            if timeout > 0:
+                self._cond.wait_for(
+                    lambda: (self._newest is not None and self._newest.seq > seq)
+                    or self.health == StreamHealth.dead,
+                    timeout,
+                )
+            return self._newest
+
+    def read(self, timeout=0.0):
         """Start reading frames from the stream.
 
+        Args:
+            timeout: Threaded mode only. Seconds to wait for a frame that has not
+                been read yet; 0 returns immediately.
+
         Returns:
             A frame from the stream if the stream is available and the maximum number of re-connection attempts has not been reached. Otherwise, returns None.
+
+            In threaded mode a `CapturedFrame` is returned instead. If no new frame
+            has been decoded since the previous call, e.g. while the stream is
+            reconnecting, the previously returned frame is returned again (same
+            `seq`); None until the first frame. Check `health` to tell these apart.
         """
+        if self.threaded:
+            return self._read_threaded(timeout)
+
         if self.source is None:
             return None
-        
+
         if self.running and self.reset_attempts > 0:
             frame = self.source.read()
 
             if frame is None:
-                self.source.stop()
-                self.reset_attempts -= 1
-                print(
-                    "re-connection attempt-{} at time:{}".format(
-                        str(self.reset_attempts),
-                        datetime.now().strftime("%m-%d-%Y %I:%M:%S%p"),
-                    )
-                )
-
-                options = {"THREADED_QUEUE_MODE": False}
-                self.source = CamGear(source=self.rtsp_url, colorspace="COLOR_BGR2RGB",
-                                      **options).start()
+                self._reconnect()
 
                 return frame
             else:
                 return frame
-        
+
         return None
 
+    def seconds_since_last_frame(self) -> Optional[float]:
+        """Return the seconds since the last decoded frame, None before the first one."""
+        if self._last_timestamp is None:
+            return None
+        return time.time() - self._last_timestamp
+
     def stop(self):
         """Stop the stream capture.
 
@@ -79,5 +299,13 @@ class StreamCapture:
         """
         self.running = False
         self.reset_attempts = 0
+        self._stopped.set()
+
+        if self._thread is not None:
+            # the supervisor thread owns the source and stops it on exit
+            if self._thread is not threading.current_thread():
+                self._thread.join(timeout=self.reset_delay)
+            return
+
         if self.source is not None:
             self.source.stop()
@@ -0,0 +1,155 @@
+import os
+import tempfile
+from enum import Enum
+from typing import AsyncIterator, Iterator, NamedTuple, Optional
+
+import cv2
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from util.metrics import stage_seconds
+
+
+class SampleMode(str, Enum):
+    """A class to represent how frames are sampled from a video.
+
+    Attributes:
+        stride : every `stride`-th frame
+        time : one frame every `interval` seconds of video
+        keyframe : only the key frames, found without decoding the others
+    """
+    stride = "stride"
+    time = "time"
+    keyframe = "keyframe"
+
+
+class VideoFrame(NamedTuple):
+    """A frame sampled from a video.
+
+    Attributes:
+        frame : the decoded RGB frame
+        index : index of the frame in the video
+        time : position of the frame in the video, in seconds
+    """
+    frame: np.ndarray
+    index: int
+    time: float
+
+
+async def save_chunks(chunks: AsyncIterator[bytes], directory: str, suffix: str = "") -> str:
+    """Write an uploaded body to a temporary file chunk by chunk.
+
+    Only one chunk is held in memory at a time, whatever the size of the upload.
+
+    Args:
+        chunks: The chunks of the upload.
+        directory: Directory of the temporary file.
+        suffix: Suffix of the temporary file, e.g. the extension of the upload.
+
+    Returns:
+        Path of the file. The caller removes it.
+    """
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in chunks:
+                if chunk:
+                    await run_in_threadpool(f.write, chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+def open_video(path: str) -> cv2.VideoCapture:
+    """Open a video file.
+
+    Raises:
+        ValueError: If the file cannot be opened as a video.
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        capture.release()
+        raise ValueError(f"Could not open video {os.path.basename(path)}")
+    return capture
+
+def sample_frames(path: str, mode: SampleMode = SampleMode.stride, stride: int = 1,
+                  interval: float = 1.0, max_frames: Optional[int] = None) -> Iterator[VideoFrame]:
+    """Lazily decode sampled frames of a video file.
+
+    Frames that are not sampled are only grabbed, never converted or kept, so
+    memory use does not depend on the length of the video.
+
+    Args:
+        path: Path of the video.
+        mode: How frames are sampled.
+        stride: Sampling stride in frames, for SampleMode.stride.
+        interval: Sampling interval in seconds, for SampleMode.time.
+        max_frames: Maximum number of frames to yield, None for all.
+
+    Yields:
+        The sampled frames, in order.
+    """
+    if mode == SampleMode.keyframe:
+        frames = _keyframes(path)
+    else:
+        frames = _grabbed_frames(path, mode, stride, interval)
+
+    try:
+        for count, frame in enumerate(frames):
+            if max_frames is not None and count >= max_frames:
+                break
+            yield frame
+    finally:
+        frames.close()
+
+def _grabbed_frames(path: str, mode: SampleMode, stride: int, interval: float) -> Iterator[VideoFrame]:
+    """Yield frames by stride or time, grabbing and skipping the others."""
+    capture = open_video(path)
+    try:
+        index, next_time = -1, 0.
+        while capture.grab():
+            index += 1
+            position = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if mode == SampleMode.stride:
+                if index % stride:
+                    continue
+            elif position + 1e-6 < next_time:
+                continue
+            else:
+                next_time += interval * max(1, int((position - next_time) // interval) + 1)
+
+            with stage_seconds.time("decode"):
+                ok, frame = capture.retrieve()
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) if ok else None
+            if ok:
+                yield VideoFrame(frame, index, position)
+    finally:
+        capture.release()
+
+def _keyframes(path: str) -> Iterator[VideoFrame]:
+    """Yield the key frames of a video.
+
+    A second capture reads the undecoded packets to find the key frames, and
+    the decoding capture seeks straight to them.
+    """
+    packets = open_video(path)
+    packets.set(cv2.CAP_PROP_FORMAT, -1)
+    capture = open_video(path)
+    try:
+        index = -1
+        while packets.grab():
+            index += 1
+            if not packets.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                continue
+            if capture.get(cv2.CAP_PROP_POS_FRAMES) != index:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+            with stage_seconds.time("decode"):
+                ok, frame = capture.read()
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) if ok else None
+            if ok:
+                position = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                yield VideoFrame(frame, index, position)
+    finally:
+        packets.release()
+        capture.release()
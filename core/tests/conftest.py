@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from config import config
+from inference.batcher import BatchInfo
+from routers import cv
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """A client of the cv router whose model finds nothing, with history and output images off."""
+    async def run_model(np_img):
+        return np.zeros((0, 6), dtype=np.float32), BatchInfo(1, 0., 0.)
+
+    monkeypatch.setattr(cv, "run_model", run_model)
+    monkeypatch.setattr(config, "HISTORY_ENABLED", False)
+    monkeypatch.setattr(config, "OUTPUT_SAVE_IMAGES", False)
+    cv.result_cache.clear()
+    app = FastAPI()
+    app.include_router(cv.cv_router)
+    return TestClient(app)
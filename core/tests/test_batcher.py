@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from inference.batcher import InferenceBatcher
+
+
+class RecordingModel:
+    """A predict function recording the size of each batch and returning the frame values."""
+    def __init__(self, delay=0.):
+        self.delay = delay
+        self.batches = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, frames, stages):
+        with self._lock:
+            self.batches.append(len(frames))
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+        stages["inference"] = self.delay
+        return [int(frame[0]) for frame in frames]
+
+
+def frames(count):
+    return [np.array([i]) for i in range(count)]
+
+def test_concurrent_requests_share_batches_up_to_the_max_size():
+    model = RecordingModel()
+    batcher = InferenceBatcher(model, max_batch_size=4, max_wait=0.05)
+
+    async def run():
+        return await asyncio.gather(*(batcher.infer(frame) for frame in frames(10)))
+
+    answers = asyncio.run(run())
+    assert [result for result, _ in answers] == list(range(10))
+    assert model.batches == [4, 4, 2]
+    assert [batch.batch_size for _, batch in answers] == [4] * 8 + [2] * 2
+    assert all(batch.stages == {"inference": 0.} for _, batch in answers)
+
+def test_a_lone_request_waits_at_most_max_wait():
+    model = RecordingModel()
+    batcher = InferenceBatcher(model, max_batch_size=8, max_wait=0.05)
+
+    async def run():
+        start = time.perf_counter()
+        _, batch = await batcher.infer(np.array([0]))
+        return time.perf_counter() - start, batch
+
+    elapsed, batch = asyncio.run(run())
+    assert model.batches == [1]
+    assert 0.04 <= batch.queue_wait and elapsed < 0.5
+
+def test_batches_use_at_most_concurrency_slots():
+    model = RecordingModel(delay=0.05)
+    batcher = InferenceBatcher(model, max_batch_size=1, max_wait=0., concurrency=2)
+
+    async def run():
+        await asyncio.gather(*(batcher.infer(frame) for frame in frames(6)))
+
+    asyncio.run(run())
+    assert model.batches == [1] * 6
+    assert model.max_running == 2
+
+def test_requests_fill_the_next_batch_while_the_slot_is_busy():
+    model = RecordingModel(delay=0.1)
+    batcher = InferenceBatcher(model, max_batch_size=8, max_wait=0., concurrency=1)
+
+    async def run():
+        first = asyncio.ensure_future(batcher.infer(np.array([0])))
+        await asyncio.sleep(0.02)
+        rest = [asyncio.ensure_future(batcher.infer(frame)) for frame in frames(5)]
+        await asyncio.gather(first, *rest)
+
+    asyncio.run(run())
+    assert model.batches == [1, 5]
+
+def test_errors_reach_every_request_of_the_batch():
+    def failing(frames, stages):
+        raise RuntimeError("model failed")
+
+    batcher = InferenceBatcher(failing, max_batch_size=4, max_wait=0.02)
+
+    async def run():
+        return await asyncio.gather(*(batcher.infer(frame) for frame in frames(3)), return_exceptions=True)
+
+    answers = asyncio.run(run())
+    assert all(isinstance(answer, RuntimeError) for answer in answers)
+
+def test_cancelled_requests_are_left_out_of_the_batch():
+    model = RecordingModel()
+    batcher = InferenceBatcher(model, max_batch_size=4, max_wait=0.05)
+
+    async def run():
+        cancelled = asyncio.ensure_future(batcher.infer(np.array([0])))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        kept = await batcher.infer(np.array([1]))
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        return kept
+
+    result, batch = asyncio.run(run())
+    assert (result, batch.batch_size) == (1, 1)
+    assert model.batches == [1]
+
+def test_queue_depth_counts_requests_waiting_for_a_slot():
+    batcher = InferenceBatcher(RecordingModel(delay=0.1), max_batch_size=1, max_wait=0., concurrency=1)
+
+    async def run():
+        requests = [asyncio.ensure_future(batcher.infer(frame)) for frame in frames(4)]
+        await asyncio.sleep(0.03)
+        depth = batcher.queue_depth()
+        await asyncio.gather(*requests)
+        return depth
+
+    assert batcher.queue_depth() == 0
+    assert asyncio.run(run()) == 3
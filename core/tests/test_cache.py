@@ -0,0 +1,92 @@
+import cv2
+import numpy as np
+import pytest
+
+from config import config
+from inference import cache
+from inference.cache import ENTRY_OVERHEAD, ResultCache
+from routers import cv
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+
+def test_entries_expire_after_the_ttl(clock):
+    results = ResultCache(max_bytes=10 ** 6, ttl=60.)
+    results.put("a", 1, 10)
+    clock.now += 59.
+    assert results.get("a") == 1
+    clock.now += 2.
+    assert results.get("a") is None
+    assert results.stats()["entries"] == 0 and results.stats()["bytes"] == 0
+
+def test_least_recently_used_entries_are_evicted_over_the_byte_cap(clock):
+    results = ResultCache(max_bytes=3 * (100 + ENTRY_OVERHEAD), ttl=60.)
+    for key in "abc":
+        results.put(key, key, 100)
+    assert results.get("a") == "a"  # b is now the least recently used
+    results.put("d", "d", 100)
+    assert results.get("b") is None
+    assert [results.get(key) for key in "acd"] == ["a", "c", "d"]
+    assert results.stats()["bytes"] == 3 * (100 + ENTRY_OVERHEAD)
+
+def test_values_larger_than_the_cap_are_not_cached(clock):
+    results = ResultCache(max_bytes=1000, ttl=60.)
+    results.put("big", "big", 1000)
+    assert results.get("big") is None
+
+def test_replacing_an_entry_counts_its_bytes_once(clock):
+    results = ResultCache(max_bytes=10 ** 6, ttl=60.)
+    results.put("a", 1, 100)
+    results.put("a", 2, 200)
+    assert results.get("a") == 2
+    assert results.stats()["bytes"] == 200 + ENTRY_OVERHEAD
+
+def test_keys_depend_on_the_upload_and_the_model_configuration():
+    config_key = ("model.onnx", "cpu", 0.25, 0.45, None)
+    key = ResultCache.key(b"image", config_key)
+    assert key == ResultCache.key(memoryview(b"image"), config_key)
+    assert key != ResultCache.key(b"other image", config_key)
+    assert key != ResultCache.key(b"image", ("model.onnx", "cpu", 0.5, 0.45, None))
+
+def test_a_configuration_change_invalidates_the_entries(clock):
+    results = ResultCache(max_bytes=10 ** 6, ttl=60.)
+    old = ResultCache.key(b"image", ("model.onnx", "cpu", 0.25, 0.45, None))
+    results.put(old, "old results", 10)
+    assert results.get(ResultCache.key(b"image", ("model.onnx", "cpu", 0.5, 0.45, None))) is None
+    results.clear()
+    assert results.get(old) is None
+    assert results.stats()["bytes"] == 0
+
+def test_stats_count_hits_and_misses(clock):
+    results = ResultCache(max_bytes=10 ** 6, ttl=60.)
+    results.put("a", 1, 10)
+    results.get("a")
+    results.get("b")
+    stats = results.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 1, 0.5)
+
+def test_set_config_clears_the_cache_of_infer_image(api, monkeypatch):
+    monkeypatch.setattr(cv.registry, "configure", lambda model_config: "applied")
+    image = cv2.imencode(".png", np.zeros((32, 32, 3), dtype=np.uint8))[1].tobytes()
+
+    def cached():
+        response = api.post("/cv/infer_image", files={"file": ("image.png", image, "image/png")})
+        assert response.status_code == 200
+        return response.json()["processing_time"]["cached"]
+
+    assert [cached(), cached()] == [False, True]
+    model_config = dict(config.DEFAULT_CONFIG, confidence_threshold=0.5)
+    assert api.post("/cv/set_config/", json=model_config).status_code == 200
+    assert cached() is False
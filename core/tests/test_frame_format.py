@@ -0,0 +1,117 @@
+import os
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+from util.frame_format import (FRAME_MAGIC, decode_frame, encode_frame, encode_frame_b64, frame_from_bytes,
+                               frame_info, frame_to_buffers, frame_to_bytes)
+
+CORE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rgb_frame(height=24, width=32):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.int16, np.uint16, np.float32, np.float64, np.bool_])
+def test_raw_round_trip_keeps_dtype_and_shape(dtype):
+    frame = (np.arange(2 * 3 * 4) % 2).astype(dtype).reshape(2, 3, 4)
+    decoded = frame_from_bytes(frame_to_bytes(frame))
+    assert decoded.dtype == frame.dtype
+    np.testing.assert_array_equal(decoded, frame)
+
+def test_raw_round_trip_fortran_order_is_not_copied():
+    frame = np.asfortranarray(rgb_frame())
+    header, payload = frame_to_buffers(frame)
+    assert np.shares_memory(np.frombuffer(payload, dtype=np.uint8), frame)
+    np.testing.assert_array_equal(frame_from_bytes(header + bytes(payload)), frame)
+
+def test_raw_round_trip_non_contiguous():
+    frame = rgb_frame()[:, ::2]
+    np.testing.assert_array_equal(frame_from_bytes(frame_to_bytes(frame)), frame)
+
+def test_raw_decoding_is_a_view_of_the_buffer():
+    data = bytearray(frame_to_bytes(rgb_frame()))
+    decoded = frame_from_bytes(data)
+    decoded[0, 0, 0] = 7
+    assert frame_from_bytes(data)[0, 0, 0] == 7
+
+def test_png_round_trip_is_lossless():
+    frame = rgb_frame()
+    np.testing.assert_array_equal(frame_from_bytes(frame_to_bytes(frame, "png")), frame)
+
+def test_jpeg_round_trip_keeps_colors():
+    frame = np.zeros((16, 16, 3), dtype=np.uint8)
+    frame[..., 0] = 255
+    decoded = frame_from_bytes(frame_to_bytes(frame, "jpeg", 95))
+    assert decoded.shape == frame.shape
+    assert decoded[..., 0].min() > 240 and decoded[..., 2].max() < 15
+
+def test_image_payloads_are_standard_files():
+    frame = np.zeros((8, 8, 3), dtype=np.uint8)
+    frame[..., 0] = 255
+    header, payload = frame_to_buffers(frame, "png")
+    assert cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)[0, 0].tolist() == [0, 0, 255]
+
+    foreign = cv2.imencode(".png", cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))[1].tobytes()
+    np.testing.assert_array_equal(frame_from_bytes(header + foreign), frame)
+
+def test_frame_info_reads_the_header():
+    frame = rgb_frame()
+    data = frame_to_bytes(frame, "png")
+    codec, shape, payload = frame_info(data)
+    assert (codec, shape) == ("png", frame.shape)
+    assert bytes(payload[:8]) == b"\x89PNG\r\n\x1a\n"
+
+def test_base64_helpers():
+    frame = rgb_frame()
+    np.testing.assert_array_equal(decode_frame(encode_frame_b64(frame)), frame)
+    shape, arr = encode_frame(frame)
+    np.testing.assert_array_equal(decode_frame(arr, shape), frame)
+
+@pytest.mark.parametrize("frame", [np.array([["a"]]), np.array([[1 + 2j]]), np.array([[object()]])])
+def test_encoding_rejects_non_numeric_dtypes(frame):
+    with pytest.raises(ValueError):
+        frame_to_bytes(frame)
+
+def with_dtype(data: bytes, dtype: bytes) -> bytes:
+    return data[:4] + dtype.ljust(8, b"\0") + data[12:]
+
+@pytest.mark.parametrize("dtype", [b"|O", b"<c8", b"|S4", b"<U2", b"|V8", b"<M8[s]", b"nope"])
+def test_decoding_rejects_non_numeric_dtypes(dtype):
+    with pytest.raises(ValueError):
+        frame_from_bytes(with_dtype(frame_to_bytes(rgb_frame()), dtype))
+
+def test_decoding_rejects_strides_outside_the_payload():
+    frame = rgb_frame(4, 4)
+    data = bytearray(frame_to_bytes(frame))
+    header_size = len(data) - frame.nbytes
+    struct.pack_into("<q", data, header_size - 24, 10 ** 6)  # stride of the first dimension
+    with pytest.raises(ValueError):
+        frame_from_bytes(data)
+
+@pytest.mark.parametrize("cut", [0, 1, 12, 14, 20])
+def test_decoding_rejects_truncated_headers(cut):
+    with pytest.raises(ValueError):
+        frame_from_bytes(frame_to_bytes(rgb_frame())[:cut])
+
+def test_decoding_rejects_payload_size_mismatch():
+    with pytest.raises(ValueError):
+        frame_from_bytes(frame_to_bytes(rgb_frame())[:-1])
+
+def test_decoding_rejects_bad_magic_and_codec():
+    data = frame_to_bytes(rgb_frame())
+    with pytest.raises(ValueError):
+        frame_from_bytes(b"XX" + data[2:])
+    with pytest.raises(ValueError):
+        frame_from_bytes(FRAME_MAGIC + data[2:3] + b"\x09" + data[4:])
+
+def test_app_copy_is_identical():
+    app_copy = os.path.join(CORE_DIR, "..", "app", "stream", "helper.py")
+    if not os.path.exists(app_copy):
+        pytest.skip("the app is not next to the core")
+    with open(os.path.join(CORE_DIR, "util", "frame_format.py"), "rb") as core, open(app_copy, "rb") as app:
+        assert core.read() == app.read()
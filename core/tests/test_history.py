@@ -0,0 +1,131 @@
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from util.history import HistoryStore
+
+DAY = 86400
+START = 1_700_000_000.
+
+
+def detections(count, seed):
+    rng = np.random.default_rng(seed)
+    boxes = np.empty((count, 6), dtype=np.float32)
+    boxes[:, :4] = rng.uniform(0, 100, (count, 4))
+    boxes[:, 4] = rng.uniform(0, 1, count)
+    boxes[:, 5] = rng.integers(0, 4, count)
+    return boxes
+
+@pytest.fixture(scope="module")
+def history(tmp_path_factory):
+    """A store with three days of frames of two cameras, and the records it was given."""
+    store = HistoryStore(str(tmp_path_factory.mktemp("history") / "history.db"), batch_size=64)
+    rng = np.random.default_rng(0)
+    records = []
+    for camera in ("a", "b"):
+        # with a frame of both cameras at the same time, ordered by id within the timestamp
+        timestamps = np.sort(np.append(START + rng.uniform(0, 3 * DAY, 300), START + DAY + 0.5))
+        for i, timestamp in enumerate(timestamps):
+            boxes = detections(int(rng.integers(0, 5)), i)
+            assert store.add(camera, float(timestamp), boxes)
+            records.append((camera, float(timestamp), boxes))
+    store.close()
+    assert store.stats()["stored"] == len(records)
+    return store, records
+
+
+def test_frames_are_paged_by_keyset_in_time_order(history):
+    store, records = history
+    pages, after = [], None
+    while True:
+        page = store.frames(limit=7, after=after)
+        pages.append(page)
+        if len(page) < 7:
+            break
+        after = (page[-1]["timestamp"], page[-1]["id"])
+    frames = [frame for page in pages for frame in page]
+
+    assert len(frames) == len(records)
+    assert len({frame["id"] for frame in frames}) == len(records)
+    assert [(f["timestamp"], f["id"]) for f in frames] == sorted((f["timestamp"], f["id"]) for f in frames)
+
+def test_frames_filter_by_camera_and_range(history):
+    store, records = history
+    start, end = START + DAY, START + 2 * DAY
+    frames = store.frames("b", start, end, limit=1000)
+    expected = [(ts, boxes) for camera, ts, boxes in records if camera == "b" and start <= ts < end]
+    assert [frame["timestamp"] for frame in frames] == [ts for ts, _ in expected]
+    for frame, (_, boxes) in zip(frames, expected):
+        assert frame["detections"] == len(boxes)
+        np.testing.assert_allclose(np.reshape(frame["boxes"], (-1, 6)), boxes)
+
+def expected_time_counts(records, bucket, camera=None, start=None, end=None):
+    counts = Counter()
+    first = math.floor(start / bucket) * bucket if start is not None else -math.inf
+    last = math.ceil(end / bucket) * bucket if end is not None else math.inf
+    for camera_, ts, boxes in records:
+        if (camera is None or camera_ == camera) and first <= ts < last:
+            counts[camera_, int(ts // bucket) * bucket] += np.array([1, len(boxes)])
+    return [{"camera": c, "timestamp": t, "frames": int(n[0]), "detections": int(n[1])}
+            for (c, t), n in sorted(counts.items())]
+
+@pytest.mark.parametrize("bucket", [60, 300, 3600, 7200, DAY])
+def test_time_counts_match_the_frames(history, bucket):
+    store, records = history
+    assert store.counts("time", bucket=bucket) == expected_time_counts(records, bucket)
+
+def test_time_counts_of_a_range(history):
+    store, records = history
+    start, end = START + 0.4 * DAY + 17, START + 2.2 * DAY - 5
+    assert store.counts("time", "a", start, end, 3600) == expected_time_counts(records, 3600, "a", start, end)
+
+def expected_class_counts(records, camera=None, start=None, end=None):
+    counts = Counter()
+    first = math.floor(start / 60) * 60 if start is not None else -math.inf
+    last = math.ceil(end / 60) * 60 if end is not None else math.inf
+    for camera_, ts, boxes in records:
+        if (camera is None or camera_ == camera) and first <= ts < last:
+            for class_id in boxes[:, 5].astype(int):
+                counts[camera_, int(class_id)] += 1
+    return [{"camera": c, "class_id": k, "detections": n} for (c, k), n in sorted(counts.items())]
+
+@pytest.mark.parametrize("start, end", [
+    (None, None),
+    (START + 0.3 * DAY + 7, START + 2.6 * DAY + 11),  # days, hours and minutes at both ends
+    (START + DAY + 125, START + DAY + 3000),  # within an hour
+    (None, START + 1.5 * DAY),
+    (START + 1.5 * DAY, None),
+])
+def test_class_counts_combine_the_rollups(history, start, end):
+    store, records = history
+    assert store.counts("class", None, start, end) == expected_class_counts(records, None, start, end)
+
+def test_class_counts_of_a_camera(history):
+    store, records = history
+    assert store.counts("class", "a") == expected_class_counts(records, "a")
+
+def test_frames_not_newer_than_the_last_one_are_ignored(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    assert store.add("a", 10., detections(1, 0))
+    assert not store.add("a", 10., detections(1, 0))
+    assert not store.add("a", 9., detections(1, 0))
+    assert store.add("b", 9., detections(1, 0))
+    store.close()
+    assert store.stats()["stored"] == 2
+
+def test_last_timestamps_are_kept_for_the_latest_cameras(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"), max_cameras=2)
+    for camera in "abc":
+        store.add(camera, 10., detections(0, 0))
+    assert not store.add("c", 10., detections(0, 0))
+    assert store.add("a", 10., detections(0, 0))  # forgotten, as the least recently seen
+    store.close()
+
+def test_keyset_separates_frames_of_the_same_timestamp(history):
+    store, _ = history
+    tied = store.frames(start=START + DAY + 0.5, end=START + DAY + 0.6, limit=10)
+    assert [frame["camera"] for frame in tied] == ["a", "b"]
+    first_page = store.frames(start=START + DAY + 0.5, limit=1)
+    assert store.frames(after=(first_page[0]["timestamp"], first_page[0]["id"]), limit=1) == tied[1:]
@@ -0,0 +1,120 @@
+import asyncio
+
+import cv2
+import numpy as np
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from config import config
+from routers import cv
+from stream.ingest import CreditWindow, pack_ingest_frame, unpack_ingest_frame
+from util.frame_format import frame_to_buffers
+
+
+def frame(height=32, width=48):
+    return np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+def message(*buffers) -> bytes:
+    return b"".join(pack_ingest_frame("edge-1", 1000., frame(), "png")[:2] + list(buffers))
+
+
+def test_message_round_trip():
+    data = b"".join(pack_ingest_frame("edge-1", 1234.5, frame(), "raw"))
+    camera, timestamp, payload = unpack_ingest_frame(data)
+    assert (camera, timestamp) == ("edge-1", 1234.5)
+    assert bytes(payload) == b"".join(frame_to_buffers(frame(), "raw"))
+
+@pytest.mark.parametrize("data", [b"", b"\0" * 9, b"\0" * 8 + b"\x05\x00abc", b"\0" * 8 + b"\x00\x00"])
+def test_malformed_messages_are_rejected(data):
+    with pytest.raises(ValueError):
+        unpack_ingest_frame(data)
+
+
+def test_credits_never_exceed_the_window():
+    window = CreditWindow(max_credits=4, max_queue_wait=0.1)
+    assert window.grant() == 4
+    assert all(window.take() for _ in range(4))
+    assert not window.take()
+    assert window.grant() == 0
+
+def test_failed_frames_return_their_credit_without_moving_the_window():
+    window = CreditWindow(max_credits=4, max_queue_wait=0.1)
+    window.grant()
+    window.take()
+    assert window.release(None) == 1
+    assert (window.window, window.in_flight, window.available) == (4, 0, 4)
+
+def test_the_window_halves_on_slow_frames_and_grows_back_by_one():
+    window = CreditWindow(max_credits=8, max_queue_wait=0.1)
+    window.grant()
+    for _ in range(3):
+        window.take()
+    assert window.release(0.5) == 0  # window 4, 2 in flight and 5 credits held
+    assert window.window == 4
+    window.release(0.5)
+    window.release(0.5)
+    assert window.window == 1
+    assert window.grant() == 0  # the client still holds 5 credits
+    for _ in range(5):
+        window.take()
+    for wait in (0., 0., 0., 0., 0.):
+        window.release(wait)
+    assert window.window == 6
+
+
+def receive(websocket):
+    return websocket.receive_json()
+
+def test_bad_frames_are_answered_with_an_error_and_their_credit(api):
+    bomb_header = frame_to_buffers(np.zeros((8, 8, 3), dtype=np.uint8), "jpeg")[0]
+    big = cv2.imencode(".jpg", np.zeros((64, 64, 3), dtype=np.uint8))[1].tobytes()
+    bad = [
+        b"not a frame",
+        message(b"OD\x01\x00|O\0\0\0\0\0\0\x01" + b"\0" * 16),  # object dtype
+        message(bomb_header, big),  # a larger image than its header says
+        message(frame_to_buffers(np.zeros((8, 8, 3), dtype=np.uint8), "png")[0], b"\x89PNG garbage"),
+        message(*frame_to_buffers(np.zeros((8, 8), dtype=np.uint8), "raw")),  # not RGB
+    ]
+    with api.websocket_connect("/cv/ingest") as websocket:
+        assert receive(websocket) == {"type": "credit", "credit": config.INGEST_MAX_CREDITS}
+        for seq, data in enumerate(bad, 1):
+            websocket.send_bytes(data)
+            answer = receive(websocket)
+            assert (answer["type"], answer["seq"], answer["credit"]) == ("error", seq, 1)
+
+def test_frames_are_answered_with_their_results(api):
+    with api.websocket_connect("/cv/ingest") as websocket:
+        receive(websocket)
+        websocket.send_bytes(b"".join(pack_ingest_frame("edge-1", 1000., frame(), "jpeg")))
+        answer = receive(websocket)
+    assert (answer["type"], answer["seq"], answer["timestamp"], answer["credit"]) == ("response", 1, 1000., 1)
+    assert answer["response"]["camera_id"] == "edge-1"
+
+def test_model_errors_return_the_credit(api, monkeypatch):
+    async def failing(np_img):
+        raise RuntimeError("model crashed")
+
+    monkeypatch.setattr(cv, "run_model", failing)
+    with api.websocket_connect("/cv/ingest") as websocket:
+        receive(websocket)
+        websocket.send_bytes(b"".join(pack_ingest_frame("edge-1", 1000., frame(), "png")))
+        answer = receive(websocket)
+    assert answer == {"type": "error", "seq": 1, "detail": "Could not process frame", "credit": 1}
+
+def test_frames_sent_without_credit_close_the_socket(api, monkeypatch):
+    run_model = cv.run_model
+
+    async def slow(np_img):
+        await asyncio.sleep(1.)
+        return await run_model(np_img)
+
+    monkeypatch.setattr(cv, "run_model", slow)
+    data = b"".join(pack_ingest_frame("edge-1", 1000., frame(), "raw"))
+    with api.websocket_connect("/cv/ingest") as websocket:
+        receive(websocket)
+        for _ in range(config.INGEST_MAX_CREDITS + 1):
+            websocket.send_bytes(data)
+        with pytest.raises(WebSocketDisconnect) as closed:
+            while True:
+                websocket.receive_json()
+    assert closed.value.code == 1008
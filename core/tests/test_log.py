@@ -0,0 +1,77 @@
+import json
+import logging
+import queue
+
+import pytest
+
+from util import log
+from util.log import DroppingQueueHandler, JsonFormatter, RateLimitFilter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(log.time, "monotonic", clock)
+    return clock
+
+def record(line=10, **extra):
+    return logging.makeLogRecord({"msg": "message", "pathname": "camera.py", "lineno": line, **extra})
+
+
+def test_a_call_site_gets_its_burst_then_its_rate(clock):
+    rate_limit = RateLimitFilter(rate=2., burst=3)
+    assert [rate_limit.filter(record()) for _ in range(5)] == [True, True, True, False, False]
+    clock.now += 1.
+    assert [rate_limit.filter(record()) for _ in range(3)] == [True, True, False]
+    assert rate_limit.suppressed == 3
+
+def test_call_sites_have_their_own_buckets(clock):
+    rate_limit = RateLimitFilter(rate=1., burst=1)
+    assert rate_limit.filter(record(line=10))
+    assert not rate_limit.filter(record(line=10))
+    assert rate_limit.filter(record(line=11))
+
+def test_the_next_kept_record_carries_the_suppressed_count(clock):
+    rate_limit = RateLimitFilter(rate=1., burst=1)
+    rate_limit.filter(record())
+    for _ in range(4):
+        rate_limit.filter(record())
+    clock.now += 1.
+    kept = record()
+    assert rate_limit.filter(kept)
+    assert kept.suppressed == 4
+    clock.now += 1.
+    later = record()
+    assert rate_limit.filter(later)
+    assert not hasattr(later, "suppressed")
+
+def test_sampled_records_are_kept_once_every_1_over_sample_calls(clock):
+    rate_limit = RateLimitFilter(rate=1000., burst=1000)
+    kept = [rate_limit.filter(record(sample=0.25)) for _ in range(12)]
+    assert sum(kept) == 3
+    assert rate_limit.suppressed == 0
+
+def test_tokens_refill_up_to_the_burst(clock):
+    rate_limit = RateLimitFilter(rate=1., burst=2)
+    rate_limit.filter(record())
+    clock.now += 100.
+    assert [rate_limit.filter(record()) for _ in range(3)] == [True, True, False]
+
+
+def test_full_queue_drops_records():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    handler.emit(record())
+    handler.emit(record())
+    assert handler.dropped == 1 and handler.queue.qsize() == 1
+
+def test_json_lines_hold_the_extra_fields():
+    entry = json.loads(JsonFormatter().format(record(stream="rtsp://camera/live", attempts_left=3)))
+    assert (entry["message"], entry["stream"], entry["attempts_left"]) == ("message", "rtsp://camera/live", 3)
+    assert "sample" not in entry
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from stream import motion
+from stream.motion import MotionGate, MotionStats
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(motion.time, "monotonic", clock)
+    return clock
+
+def scene(seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (120, 160, 3), dtype=np.uint8)
+
+
+def test_static_frames_are_skipped_until_max_skip(clock):
+    gate = MotionGate(max_skip=5.)
+    frame = scene()
+    assert gate.check(frame)
+    for _ in range(4):
+        clock.now += 1.
+        assert not gate.check(frame)
+    clock.now += 1.
+    assert gate.check(frame)
+    clock.now += 1.
+    assert not gate.check(frame)
+    assert (gate.stats.frames, gate.stats.skipped) == (7, 5)
+
+def test_max_skip_counts_from_the_last_model_run(clock):
+    gate = MotionGate(max_skip=5., alpha=1.)  # the background is the last frame
+    gate.check(scene(0))
+    clock.now += 3.
+    assert gate.check(scene(1))  # changed: runs and restarts the max_skip period
+    clock.now += 4.
+    assert not gate.check(scene(1))
+    clock.now += 1.
+    assert gate.check(scene(1))
+
+def test_changed_frames_run_the_model(clock):
+    gate = MotionGate(max_skip=60.)
+    gate.check(scene(0))
+    clock.now += 0.1
+    assert gate.check(scene(1))
+    assert gate.change >= gate.threshold
+
+def test_zero_threshold_disables_the_gate(clock):
+    gate = MotionGate(threshold=0.)
+    frame = scene()
+    assert all(gate.check(frame) for _ in range(5))
+
+def test_resolution_change_resets_the_background(clock):
+    gate = MotionGate(max_skip=60.)
+    gate.check(scene())
+    clock.now += 0.1
+    assert gate.check(np.zeros((60, 200, 3), dtype=np.uint8))
+    assert gate.change == 1.
+
+def test_gates_of_a_camera_share_their_stats(clock):
+    stats = MotionStats()
+    gates = [MotionGate(max_skip=60., stats=stats) for _ in range(2)]
+    for gate in gates:
+        gate.check(scene())
+        gate.check(scene())
+    assert stats.as_dict() == {"frames": 4, "skipped": 2, "skip_ratio": 0.5}
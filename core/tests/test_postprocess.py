@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from benchmarks.bench_postprocess import _iou, reference_postprocess, synthetic_output
+from inference.postprocess import MAX_NMS_BOXES, _chunked_nms, nms, postprocess
+
+
+def reference_nms(boxes, scores, groups, iou_threshold):
+    """Greedy per-box NMS within groups."""
+    kept = {}
+    for i in sorted(range(len(boxes)), key=lambda i: -scores[i]):
+        group = kept.setdefault(groups[i], [])
+        if all(_iou(boxes[i], boxes[k]) <= iou_threshold for k in group):
+            group.append(i)
+    return sorted((i for group in kept.values() for i in group), key=lambda i: -scores[i])
+
+def random_boxes(count, groups, seed, size=200.):
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, size, (count, 2))
+    wh = rng.uniform(5, 60, (count, 2))
+    boxes = np.hstack([xy, xy + wh]).astype(np.float32)
+    return boxes, rng.permutation(count).astype(np.float32) / count, rng.integers(0, groups, count)
+
+def letterbox(batch, input_size=640, height=480, width=640):
+    image_sizes = np.tile(np.array([[height, width]], dtype=np.float32), (batch, 1))
+    scales = np.full((batch, 2), min(input_size / width, input_size / height), dtype=np.float32)
+    pads = np.tile(np.array([[0., (input_size - height * scales[0, 1]) / 2]], dtype=np.float32), (batch, 1))
+    return scales, pads, image_sizes
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("iou_threshold", [0.3, 0.45, 0.7])
+def test_nms_matches_greedy_loop(seed, iou_threshold):
+    boxes, scores, groups = random_boxes(150, 3, seed)
+    expected = reference_nms(boxes, scores, groups, iou_threshold)
+    assert nms(boxes, scores, groups, iou_threshold).tolist() == expected
+
+def test_nms_suppression_chain():
+    # b overlaps a and c, c does not overlap a: a suppresses b, so c is kept
+    boxes = np.array([[0, 0, 10, 10], [4, 0, 14, 10], [8, 0, 18, 10]], dtype=np.float32)
+    scores = np.array([0.9, 0.8, 0.7], dtype=np.float32)
+    assert nms(boxes, scores, np.zeros(3, dtype=np.int64), 0.3).tolist() == [0, 2]
+
+def test_nms_of_no_boxes():
+    assert nms(np.empty((0, 4)), np.empty(0), np.empty(0, dtype=np.int64), 0.5).tolist() == []
+
+def test_chunked_nms_matches_greedy_loop_over_the_chunk_size():
+    boxes, scores, groups = random_boxes(3 * MAX_NMS_BOXES, 7, seed=1, size=100.)
+    groups[:MAX_NMS_BOXES + 10] = 0  # one group larger than a chunk
+    order = np.argsort(groups, kind="stable")
+    boxes, scores, groups = boxes[order], scores[order], groups[order]
+    kept = _chunked_nms(boxes, scores, groups, 0.45)
+    assert sorted(kept.tolist()) == sorted(reference_nms(boxes, scores, groups, 0.45))
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("class_ids", [None, [0, 2, 5]])
+def test_postprocess_matches_reference_loop(seed, class_ids):
+    raw = synthetic_output(3, 2000, 8, 640, seed)
+    call = (raw, *letterbox(3), 0.25, 0.45, class_ids)
+    fast, slow = postprocess(*call), reference_postprocess(*call)
+    assert len(fast) == len(slow) == 3
+    for a, b in zip(fast, slow):
+        assert a.shape == b.shape
+        np.testing.assert_allclose(a, b, atol=1e-2)
+
+def test_postprocess_caps_detections_per_image():
+    raw = synthetic_output(2, 2000, 4, 640, 0)
+    detections = postprocess(raw, *letterbox(2), 0.01, 0.9, max_detections=5)
+    assert [len(d) for d in detections] == [5, 5]
+    assert all(np.all(np.diff(d[:, 4]) <= 0) for d in detections)
+
+def test_postprocess_without_candidates():
+    raw = synthetic_output(2, 100, 4, 640, 0)
+    raw[..., 4] = 0.
+    assert [d.shape for d in postprocess(raw, *letterbox(2), 0.25, 0.45)] == [(0, 6), (0, 6)]
@@ -0,0 +1,97 @@
+import pytest
+
+from stream import scheduler as scheduler_module
+from stream.scheduler import FrameScheduler, fair_share
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(scheduler_module.time, "monotonic", clock)
+    return clock
+
+
+def test_fair_share_gives_every_target_within_budget():
+    assert fair_share([5., 10., 15.], 40.) == [5., 10., 15.]
+
+def test_fair_share_splits_what_small_lanes_leave():
+    assert fair_share([2., 30., 30.], 20.) == [2., 9., 9.]
+
+def test_fair_share_keeps_the_order_of_the_targets():
+    assert fair_share([30., 2., 10.], 16.) == [7., 2., 7.]
+
+def test_fair_share_keeps_a_minimum_rate():
+    assert fair_share([10., 10., 0.5], 1., min_fps=1.) == [1., 1., 0.5]
+
+def test_fair_share_of_no_lanes():
+    assert fair_share([], 10.) == []
+
+
+def test_budget_starts_at_the_sum_of_the_targets(clock):
+    scheduler = FrameScheduler()
+    lanes = [scheduler.lane("a", 10.), scheduler.lane("b", 20.)]
+    assert scheduler.budget == 30.
+    assert [lane.fps for lane in lanes] == [10., 20.]
+
+def test_overload_cuts_the_budget_once_per_cooldown(clock):
+    scheduler = FrameScheduler(max_queue_wait=0.1, decrease=0.5, cooldown=1.)
+    scheduler.lane("a", 10.)
+    scheduler.lane("b", 10.)
+
+    scheduler.report(0.5)
+    assert scheduler.overloaded and scheduler.budget == 10.
+    clock.now += 0.5
+    scheduler.report(0.5)
+    assert scheduler.budget == 10.  # within the cooldown
+    clock.now += 0.5
+    scheduler.report(0.5)
+    assert scheduler.budget == 5.
+
+def test_cuts_start_from_the_achieved_rate(clock):
+    scheduler = FrameScheduler(max_queue_wait=0.1, decrease=0.5, cooldown=1.)
+    lane = scheduler.lane("a", 20.)
+    lane.achieved_fps = 8.
+    scheduler.report(0.5)
+    assert scheduler.budget == 4.
+
+def test_cuts_keep_the_minimum_rate_of_every_lane(clock):
+    scheduler = FrameScheduler(max_queue_wait=0.1, min_fps=2., decrease=0.1, cooldown=0.)
+    lanes = [scheduler.lane("a", 10.), scheduler.lane("b", 10.)]
+    for _ in range(5):
+        clock.now += 1.
+        scheduler.report(0.5)
+    assert scheduler.budget == 4.
+    assert [lane.fps for lane in lanes] == [2., 2.]
+
+def test_budget_grows_back_additively_up_to_the_demand(clock):
+    scheduler = FrameScheduler(max_queue_wait=0.1, decrease=0.5, increase=0.1, cooldown=1.)
+    scheduler.lane("a", 10.)
+    scheduler.lane("b", 10.)
+    scheduler.report(0.5)
+    assert scheduler.budget == 10.
+
+    clock.now += 1.
+    scheduler.report(0.)
+    assert not scheduler.overloaded
+    assert scheduler.budget == pytest.approx(12.)  # 0.1 * 20 fps per second
+    clock.now += 100.
+    scheduler.report(0.)
+    assert scheduler.budget == 20.
+
+def test_removing_a_lane_gives_its_share_to_the_others(clock):
+    scheduler = FrameScheduler(max_queue_wait=0.1, decrease=0.5, cooldown=1.)
+    a = scheduler.lane("a", 10.)
+    b = scheduler.lane("b", 10.)
+    scheduler.report(0.5)
+    assert (a.fps, b.fps) == (5., 5.)
+    b.close()
+    assert (scheduler.budget, a.fps) == (10., 10.)
+    assert scheduler.stats()["cameras"] == {"a": {"lanes": 1, "target_fps": 10., "allowed_fps": 10.,
+                                                  "achieved_fps": 0.}}
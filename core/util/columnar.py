@@ -0,0 +1,63 @@
+from typing import Optional
+
+import msgpack
+import numpy as np
+import orjson
+
+
+COLUMNAR_JSON_MEDIA_TYPE = "application/vnd.detections.columnar+json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+_MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+COLUMNS = ("xmin", "ymin", "xmax", "ymax", "d_score", "class_id")
+
+
+def columnar_media_type(accept: Optional[str], columnar: bool = False) -> Optional[str]:
+    """Pick the columnar encoding a client asked for.
+
+    A client asks for the columnar format with the `format=columnar` query flag
+    or by accepting one of the columnar media types. msgpack is only produced
+    in columnar form.
+
+    Args:
+        accept: Value of the Accept header.
+        columnar: True if the columnar format was requested by query flag.
+
+    Returns:
+        COLUMNAR_JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE or None for the default Response.
+    """
+    accepted = [part.split(";")[0].strip().lower() for part in (accept or "").split(",")]
+    for media_type in accepted:
+        if media_type in _MSGPACK_MEDIA_TYPES:
+            return MSGPACK_MEDIA_TYPE
+        if media_type == COLUMNAR_JSON_MEDIA_TYPE:
+            return COLUMNAR_JSON_MEDIA_TYPE
+    return COLUMNAR_JSON_MEDIA_TYPE if columnar else None
+
+def columnar_results(coords: np.ndarray, detections: np.ndarray) -> dict:
+    """Lay out detections as parallel arrays, one per `COLUMNS` entry.
+
+    Args:
+        coords: Integer boxes of shape (N, 4) as xmin, ymin, xmax, ymax.
+        detections: Detections of shape (N, 6), for the score and class id columns.
+
+    Returns:
+        A dict of contiguous 1-D numpy arrays keyed by column name.
+    """
+    coords = np.ascontiguousarray(coords.T, dtype=np.int64)
+    return {
+        "xmin": coords[0], "ymin": coords[1], "xmax": coords[2], "ymax": coords[3],
+        "d_score": np.ascontiguousarray(detections[:, 4], dtype=np.float32),
+        "class_id": detections[:, 5].astype(np.int64),
+    }
+
+def encode_columnar(payload: dict, media_type: str) -> bytes:
+    """Encode a columnar payload holding numpy columns.
+
+    JSON is written by orjson straight from the numpy buffers; msgpack needs
+    the columns as lists.
+    """
+    if media_type == COLUMNAR_JSON_MEDIA_TYPE:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    payload = dict(payload, results={name: column.tolist()
+                                     for name, column in payload["results"].items()})
+    return msgpack.packb(payload, use_bin_type=True)
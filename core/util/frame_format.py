@@ -0,0 +1,221 @@
+import base64
+import struct
+from typing import List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+# The frame wire format shared by the API and the app. core/util/frame_format.py
+# and app/stream/helper.py are the same file, copied as each image only ships
+# its own directory; change both together.
+
+# Binary frame wire format (version 1), little endian:
+#   magic    2s   b"OD"
+#   version  B    FRAME_FORMAT_VERSION
+#   codec    B    one of FRAME_CODECS
+#   dtype    8s   numpy dtype string of a bool, int, uint or float dtype (e.g. b"|u1"), NUL padded
+#   ndim     B    number of dimensions
+#   shape    ndim * q
+#   strides  ndim * q   (raw payload only, zeros otherwise)
+# followed by the payload: the array memory for "raw", the encoded image
+# bytes for "jpeg" and "png". Frames of 3 or 4 channels are RGB(A); the
+# image payloads are ordinary JPEG and PNG files, so any encoder produces
+# them and they decode to the same colors as `decode_image`.
+FRAME_MAGIC = b"OD"
+FRAME_FORMAT_VERSION = 1
+FRAME_CODECS = {"raw": 0, "jpeg": 1, "png": 2}
+_FRAME_CODEC_NAMES = {value: key for key, value in FRAME_CODECS.items()}
+_FRAME_HEADER = struct.Struct("<2sBB8sB")
+# dtype kinds a frame may have: boolean, signed and unsigned integers, floats
+FRAME_DTYPE_KINDS = frozenset("biuf")
+
+
+def _frame_header(frame: np.ndarray, codec: str, strides: tuple) -> bytes:
+    """Pack the header describing `frame` for the given codec."""
+    if frame.dtype.hasobject or frame.dtype.kind not in FRAME_DTYPE_KINDS or len(frame.dtype.str) > 8:
+        raise ValueError(f"Unsupported frame dtype: {frame.dtype}")
+    dims = struct.pack(f"<{2 * frame.ndim}q", *frame.shape, *strides)
+    return _FRAME_HEADER.pack(FRAME_MAGIC, FRAME_FORMAT_VERSION, FRAME_CODECS[codec],
+                              frame.dtype.str.encode("ascii"), frame.ndim) + dims
+
+def _swap_red_blue(image: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """Convert an RGB(A) image to BGR(A), the channel order of OpenCV codecs, or back; others are returned as is."""
+    if image.ndim == 3 and image.shape[2] in (3, 4):
+        return cv2.cvtColor(image, cv2.COLOR_RGB2BGR if image.shape[2] == 3 else cv2.COLOR_RGBA2BGRA, dst=dst)
+    return image
+
+def frame_to_buffers(frame: np.ndarray, codec: str = "raw", quality: int = 90) -> List[Union[bytes, memoryview]]:
+    """Serialize a frame into the binary wire format without joining the parts.
+
+    Args:
+        frame: A numpy array representing a frame.
+        codec: Payload codec, one of "raw", "jpeg" or "png".
+        quality: JPEG quality (0-100) or PNG compression level (0-9).
+
+    Returns:
+        A list of buffers (header, payload) that can be written one after
+        another, e.g. with `socket.sendmsg` or `b"".join`.
+
+    Note:
+        For the "raw" codec the payload is a memoryview of the frame itself, so
+        C or Fortran contiguous frames are not copied.
+    """
+    if codec not in FRAME_CODECS:
+        raise ValueError(f"Unknown frame codec: {codec}")
+
+    if codec == "raw":
+        if not (frame.flags.c_contiguous or frame.flags.f_contiguous):
+            frame = np.ascontiguousarray(frame)
+        payload = memoryview(frame.reshape(-1, order="A")).cast("B")
+        return [_frame_header(frame, codec, frame.strides), payload]
+
+    image = _swap_red_blue(frame)
+    if codec == "jpeg":
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    else:
+        ok, encoded = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, quality])
+    if not ok:
+        raise ValueError(f"Could not encode frame with codec: {codec}")
+
+    return [_frame_header(frame, codec, (0,) * frame.ndim), memoryview(encoded).cast("B")]
+
+def frame_to_bytes(frame: np.ndarray, codec: str = "raw", quality: int = 90) -> bytes:
+    """Serialize a frame into a single binary wire format message.
+
+    Args:
+        frame: A numpy array representing a frame.
+        codec: Payload codec, one of "raw", "jpeg" or "png".
+        quality: JPEG quality (0-100) or PNG compression level (0-9).
+
+    Returns:
+        The serialized frame.
+    """
+    return b"".join(frame_to_buffers(frame, codec, quality))
+
+def _frame_dtype(name: bytes) -> np.dtype:
+    """Parse the dtype of a frame header, accepting only boolean and numeric dtypes."""
+    try:
+        dtype = np.dtype(name.rstrip(b"\0").decode("ascii"))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid frame dtype: {name!r}")
+    if dtype.hasobject or dtype.kind not in FRAME_DTYPE_KINDS:
+        raise ValueError(f"Unsupported frame dtype: {dtype}")
+    return dtype
+
+def _parse_frame_header(view: memoryview) -> Tuple[str, np.dtype, tuple, tuple, int]:
+    """Unpack the header of a frame message into codec, dtype, shape, strides and payload offset."""
+    if len(view) < _FRAME_HEADER.size:
+        raise ValueError("Frame buffer is shorter than the frame header")
+
+    magic, version, codec_id, dtype, ndim = _FRAME_HEADER.unpack_from(view)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Frame buffer does not start with the frame magic")
+    if version != FRAME_FORMAT_VERSION:
+        raise ValueError(f"Unsupported frame format version: {version}")
+    if codec_id not in _FRAME_CODEC_NAMES:
+        raise ValueError(f"Unknown frame codec id: {codec_id}")
+
+    offset = _FRAME_HEADER.size
+    if len(view) < offset + 16 * ndim:
+        raise ValueError("Frame buffer is shorter than the frame header")
+    dims = struct.unpack_from(f"<{2 * ndim}q", view, offset)
+    offset += 16 * ndim
+    dtype = _frame_dtype(dtype)
+    return _FRAME_CODEC_NAMES[codec_id], dtype, dims[:ndim], dims[ndim:], offset
+
+def frame_info(data: Union[bytes, bytearray, memoryview]) -> Tuple[str, tuple, memoryview]:
+    """Read the codec and shape of a serialized frame from its header, without decoding it.
+
+    Args:
+        data: A buffer holding one serialized frame.
+
+    Returns:
+        The codec name, the frame shape stated by the header and a view of the
+        payload, e.g. to check the size of an encoded image with `image_info`.
+
+    Raises:
+        ValueError: If the buffer does not start with a valid frame header.
+    """
+    view = memoryview(data).cast("B")
+    codec, _, shape, _, offset = _parse_frame_header(view)
+    return codec, shape, view[offset:]
+
+def frame_from_bytes(data: Union[bytes, bytearray, memoryview]) -> np.ndarray:
+    """Deserialize a frame from the binary wire format.
+
+    Args:
+        data: A buffer holding one serialized frame.
+
+    Returns:
+        A numpy array with the dtype and shape from the header. Raw payloads
+        are returned as a view over `data` (read-only for `bytes` input).
+
+    Raises:
+        ValueError: If the buffer is not a valid frame message.
+    """
+    view = memoryview(data).cast("B")
+    codec, dtype, shape, strides, offset = _parse_frame_header(view)
+    payload = view[offset:]
+
+    if codec == "raw":
+        if len(payload) != dtype.itemsize * int(np.prod(shape)):
+            raise ValueError("Frame payload size does not match the header")
+        return np.ndarray(shape, dtype=dtype, buffer=payload, strides=strides)
+
+    frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if frame is None:
+        raise ValueError("Could not decode frame payload")
+    frame = frame.reshape(shape)
+    return _swap_red_blue(frame, dst=frame).astype(dtype, copy=False)
+
+def encode_frame(frame: np.ndarray) -> tuple:
+    """Encode a frame.
+
+    Args:
+        frame: A numpy array representing a frame.
+
+    Returns:
+        A tuple containing the shape of the frame and the encoded frame as a string.
+
+    Note:
+        The frame is encoded using base64 encoding. Kept for existing clients,
+        new code should use `encode_frame_b64` or `frame_to_bytes`.
+    """
+    shape = frame.shape
+    arr = base64.b64encode(memoryview(np.ascontiguousarray(frame)).cast("B")).decode('utf-8')
+    return shape, arr
+
+def decode_frame(arr: str, shape: Optional[tuple] = None) -> np.ndarray:
+    """Decodes a base64 encoded string and reshapes it into a numpy array.
+
+    Args:
+        arr: A base64 encoded string.
+        shape: A tuple specifying the shape of the resulting numpy array. If
+            omitted, `arr` is expected to hold a binary wire format frame as
+            produced by `encode_frame_b64`.
+
+    Returns:
+        A numpy array with the specified shape.
+
+    Raises:
+        ValueError: If the shape does not match the dimensions of the decoded array.
+    """
+    if shape is None:
+        return frame_from_bytes(base64.b64decode(arr))
+
+    vec = np.frombuffer(base64.b64decode(arr), dtype=np.uint8).reshape(shape)
+    return vec
+
+def encode_frame_b64(frame: np.ndarray, codec: str = "raw", quality: int = 90) -> str:
+    """Encode a frame as a base64 string of the binary wire format.
+
+    Args:
+        frame: A numpy array representing a frame.
+        codec: Payload codec, one of "raw", "jpeg" or "png".
+        quality: JPEG quality (0-100) or PNG compression level (0-9).
+
+    Returns:
+        A string suitable for the `Frame` model. Unlike `encode_frame`, dtype and
+        shape travel with the data, so `decode_frame(arr)` needs no shape.
+    """
+    return base64.b64encode(frame_to_bytes(frame, codec, quality)).decode('ascii')
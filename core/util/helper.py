@@ -1,56 +1,175 @@
-import base64
+import io
+import mmap
 import os
+import struct
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional, Tuple, Union
 
 import cv2
 import numpy as np
 
+from util.frame_format import (FRAME_CODECS, FRAME_DTYPE_KINDS, FRAME_FORMAT_VERSION, FRAME_MAGIC, decode_frame,
+                               encode_frame, encode_frame_b64, frame_from_bytes, frame_info, frame_to_buffers,
+                               frame_to_bytes)
 
-def encode_frame(frame: np.ndarray) -> tuple:
-    """Encode a frame.
+
+def save_image(np_img: np.ndarray, output: str, source_name: str, image_format: str = "jpeg",
+               quality: int = 95) -> None:
+    """Saves an image to a specified location.
 
     Args:
-        frame: A numpy array representing a frame.
+        np_img: NumPy array representing the RGB image
+        output: Path to the output directory
+        source_name: Name of the image source
+        image_format: "jpeg" or "webp"
+        quality: Encoding quality (1-100)
 
     Returns:
-        A tuple containing the shape of the frame and the encoded frame as a string.
+        None
+    """
+    extension, flag = IMAGE_FORMATS[image_format]
+    output_path = os.path.join(output, f"{source_name}.{extension}")
+
+    cv2.imwrite(output_path, cv2.cvtColor(np_img, cv2.COLOR_RGB2BGR), [flag, int(quality)])
+
+IMAGE_FORMATS = {
+    "jpeg": ("jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": ("webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+_REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
 
-    Note:
-        The frame is encoded using base64 encoding.
+
+def decode_image(data: Union[bytes, memoryview], reduction: int = 1) -> Optional[np.ndarray]:
+    """Decodes an encoded image (JPEG, PNG, ...) into an RGB array.
+
+    Args:
+        data: The encoded image bytes, or any buffer holding them.
+        reduction: 1, 2, 4 or 8 to decode at a fraction of the resolution;
+            JPEG decoders then skip most of the work.
+
+    Returns:
+        The RGB image, or None if the data could not be decoded.
     """
-    shape = frame.shape
-    arr = base64.b64encode(frame.tobytes()).decode('utf-8')
-    return shape, arr
+    np_img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), _REDUCED_DECODE_FLAGS[reduction])
+    if np_img is None:
+        return None
+    return cv2.cvtColor(np_img, cv2.COLOR_BGR2RGB, dst=np_img)
 
-def decode_frame(arr: str, shape: tuple) -> np.ndarray:
-    """Decodes a base64 encoded string and reshapes it into a numpy array.
+def image_info(data: Union[bytes, memoryview]) -> Optional[Tuple[str, int, int]]:
+    """Reads the format and size of a JPEG or PNG image from its header, without decoding it.
 
     Args:
-        arr: A base64 encoded string.
-        shape: A tuple specifying the shape of the resulting numpy array.
+        data: The encoded image bytes, or any buffer holding them.
 
     Returns:
-        A numpy array with the specified shape.
+        The format ("jpeg" or "png"), width and height, or None for other or
+        malformed data.
+    """
+    data = memoryview(data)
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        width, height = struct.unpack(">II", data[16:24])
+        return "png", width, height
+
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+        elif marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return "jpeg", width, height
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            i += 2
+        else:
+            i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+    return None
+
+@contextmanager
+def file_buffer(f: BinaryIO) -> Iterator[memoryview]:
+    """Exposes the content of a file object as a buffer without copying it.
+
+    In-memory files (e.g. a SpooledTemporaryFile that was not rolled over to
+    disk) share their buffer, files on disk are memory mapped. The buffer is
+    only valid inside the context.
+
+    Args:
+        f: The file object.
 
-    Raises:
-        ValueError: If the shape does not match the dimensions of the decoded array.
+    Yields:
+        A read-only memoryview of the content.
     """
-    vec = np.frombuffer(base64.b64decode(arr), dtype=np.uint8).reshape(
-        shape[0], shape[1], shape[2])
-    return vec
+    raw = getattr(f, "_file", f)  # the underlying file of a SpooledTemporaryFile
+    if isinstance(raw, io.BytesIO):
+        with raw.getbuffer() as buffer, buffer.toreadonly() as readonly:
+            yield readonly
+        return
+
+    raw.flush()
+    if os.fstat(raw.fileno()).st_size == 0:
+        yield memoryview(b"")
+        return
+    with mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as buffer:
+        yield buffer
+
+def encode_jpeg(np_img: np.ndarray, quality: int = 85) -> bytes:
+    """Encodes an RGB image as JPEG.
 
-def save_image(np_img: np.ndarray, output: str, source_name: str) -> None:
-    """Saves an image to a specified location.
+    Args:
+        np_img: NumPy array representing the RGB image
+        quality: JPEG quality (0-100)
+
+    Returns:
+        The JPEG bytes.
+    """
+    ok, encoded = cv2.imencode(".jpg", cv2.cvtColor(np_img, cv2.COLOR_RGB2BGR),
+                               [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        raise ValueError("Could not encode image as JPEG")
+    return encoded.tobytes()
+
+def draw_detections(np_img: np.ndarray, detections, color: tuple = (0, 255, 0)) -> np.ndarray:
+    """Draws detection boxes on a copy of an image.
 
     Args:
         np_img: NumPy array representing the image
-        output: Path to the output directory
-        source_name: Name of the image source
+        detections: Rows starting with xmin, ymin, xmax, ymax and score, e.g. the
+            (N, 6) arrays returned by the detector
+        color: Box color in the channel order of `np_img`
 
     Returns:
-        None
+        The annotated image, or `np_img` itself if there is nothing to draw.
     """
+    if len(detections) == 0:
+        return np_img
 
-    output_path = os.path.join(output, f"{source_name}.jpg")
+    annotated = np_img.copy()
+    for xmin, ymin, xmax, ymax, score, *_ in detections:
+        xmin, ymin, xmax, ymax = (int(round(v)) for v in (xmin, ymin, xmax, ymax))
+        cv2.rectangle(annotated, (xmin, ymin), (xmax, ymax), color, 2)
+        cv2.putText(annotated, f"{score:.2f}", (xmin, max(ymin - 5, 0)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+    return annotated
 
-    cv2.imwrite(output_path, cv2.cvtColor(np_img, cv2.COLOR_RGB2BGR))
+def draw_results(np_img: np.ndarray, results: list, color: tuple = (0, 255, 0)) -> np.ndarray:
+    """Draws detection boxes on a copy of an image.
 
+    Args:
+        np_img: NumPy array representing the image
+        results: Objects with a `box` (xmin, ymin, xmax, ymax) and a `d_score`
+        color: Box color in the channel order of `np_img`
+
+    Returns:
+        The annotated image, or `np_img` itself if there is nothing to draw.
+    """
+    return draw_detections(np_img, [(result.box.xmin, result.box.ymin, result.box.xmax, result.box.ymax,
+                                     result.d_score) for result in results], color)
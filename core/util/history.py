@@ -0,0 +1,341 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from config import config
+from util.metrics import stage_seconds
+
+logger = logging.getLogger("core")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (
+    id INTEGER PRIMARY KEY,
+    camera TEXT NOT NULL,
+    ts REAL NOT NULL,
+    detections INTEGER NOT NULL,
+    detection_time REAL,
+    queue_wait REAL,
+    batch_size INTEGER,
+    boxes BLOB
+);
+CREATE INDEX IF NOT EXISTS frames_camera_ts ON frames (camera, ts);
+CREATE INDEX IF NOT EXISTS frames_ts ON frames (ts);
+"""
+
+# seconds per bucket of the rollup tables, each with a <unit>_counts table of
+# frames and detections and a <unit>_classes table of detections per class
+ROLLUPS = {"minute": 60, "hour": 3600, "day": 86400}
+
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {unit}_counts (
+    camera TEXT NOT NULL,
+    {unit} INTEGER NOT NULL,
+    frames INTEGER NOT NULL,
+    detections INTEGER NOT NULL,
+    PRIMARY KEY (camera, {unit})
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS {unit}_classes (
+    camera TEXT NOT NULL,
+    {unit} INTEGER NOT NULL,
+    class_id INTEGER NOT NULL,
+    detections INTEGER NOT NULL,
+    PRIMARY KEY (camera, {unit}, class_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS {unit}_counts_{unit} ON {unit}_counts ({unit}, frames, detections);
+CREATE INDEX IF NOT EXISTS {unit}_classes_{unit} ON {unit}_classes ({unit}, detections);
+"""
+
+
+class HistoryStore:
+    """An append-only SQLite store of per-frame detection results.
+
+    `add` only queues a record; a writer thread inserts queued records in one
+    transaction every `flush_interval` seconds or `batch_size` records, and
+    keeps per-minute, hour and day rollups of frame and per-class detection
+    counts up to date, so aggregations over long ranges read the small rollup
+    tables instead of every frame. Boxes are stored as a float32 blob per frame. When the queue
+    is full records are dropped, the stream loops never wait for the disk.
+    The timestamp of the last frame is kept for the `max_cameras` most
+    recently seen cameras only, as ingest clients choose their camera ids.
+
+    Attributes:
+        path : path of the SQLite database
+        flush_interval : maximum seconds between two inserts
+        batch_size : maximum number of records inserted at once
+        max_cameras : number of cameras whose last frame timestamp is kept
+        stored : number of records inserted
+        dropped : number of records dropped because the queue was full
+
+    Methods:
+        add() : Queue the result of a frame.
+        frames() : Return a page of frame records.
+        counts() : Return detection counts per time bucket or per class.
+        stats() : Return the record counters.
+        close() : Insert the queued records and stop the writer thread.
+    """
+    def __init__(self, path: str, flush_interval: float = 1., batch_size: int = 500,
+                 queue_size: int = 10000, max_cameras: int = 1000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_cameras = max_cameras
+        self.stored = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._last_timestamps: "OrderedDict[str, float]" = OrderedDict()
+        self._timestamps_lock = threading.Lock()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return the connection of the calling thread, creating the database on first use."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA + "".join(ROLLUP_SCHEMA.format(unit=unit) for unit in ROLLUPS))
+            self._local.connection = connection
+        return connection
+
+    def add(self, camera: str, timestamp: float, detections: np.ndarray, detection_time: Optional[float] = None,
+            queue_wait: Optional[float] = None, batch_size: Optional[int] = None) -> bool:
+        """Queue the result of a frame.
+
+        Frames not newer than the last one of the camera, e.g. the same frame
+        sent by another client of the camera, are ignored. A camera not seen
+        among the last `max_cameras` ones has no last frame.
+
+        Args:
+            camera: Name of the camera.
+            timestamp: time.time() at which the frame was captured.
+            detections: The (N, 6) detections of the frame.
+            detection_time: Seconds the detection took.
+            queue_wait: Seconds the frame waited for its inference batch.
+            batch_size: Size of the inference batch.
+
+        Returns:
+            True if the record was queued.
+        """
+        with self._timestamps_lock:
+            if timestamp <= self._last_timestamps.get(camera, 0.):
+                return False
+            self._last_timestamps[camera] = timestamp
+            self._last_timestamps.move_to_end(camera)
+            if len(self._last_timestamps) > self.max_cameras:
+                self._last_timestamps.popitem(last=False)
+
+        detections = np.asarray(detections, dtype=np.float32).reshape(-1, 6)
+        try:
+            self._queue.put_nowait((camera, timestamp, detections, detection_time, queue_wait, batch_size))
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="HistoryStore", daemon=True)
+                    self._thread.start()
+        return True
+
+    def _run(self) -> None:
+        """Writer loop inserting batches of records until a None sentinel is received."""
+        connection = self._connect()
+        stopped = False
+        while not stopped:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0., deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopped = True
+                    break
+                batch.append(item)
+
+            if batch:
+                try:
+                    with stage_seconds.time("history"):
+                        self._insert(connection, batch)
+                    self.stored += len(batch)
+                except sqlite3.Error as e:
+                    logger.error(f"Could not store {len(batch)} history records: {e}")
+
+    def _insert(self, connection: sqlite3.Connection, batch: list) -> None:
+        """Insert records and update the rollups in one transaction."""
+        frames = []
+        counts = {unit: Counter() for unit in ROLLUPS}
+        classes = {unit: Counter() for unit in ROLLUPS}
+        for camera, timestamp, detections, detection_time, queue_wait, batch_size in batch:
+            frames.append((camera, timestamp, len(detections), detection_time, queue_wait, batch_size,
+                           detections.tobytes()))
+            class_counts = zip(*np.unique(detections[:, 5].astype(np.int64), return_counts=True))
+            for class_id, count in class_counts:
+                for unit, seconds in ROLLUPS.items():
+                    classes[unit][camera, int(timestamp // seconds), int(class_id)] += int(count)
+            for unit, seconds in ROLLUPS.items():
+                counts[unit][camera, int(timestamp // seconds)] += np.array([1, len(detections)])
+
+        with connection:
+            connection.executemany(
+                "INSERT INTO frames (camera, ts, detections, detection_time, queue_wait, batch_size, boxes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", frames)
+            for unit in ROLLUPS:
+                connection.executemany(
+                    f"INSERT INTO {unit}_counts (camera, {unit}, frames, detections) VALUES (?, ?, ?, ?) "
+                    f"ON CONFLICT (camera, {unit}) DO UPDATE SET "
+                    "frames = frames + excluded.frames, detections = detections + excluded.detections",
+                    [(*key, int(n_frames), int(n_detections))
+                     for key, (n_frames, n_detections) in counts[unit].items()])
+                connection.executemany(
+                    f"INSERT INTO {unit}_classes (camera, {unit}, class_id, detections) VALUES (?, ?, ?, ?) "
+                    f"ON CONFLICT (camera, {unit}, class_id) DO UPDATE SET "
+                    "detections = detections + excluded.detections",
+                    [(*key, count) for key, count in classes[unit].items()])
+
+    def frames(self, camera: Optional[str] = None, start: Optional[float] = None, end: Optional[float] = None,
+               after: Optional[Tuple[float, int]] = None, limit: int = 100) -> List[dict]:
+        """Return a page of frame records, oldest first.
+
+        Pages are read by keyset on (timestamp, id) along the time indexes, so
+        a page costs the same at the end of a month as at its start.
+
+        Args:
+            camera: Only frames of this camera, None for all cameras.
+            start: Only frames captured at or after this time.
+            end: Only frames captured before this time.
+            after: The `timestamp` and `id` of the last frame of the previous page.
+            limit: Maximum number of frames.
+
+        Returns:
+            The frames, each with its boxes as rows of xmin, ymin, xmax, ymax,
+            score and class id.
+        """
+        where, params = self._where(camera, start, end, "ts")
+        if after is not None:
+            where.append("(ts, id) > (?, ?)")
+            params.extend(after)
+        rows = self._connect().execute(
+            "SELECT id, camera, ts, detections, detection_time, queue_wait, batch_size, boxes FROM frames "
+            f"WHERE {' AND '.join(where) or '1'} ORDER BY ts, id LIMIT ?", params + [limit]).fetchall()
+        return [{
+            "id": id_, "camera": camera_, "timestamp": ts, "detections": count,
+            "detection_time": detection_time, "queue_wait": queue_wait, "batch_size": batch_size,
+            "boxes": np.frombuffer(boxes, dtype=np.float32).reshape(-1, 6).tolist(),
+        } for id_, camera_, ts, count, detection_time, queue_wait, batch_size, boxes in rows]
+
+    def counts(self, by: str = "time", camera: Optional[str] = None, start: Optional[float] = None,
+               end: Optional[float] = None, bucket: int = 60) -> List[dict]:
+        """Return frame and detection counts from the rollups.
+
+        Time buckets are read from the coarsest rollup dividing them. Class
+        counts are summed over the whole days of the range, then the hours and
+        minutes left at both ends, so a month is a few hundred rows per camera.
+
+        Args:
+            by: "time" for frames and detections per camera and time bucket,
+                "class" for detections per camera and class.
+            camera: Only this camera, None for all cameras.
+            start: Start of the range, rounded down to the minute (to the
+                bucket for "time").
+            end: End of the range, rounded up to the minute (to the bucket for
+                "time").
+            bucket: Seconds per time bucket, rounded to whole minutes.
+
+        Returns:
+            One dict per camera and time bucket (with its start as
+            `timestamp`), or per camera and class.
+        """
+        connection = self._connect()
+
+        if by == "class":
+            start = int(start // 60) if start is not None else None
+            end = -int(-end // 60) if end is not None else None
+            totals = Counter()
+            for unit, part_start, part_end in self._spans(start, end):
+                where, params = self._where(camera, part_start, part_end, unit)
+                rows = connection.execute(
+                    f"SELECT camera, class_id, SUM(detections) FROM {unit}_classes "
+                    f"WHERE {' AND '.join(where) or '1'} GROUP BY camera, class_id", params)
+                for camera_, class_id, detections in rows:
+                    totals[camera_, class_id] += detections
+            return [{"camera": camera_, "class_id": class_id, "detections": totals[camera_, class_id]}
+                    for camera_, class_id in sorted(totals)]
+
+        bucket = max(1, round(bucket / 60)) * 60
+        unit = next(unit for unit, seconds in reversed(ROLLUPS.items()) if bucket % seconds == 0)
+        per_bucket = bucket // ROLLUPS[unit]
+        start = int(start // bucket) * per_bucket if start is not None else None
+        end = -int(-end // bucket) * per_bucket if end is not None else None
+        where, params = self._where(camera, start, end, unit)
+        rows = connection.execute(
+            f"SELECT camera, {unit} / ? AS bucket, SUM(frames), SUM(detections) FROM {unit}_counts "
+            f"WHERE {' AND '.join(where) or '1'} GROUP BY camera, bucket ORDER BY camera, bucket",
+            [per_bucket] + params).fetchall()
+        return [{"camera": camera_, "timestamp": bucket_ * bucket, "frames": frames, "detections": detections}
+                for camera_, bucket_, frames, detections in rows]
+
+    @staticmethod
+    def _spans(start: Optional[int], end: Optional[int], units: Optional[list] = None) -> List[tuple]:
+        """Split a range of minutes into whole buckets of the coarsest rollups.
+
+        Returns:
+            (unit, start, end) tuples, start and end counted in the unit and
+            None for an open end.
+        """
+        units = units or [unit for unit in reversed(ROLLUPS)]
+        unit, size = units[0], ROLLUPS[units[0]] // 60
+        if len(units) == 1:
+            return [(unit, start, end)] if start is None or end is None or start < end else []
+        first = -(-start // size) if start is not None else None
+        last = end // size if end is not None else None
+        if first is not None and last is not None and first >= last:
+            return HistoryStore._spans(start, end, units[1:])
+        spans = [(unit, first, last)]
+        if start is not None:
+            spans += HistoryStore._spans(start, first * size, units[1:])
+        if end is not None:
+            spans += HistoryStore._spans(last * size, end, units[1:])
+        return spans
+
+    @staticmethod
+    def _where(camera: Optional[str], start, end, column: str):
+        """Build the conditions of a camera and time range query."""
+        where, params = [], []
+        if camera is not None:
+            where.append("camera = ?")
+            params.append(camera)
+        if start is not None:
+            where.append(f"{column} >= ?")
+            params.append(start)
+        if end is not None:
+            where.append(f"{column} < ?")
+            params.append(end)
+        return where, params
+
+    def stats(self) -> dict:
+        """Return the stored, dropped and pending record counters."""
+        return {"stored": self.stored, "dropped": self.dropped, "pending": self._queue.qsize()}
+
+    def close(self, timeout: Optional[float] = 10.) -> None:
+        """Insert the queued records and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+history_store = HistoryStore(config.HISTORY_DB, config.HISTORY_FLUSH_INTERVAL, config.HISTORY_BATCH_SIZE,
+                             config.HISTORY_QUEUE_SIZE, config.HISTORY_MAX_CAMERAS)
@@ -1,22 +1,174 @@
+import atexit
+import copy
+import json
 import os
 import logging
-from logging.handlers import TimedRotatingFileHandler
-from config.config import TEMP_LOG_OUT
+import queue
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Dict, Optional, Tuple
+
+from config import config
+from util.metrics import MetricFamily, metrics
+
+# attributes of every LogRecord, the others come from `extra` and are written as fields
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sample"}
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional["DroppingQueueHandler"] = None
+_rate_limit: Optional["RateLimitFilter"] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as JSON lines.
+
+    The `extra` fields of a record are written next to the standard ones, so
+    `logger.warning("Stream reconnecting", extra={"stream": url})` can be
+    filtered on `stream` without parsing the message.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).astimezone().isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+            "source": f"{record.module}:{record.lineno}",
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Rate limit and sample records per call site.
+
+    Each call site (file and line) has a token bucket of `burst` records
+    refilled at `rate` records per second, so a flapping camera or a hot
+    endpoint cannot flood the log. A record with a `sample` extra field (a
+    fraction between 0 and 1) is furthermore kept only once every 1/sample
+    calls. The next record kept from a call site carries the number of
+    records dropped before it in a `suppressed` field.
+
+    Attributes:
+        rate : records per second allowed per call site
+        burst : records allowed at once per call site
+        suppressed : total number of records dropped
+    """
+    def __init__(self, rate: float, burst: int):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.suppressed = 0
+        # call site -> [tokens, last refill, calls, suppressed since the last kept record]
+        self._sites: Dict[Tuple[str, int], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        now = time.monotonic()
+        sample = getattr(record, "sample", None)
+        with self._lock:
+            site = self._sites.get((record.pathname, record.lineno))
+            if site is None:
+                site = self._sites[(record.pathname, record.lineno)] = [float(self.burst), now, 0, 0]
+            site[2] += 1
+            if sample is not None and int(site[2] * sample) == int((site[2] - 1) * sample):
+                return False
+            site[0] = min(float(self.burst), site[0] + (now - site[1]) * self.rate)
+            site[1] = now
+            if site[0] < 1:
+                site[3] += 1
+                self.suppressed += 1
+                return False
+            site[0] -= 1
+            if site[3]:
+                record.suppressed = site[3]
+                site[3] = 0
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """A QueueHandler dropping records when the queue is full instead of blocking or raising.
+
+    Attributes:
+        dropped : number of records dropped on a full queue
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Merge the arguments into the message and render the traceback, keeping the `extra` fields."""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
 
 def setup_logging(log_dir):
-    path = os.path.join(TEMP_LOG_OUT, log_dir)
-    os.makedirs(path, exist_ok=True)
+    """Log to a daily rotated JSON lines file through a queue.
+
+    Logging calls only filter the record and put it on a bounded queue;
+    formatting and file I/O happen on a QueueListener thread, so request and
+    stream threads never wait for the disk. Records over the per call site
+    rate limit or beyond a full queue are dropped.
+
+    Args:
+        log_dir: Directory of the log file under TEMP_LOG_OUT.
+
+    Returns:
+        The root logger.
+    """
+    global _listener, _queue_handler, _rate_limit
 
-    log_formatter = logging.Formatter('%(asctime)s [%(levelname)s] - %(message)s', datefmt='%Y-%m-%dT%H:%M:%S%z')
+    logger = logging.getLogger()
+    if _listener is not None:
+        return logger
+
+    path = os.path.join(config.TEMP_LOG_OUT, log_dir)
+    os.makedirs(path, exist_ok=True)
 
     log_handler = TimedRotatingFileHandler(
         filename=os.path.join(path, 'app.log'),
         when='midnight', interval=1, backupCount=7
     )
-    log_handler.setFormatter(log_formatter)
+    log_handler.setFormatter(JsonFormatter())
 
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    logger.addHandler(log_handler)
+    _rate_limit = RateLimitFilter(config.LOG_RATE, config.LOG_BURST)
+    _queue_handler = DroppingQueueHandler(queue.Queue(config.LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(_rate_limit)
+    _listener = QueueListener(_queue_handler.queue, log_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    logger.setLevel(config.LOG_LEVEL)
+    logger.addHandler(_queue_handler)
 
     return logger
+
+
+@metrics.collector
+def logging_metrics():
+    if _queue_handler is None:
+        return
+    yield MetricFamily("log_queue_depth", "gauge", "Log records waiting to be written",
+                       [({}, _queue_handler.queue.qsize())])
+    yield MetricFamily("log_records_dropped_total", "counter", "Log records dropped",
+                       [({"reason": "rate_limit"}, _rate_limit.suppressed),
+                        ({"reason": "queue_full"}, _queue_handler.dropped)])
@@ -0,0 +1,191 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+logger = logging.getLogger("core")
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4"
+LABEL_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+# seconds, from sub-millisecond preprocessing to multi-second CPU inference
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+
+class MetricFamily(NamedTuple):
+    """A metric as returned by collectors.
+
+    Attributes:
+        name : metric name
+        kind : "counter" or "gauge"
+        documentation : help text
+        samples : (labels, value) pairs
+    """
+    name: str
+    kind: str
+    documentation: str
+    samples: List[Tuple[Dict[str, str], float]]
+
+
+class Histogram:
+    """A Prometheus histogram whose observations take no lock.
+
+    Each thread observes into a shard of its own, registered once under a lock
+    on its first observation; shards are only merged when the metrics are
+    rendered, so threads never contend while observing. A render may miss an
+    observation in progress, which the next scrape includes.
+
+    Attributes:
+        name : metric name
+        documentation : help text
+        labelnames : names of the labels, their values are passed to observe()
+        buckets : upper bounds of the buckets, +Inf is added
+
+    Methods:
+        observe() : Record a value.
+        time() : Context manager recording the seconds its block took.
+    """
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def observe(self, value: float, *labels: str) -> None:
+        """Record a value with the given label values."""
+        shard = self._shard()
+        values = shard.get(labels)
+        if values is None:
+            # one count per bucket and +Inf, then the sum
+            values = shard[labels] = [0] * (len(self.buckets) + 1) + [0.]
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        """Record the seconds the block took with the given label values."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def collect(self) -> Dict[tuple, list]:
+        """Return the bucket counts and sum per label values, merged over all threads."""
+        with self._lock:
+            shards = list(self._shards)
+        merged = {}
+        for shard in shards:
+            for labels, values in list(shard.items()):
+                total = merged.get(labels)
+                if total is None:
+                    merged[labels] = list(values)
+                else:
+                    for i, value in enumerate(values):
+                        total[i] += value
+        return merged
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, values in sorted(self.collect().items()):
+            base = dict(zip(self.labelnames, labels))
+            count = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), values):
+                count += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels({**base, 'le': format_value(bound)})} {count}")
+            lines.append(f"{self.name}_sum{format_labels(base)} {format_value(values[-1])}")
+            lines.append(f"{self.name}_count{format_labels(base)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """The metrics rendered by the /metrics endpoint.
+
+    Histograms are updated on the hot path. Everything else (frame rates,
+    queue depths, drop counters) already lives in the objects that own it and
+    is read by collectors, functions called on each scrape and returning
+    MetricFamily tuples, so it costs nothing between scrapes.
+
+    Methods:
+        histogram() : Create and register a Histogram.
+        collector() : Register a collector function, usable as a decorator.
+        render() : Return all metrics in the Prometheus text format.
+    """
+    def __init__(self):
+        self._histograms: List[Histogram] = []
+        self._collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        histogram = Histogram(name, documentation, labelnames, buckets)
+        self._histograms.append(histogram)
+        return histogram
+
+    def collector(self, func: Callable[[], Iterable[MetricFamily]]) -> Callable[[], Iterable[MetricFamily]]:
+        self._collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for histogram in self._histograms:
+            lines.extend(histogram.render())
+        for collect in self._collectors:
+            try:
+                families = list(collect())
+            except Exception as e:
+                logger.error(f"Metrics collector {collect.__name__} failed: {e}")
+                continue
+            for family in families:
+                lines.append(f"# HELP {family.name} {family.documentation}")
+                lines.append(f"# TYPE {family.name} {family.kind}")
+                for labels, value in family.samples:
+                    lines.append(f"{family.name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    """Format labels as {name="value",...}, escaping the values."""
+    if not labels:
+        return ""
+    escaped = (f'{name}="{str(value).translate(LABEL_ESCAPES)}"' for name, value in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+def format_value(value: float) -> str:
+    """Format a sample value, e.g. +Inf for an infinite bucket bound."""
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram(
+    "cv_stage_seconds",
+    "Seconds per processing stage; preprocess, inference and postprocess are per batch",
+    ("stage",))
+
+batch_sizes = metrics.histogram(
+    "cv_batch_size", "Frames per inference batch", buckets=(1, 2, 4, 8, 16, 32, 64))
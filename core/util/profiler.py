@@ -0,0 +1,126 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType
+from typing import Dict, List, Optional, Set
+
+# innermost frames of threads waiting for work, skipped unless idle stacks are asked for
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+}
+
+
+def current_stacks(skip: Set[int], idle: bool = False, labels: Optional[Dict[CodeType, str]] = None) -> List[str]:
+    """Read the Python stack of each thread of the process once.
+
+    Args:
+        skip: Idents of the threads not to read, e.g. the sampling one.
+        idle: Also read the stacks of threads waiting for work.
+        labels: Frame labels by code object, reused across samples.
+
+    Returns:
+        The collapsed stacks, "thread;outer;...;inner".
+    """
+    if labels is None:
+        labels = {}
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks = []
+    for ident, frame in sys._current_frames().items():
+        if ident in skip:
+            continue
+        code = frame.f_code
+        if not idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+            continue
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            label = labels.get(code)
+            if label is None:
+                label = labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            stack.append(label)
+            frame = frame.f_back
+        stack.append(names.get(ident, str(ident)).replace(";", ":"))
+        stacks.append(";".join(reversed(stack)))
+    return stacks
+
+
+def sample_stacks(seconds: float, interval: float = 0.005, idle: bool = False) -> str:
+    """Sample the Python stacks of all threads of the process for a while.
+
+    Every `interval` seconds the current frame of each thread is read with
+    `sys._current_frames()` and its stack counted, so the cost on the profiled
+    threads is a short GIL hold per sample whatever the code does.
+
+    Args:
+        seconds: How long to sample.
+        interval: Seconds between two samples.
+        idle: Also count the stacks of threads waiting for work.
+
+    Returns:
+        The collapsed stacks, one "thread;outer;...;inner count" line per
+        stack, as read by flamegraph.pl, speedscope or inferno.
+    """
+    own = {threading.get_ident()}
+    labels = {}
+    counts = Counter()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        counts.update(current_stacks(own, idle, labels))
+        time.sleep(interval)
+
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+class StackSampler:
+    """Sample the stacks of the process into counters while they are attached.
+
+    A single daemon thread reads the non-idle stacks of all threads every
+    `interval` seconds and counts them in each attached counter; it runs only
+    while a counter is attached. Stacks are those of the whole process, so
+    the samples of a request also hold the work of the requests and streams
+    running at the same time.
+
+    Attributes:
+        interval : seconds between two samples
+
+    Methods:
+        attach() : Start counting the samples in a counter.
+        detach() : Stop counting the samples in a counter.
+    """
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._counters: Dict[int, Counter] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def attach(self, counts: Counter) -> None:
+        with self._lock:
+            self._counters[id(counts)] = counts
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+
+    def detach(self, counts: Counter) -> None:
+        """Stop counting in `counts`; no sample is added to it once this returns."""
+        with self._lock:
+            self._counters.pop(id(counts), None)
+
+    def _run(self) -> None:
+        own = {threading.get_ident()}
+        labels = {}
+        while True:
+            stacks = current_stacks(own, labels=labels)
+            with self._lock:
+                if not self._counters:
+                    self._thread = None
+                    return
+                for counts in self._counters.values():
+                    counts.update(stacks)
+            time.sleep(self.interval)
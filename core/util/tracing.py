@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from util.profiler import StackSampler
+
+logger = logging.getLogger("core")
+
+current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """The spans and stack samples of one request.
+
+    Spans are (name, start, duration) in seconds from the start of the request.
+    The trace is shared by the coroutines and threadpool calls of the request
+    through `current_trace`, so spans can be added from anywhere in it.
+    Stacks are the collapsed stacks of the process sampled while the request
+    ran, by number of samples.
+
+    Attributes:
+        method : HTTP method
+        path : request path
+        query : query string
+        status : response status code, None until the response starts
+        started : time.time() at which the request started
+        spans : the recorded spans
+        stacks : the sampled stacks
+    """
+    def __init__(self, method: str, path: str, query: str = ""):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.status = None
+        self.started = time.time()
+        self.spans: List[tuple] = []
+        self.stacks = Counter()
+        self._start = time.perf_counter()
+
+    def add(self, name: str, start: float, duration: float) -> None:
+        """Add a span starting at time.perf_counter() value `start`."""
+        self.spans.append((name, start - self._start, duration))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def as_dict(self) -> dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "query": self.query,
+            "status": self.status,
+            "started": datetime.fromtimestamp(self.started).isoformat(),
+            "duration": self.elapsed(),
+            "spans": [{"name": name, "start": start, "duration": duration}
+                      for name, start, duration in sorted(self.spans, key=lambda s: s[1])],
+            "stacks": dict(self.stacks.most_common()),
+        }
+
+
+@contextmanager
+def span(name: str):
+    """Record the block as a span of the current request, if it is traced."""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter() - start)
+
+
+def add_span(name: str, start: float, duration: float) -> None:
+    """Add a span measured elsewhere, e.g. by the batcher, to the current request if it is traced."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, start, duration)
+
+
+class TraceMiddleware:
+    """An ASGI middleware tracing requests and writing down the slow ones.
+
+    Requests to the traced paths get a Trace in `current_trace`. The
+    middleware itself adds an "upload" span for receiving the body and a
+    "send" span for sending the response, and route code adds its own with
+    `span()`. With a `sample_interval`, the stacks of the process are also
+    sampled while traced requests run, so the time of a slow request spent
+    outside any span (or inside one, e.g. waiting for the GIL) can be
+    attributed. Requests slower than the threshold of their path are written
+    as JSON to `directory`, of which the `max_files` newest are kept.
+
+    Attributes:
+        thresholds : seconds from which a request is slow, by request path
+        directory : directory of the slow request files
+        max_files : number of slow request files kept
+        sampler : StackSampler of the traced requests, None if they are not sampled
+    """
+    def __init__(self, app, thresholds: Dict[str, float], directory: str, max_files: int = 1000,
+                 sample_interval: Optional[float] = None):
+        self.app = app
+        self.thresholds = thresholds
+        self.directory = directory
+        self.max_files = max_files
+        self.sampler = StackSampler(sample_interval) if sample_interval else None
+
+    async def __call__(self, scope, receive, send):
+        threshold = self.thresholds.get(scope["path"]) if scope["type"] == "http" else None
+        if threshold is None:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(scope["method"], scope["path"], scope.get("query_string", b"").decode("latin-1"))
+        token = current_trace.set(trace)
+        if self.sampler is not None:
+            self.sampler.attach(trace.stacks)
+        upload_start = send_start = None
+
+        async def traced_receive():
+            nonlocal upload_start
+            if upload_start is None:
+                upload_start = time.perf_counter()
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                trace.add("upload", upload_start, time.perf_counter() - upload_start)
+            return message
+
+        async def traced_send(message):
+            nonlocal send_start
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+                send_start = time.perf_counter()
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                trace.add("send", send_start, time.perf_counter() - send_start)
+
+        try:
+            await self.app(scope, traced_receive, traced_send)
+        finally:
+            current_trace.reset(token)
+            if self.sampler is not None:
+                self.sampler.detach(trace.stacks)
+            if trace.elapsed() > threshold:
+                await run_in_threadpool(self._write, trace)
+
+    def _write(self, trace: Trace) -> None:
+        """Write a slow request to its own file and delete the oldest files over `max_files`."""
+        record = trace.as_dict()
+        logger.warning(f"Slow request {trace.method} {trace.path}: {record['duration']:.3f}s")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            name = f"{datetime.fromtimestamp(trace.started):%Y%m%dT%H%M%S%f}_{trace.path.strip('/').replace('/', '_')}.json"
+            with open(os.path.join(self.directory, name), "w") as f:
+                json.dump(record, f, indent=2)
+
+            files = sorted(os.listdir(self.directory))
+            for old in files[:max(0, len(files) - self.max_files)]:
+                os.remove(os.path.join(self.directory, old))
+        except OSError as e:
+            logger.error(f"Could not write slow request trace: {e}")
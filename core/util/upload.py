@@ -0,0 +1,49 @@
+from typing import Dict
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+
+class UploadLimitMiddleware:
+    """An ASGI middleware rejecting request bodies above a per path size limit.
+
+    A request announcing a larger Content-Length is answered with 413 before
+    its body is received. Bodies without a length (chunked uploads) are counted
+    while they are received, and reading past the limit raises a 413
+    HTTPException in the route parsing the body.
+
+    Attributes:
+        limits : maximum body size in bytes by request path
+    """
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        try:
+            length = int(headers.get(b"content-length", 0))
+        except ValueError:
+            length = 0
+        if length > limit:
+            response = JSONResponse({"detail": f"Upload larger than {limit} bytes"}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=f"Upload larger than {limit} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,143 @@
+import logging
+import os
+import threading
+from collections import defaultdict, deque
+from typing import Hashable, Optional
+
+import numpy as np
+
+from util.helper import draw_detections, save_image
+from util.metrics import stage_seconds
+
+logger = logging.getLogger("core")
+
+
+class OutputWriter:
+    """A background service saving annotated images off the request path.
+
+    `submit` only queues the image; a writer thread draws the detections and
+    writes the files in batches of up to `batch_size`. The queue is bounded:
+    when it is full, a newer image replaces the last one still pending for
+    the same key (e.g. a camera), so a stream keeps its latest frame, and
+    images of other keys are dropped. Inference never waits for the disk.
+
+    Attributes:
+        queue_size : maximum number of pending images
+        image_format : "jpeg" or "webp"
+        quality : encoding quality (1-100)
+        every_n : only every n-th image of each key is saved
+        only_detections : only save images with at least one detection
+        batch_size : maximum number of images written per wake-up
+        written : number of images written
+        dropped : number of images dropped because the queue was full
+        coalesced : number of pending images replaced by a newer one of their key
+
+    Methods:
+        submit() : Queue an image to be saved.
+        stats() : Return the counters.
+        close() : Write the pending images and stop the writer thread.
+    """
+    def __init__(self, queue_size: int = 64, image_format: str = "jpeg", quality: int = 90,
+                 every_n: int = 1, only_detections: bool = False, batch_size: int = 8):
+        self.queue_size = queue_size
+        self.image_format = image_format
+        self.quality = quality
+        self.every_n = every_n
+        self.only_detections = only_detections
+        self.batch_size = batch_size
+        self.written = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+        self._pending = deque()
+        self._counts = defaultdict(int)
+        self._directories = set()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def submit(self, np_img: np.ndarray, output: str, source_name: str,
+               detections: Optional[np.ndarray] = None, key: Optional[Hashable] = None) -> bool:
+        """Queue an image to be saved, annotated with its detections.
+
+        The image must not be modified afterwards.
+
+        Args:
+            np_img: The RGB image.
+            output: Path to the output directory.
+            source_name: Name of the file, without extension.
+            detections: Optional (N, 6) detections to draw.
+            key: Sampling and coalescing key, `output` by default.
+
+        Returns:
+            True if the image was queued.
+        """
+        key = output if key is None else key
+        if self.only_detections and (detections is None or len(detections) == 0):
+            return False
+
+        with self._condition:
+            if self._closed:
+                return False
+            count = self._counts[key]
+            self._counts[key] = count + 1
+            if count % self.every_n:
+                return False
+
+            item = (np_img, output, source_name, detections)
+            if len(self._pending) >= self.queue_size:
+                for entry in reversed(self._pending):
+                    if entry[0] == key:
+                        entry[1] = item
+                        self.coalesced += 1
+                        return True
+                self.dropped += 1
+                return False
+
+            self._pending.append([key, item])
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="OutputWriter", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return True
+
+    def _run(self) -> None:
+        """Writer loop taking batches of pending images until closed."""
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                batch = [self._pending.popleft()[1] for _ in range(min(self.batch_size, len(self._pending)))]
+
+            for np_img, output, source_name, detections in batch:
+                try:
+                    with stage_seconds.time("save"):
+                        self._write(np_img, output, source_name, detections)
+                except Exception as e:
+                    logger.error(f"Could not save {source_name} to {output}: {e}")
+
+    def _write(self, np_img: np.ndarray, output: str, source_name: str,
+               detections: Optional[np.ndarray]) -> None:
+        if output not in self._directories:
+            os.makedirs(output, exist_ok=True)
+            self._directories.add(output)
+        if detections is not None:
+            np_img = draw_detections(np_img, detections)
+        save_image(np_img, output, source_name, self.image_format, self.quality)
+        self.written += 1
+
+    def stats(self) -> dict:
+        """Return the written, dropped and coalesced counters and the queue length."""
+        with self._condition:
+            return {"written": self.written, "dropped": self.dropped, "coalesced": self.coalesced,
+                    "pending": len(self._pending)}
+
+    def close(self, timeout: Optional[float] = 10.) -> None:
+        """Write the pending images and stop the writer thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)